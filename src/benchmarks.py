@@ -0,0 +1,603 @@
+# Developed By Keagan Bowman
+# Micro-benchmarks for the transmitter/receiver hot paths.
+# Run from the project root, ie: python src/benchmarks.py qr
+#
+# benchmarks.py
+from __future__ import annotations
+
+import sys
+import json
+import time
+import random
+
+
+def _sample_payloads(count: int) -> list[str]:
+    """
+    Builds telemetry payloads shaped like the ones the transmitter sends
+    :param count: number of payloads to build
+    :return: list of JSON payloads
+    """
+    payloads = []
+
+    for i in range(count):
+        telemetry = [
+            1 + i % 2,  # device ID
+            random.randint(-1000, 1000), random.randint(-1000, 1000), random.randint(-1000, 1000),  # acceleration
+            random.randint(-2000, 2000),  # velocity
+            random.randint(0, 30000),  # altitude
+            random.randint(0, 900), random.randint(-1800, 1800),  # tilt, roll
+            f"15:{i // 60 % 60:02}:{i % 60:02}.{random.randint(0, 999):03}",  # time
+            random.randint(3000, 4200),  # battery
+            random.randint(1500, 4000),  # temperature
+            30,  # fps
+            i,  # transmission id
+        ]
+
+        payloads.append(json.dumps(telemetry))
+
+    return payloads
+
+
+def _report(name: str, seconds: float, iterations: int) -> float:
+    per_frame = seconds / iterations * 1000
+    print(f"{name:<40} {per_frame:8.3f} ms/frame {iterations / seconds:10.1f} frames/s")
+
+    return per_frame
+
+
+def benchmark_qr_render(iterations: int = 300) -> None:
+    """
+    Compares the per-frame cost of building a QR image with qrcode + PIL against the fixed-template renderer
+    :param iterations: number of frames to render with each method
+    """
+    import cv2
+    import qrcode
+    import numpy as np
+    import qr_renderer
+
+    payloads = _sample_payloads(iterations)
+
+    # previous transmitter path
+    qr = qrcode.main.QRCode(
+        version=13,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=4,
+        border=1,
+    )
+
+    start = time.perf_counter()
+    for payload in payloads:
+        qr.clear()
+        qr.add_data(payload)
+        qr.make()
+        qr_img = qr.make_image()
+        qr_img = np.array(qr_img, dtype=np.uint8) * 255
+        cv2.cvtColor(qr_img, cv2.COLOR_GRAY2RGB)
+    before = _report("qrcode + PIL (all masks)", time.perf_counter() - start, iterations)
+
+    # fixed-template renderer
+    renderer = qr_renderer.QRRenderer(version=13, error_correction='H', mask_pattern=0, box_size=4, border=1)
+
+    start = time.perf_counter()
+    for payload in payloads:
+        renderer.render(payload)
+    after = _report("qr_renderer (fixed template, mask 0)", time.perf_counter() - start, iterations)
+
+    print(f"speedup: {before / after:.1f}x")
+
+
+def benchmark_qr_cache(seconds: int = 20, fps: int = 30, raven_period: float = 0.22,
+                       frames_per_controller: int = 2) -> None:
+    """
+    Replays the transmitter's controller rotation against a payload-keyed QR cache, with each controller replaying
+    one of ./simulations/*.dat and producing new telemetry every raven_period seconds
+    :param seconds: length of the simulated transmission
+    :param fps: simulated transmitter frame rate
+    :param raven_period: time between new Blue Raven telemetry lines
+    :param frames_per_controller: frames sent for a controller before switching to the next one
+    """
+    import glob
+    import qr_renderer
+    import telemetry_codec
+    import telemetry_parser
+
+    renderer = qr_renderer.QRRenderer(version=13, error_correction='H', mask_pattern=0, box_size=4, border=1)
+
+    # status records of each simulation, in the order they were sent
+    simulations = []
+    for sim_file in sorted(glob.glob("./simulations/*.dat")):
+        parser = telemetry_parser.StatusParser(require_crc=False)
+
+        with open(sim_file, "rb") as file:
+            simulations.append([record for record in map(parser.parse, file) if record is not None])
+
+    for controllers in (2, 4):
+        # each controller replays a simulation as its own device, so its telemetry lists are built once, like
+        # get_telemetry's
+        telemetry = [[record.to_list(controller + 1) for record in simulations[controller % len(simulations)]]
+                     for controller in range(controllers)]
+
+        # payloads are encoded every frame, as the transmitter does (one controller per frame, no keyframes), so a
+        # payload only changes with the controller's telemetry
+        encoder = telemetry_codec.TelemetryEncoder()
+        cache = qr_renderer.QRCache(renderer, max_size=32)
+
+        start = time.perf_counter()
+        for frame in range(seconds * fps):
+            controller = frame // frames_per_controller % controllers
+            update = int(frame / fps / raven_period)
+
+            payload, _ = encoder.encode([telemetry[controller][update % len(telemetry[controller])]])
+            cache.get(payload)
+        elapsed = time.perf_counter() - start
+
+        print(f"{controllers} controllers @ {fps} fps: {cache.stats()}")
+        print(f"    {elapsed / seconds * 1000:.1f} ms of QR work per second of video, "
+              f"{cache.saved_seconds / seconds * 1000:.1f} ms/s saved")
+
+
+def benchmark_db_latest(rows: int = 1_000_000, devices: int = 2, queries: int = 1000) -> None:
+    """
+    Compares latest-row lookups after logging a flight's worth of rows: sorting the data table (the previous query
+    without an index), walking the (device, time) index, and reading the device_latest table. Runs against the
+    database in ./.creds, inside a scratch schema that is dropped afterwards.
+    :param rows: number of data rows to insert
+    :param devices: number of devices the rows are spread across
+    :param queries: number of lookups to time for the indexed queries
+    """
+    import db_handler
+
+    db = db_handler.establish_db()
+    cursor = db.cursor()
+
+    # build the schema in a scratch namespace
+    cursor.execute("DROP SCHEMA IF EXISTS benchmark CASCADE;")
+    cursor.execute("CREATE SCHEMA benchmark;")
+    cursor.execute("SET search_path TO benchmark;")
+    db_handler.create_schema(db)
+
+    def time_query(name: str, query: str, count: int) -> None:
+        start = time.perf_counter()
+        for i in range(count):
+            cursor.execute(query, (1 + i % devices,))
+            cursor.fetchone()
+        elapsed = time.perf_counter() - start
+
+        print(f"{name:<40} {elapsed / count * 1000:8.3f} ms/query")
+
+    try:
+        cursor.execute("INSERT INTO devices (port) SELECT 'BENCHMARK-' || i FROM generate_series(1, %s) i;",
+                       (devices,))
+
+        # insert through the device_latest trigger, like the telemetry threads do
+        start = time.perf_counter()
+        cursor.execute("""
+        INSERT INTO data (device, data, time, device_time, altitude)
+        SELECT 1 + i %% %s, 'BLR_STAT ' || i, TIMESTAMP '2024-10-05 15:00:00' + i * INTERVAL '1 millisecond',
+        TIME '15:00:00' + i * INTERVAL '1 millisecond', i
+        FROM generate_series(1, %s) i;
+        """, (devices, rows))
+        db.commit()
+        print(f"inserted {rows} rows in {time.perf_counter() - start:.1f} s")
+
+        cursor.execute("ANALYZE data;")
+
+        latest = "SELECT data FROM data WHERE device = %s ORDER BY time DESC LIMIT 1;"
+
+        time_query("ORDER BY time DESC LIMIT 1 (indexed)", latest, queries)
+        time_query("device_latest lookup", "SELECT d.data FROM device_latest l JOIN data d ON d.id = l.data_id "
+                                           "WHERE l.device = %s;", queries)
+
+        # previous schema, without the index (rolled back afterwards)
+        cursor.execute("DROP INDEX data_device_time_idx;")
+        time_query("ORDER BY time DESC LIMIT 1 (no index)", latest, max(queries // 100, 5))
+        db.rollback()
+    finally:
+        db.rollback()
+        cursor.execute("DROP SCHEMA IF EXISTS benchmark CASCADE;")
+        db.commit()
+        db.close()
+
+
+def benchmark_db_ingest(lines: int = 5000, devices: int = 2) -> None:
+    """
+    Compares inserting telemetry lines with a transaction per line (db_handler.add_data) against the batched
+    TelemetryWriter. Runs against the database in ./.creds, inside a scratch schema that is dropped afterwards.
+    :param lines: number of telemetry lines to insert with each method
+    :param devices: number of devices the lines are spread across
+    """
+    import db_handler
+    import telemetry_writer
+
+    db = db_handler.establish_db()
+    cursor = db.cursor()
+
+    # build the schema in a scratch namespace
+    cursor.execute("DROP SCHEMA IF EXISTS benchmark CASCADE;")
+    cursor.execute("CREATE SCHEMA benchmark;")
+    cursor.execute("SET search_path TO benchmark;")
+    db_handler.create_schema(db)
+
+    try:
+        cursor.execute("INSERT INTO devices (port) SELECT 'BENCHMARK-' || i FROM generate_series(1, %s) i;",
+                       (devices,))
+        db.commit()
+
+        # pooled connections, working in the scratch schema
+        db_handler.init_pool(options="-c search_path=benchmark")
+
+        data = [f"@ BLR_STAT 2024 10 5 15:00:{i % 60:02}.{i % 1000:03} HG: 0 0 0 XYZ: 0 0 1000" for i in range(lines)]
+
+        # previous path, one transaction per line
+        start = time.perf_counter()
+        for i, line in enumerate(data):
+            db_handler.add_data(1 + i % devices, line)
+        elapsed = time.perf_counter() - start
+        print(f"{'add_data (commit per line)':<40} {lines / elapsed:10.1f} rows/s")
+
+        # batched writer
+        writer = telemetry_writer.TelemetryWriter()
+        writer.start()
+
+        start = time.perf_counter()
+        for i, line in enumerate(data):
+            writer.add(1 + i % devices, line)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        print(f"{'TelemetryWriter (batched)':<40} {lines / elapsed:10.1f} rows/s")
+        print(writer.stats())
+    finally:
+        db_handler.close_pool()
+
+        db.rollback()
+        cursor.execute("DROP SCHEMA IF EXISTS benchmark CASCADE;")
+        db.commit()
+        db.close()
+
+
+def benchmark_parse(repeats: int = 20) -> None:
+    """
+    Compares parsing the BLR_STAT lines in ./simulations/*.dat with the previous regex against the fixed-layout,
+    CRC-checked parser in telemetry_parser.py
+    :param repeats: number of passes over the simulation lines
+    """
+    import re
+    import glob
+    import telemetry_parser
+
+    # previous telemetry_handler regex
+    telemetry_re = re.compile(r"([0-9]*)\s([0-9]*)\s([0-9]*)\s([0-9]*:[0-9]*:[0-9]*.[0-9]*)\sHG:\s*(-?[0-9]*)\s*(-?["
+                              r"0-9]*)\s*(-?[0-9]*)\s*XYZ:\s*(-?[0-9]*)\s*(-?[0-9]*)\s*(-?[0-9]*)\s*Bo:\s*(-?[0-9]*)\s*("
+                              r"-?[0-9]*)\s*bt:\s*(-?[0-9]*)\s*gy:\s*(-?[0-9]*)\s*(-?[0-9]*)\s*(-?[0-9]*)\s*ang:\s*(-?["
+                              r"0-9]*)\s*(-?[0-9]*)\s*vel\s*(-?[0-9]*)\s*AGL\s*(-?[0-9]*)")
+
+    lines = []
+    for sim_file in sorted(glob.glob("./simulations/*.dat")):
+        with open(sim_file, "rb") as file:
+            lines.extend(file.read().split(b"\n"))
+
+    def regex_parse(line: bytes) -> None:
+        match = telemetry_re.findall(line.decode("utf-8", errors="replace"))
+        if match:
+            [int(value) for value in match[0][4:]]
+
+    # field parsing alone (with the CRC fields stripped, so they are not checked), then with the CRC check the regex
+    # never did
+    plain_parser = telemetry_parser.StatusParser(require_crc=False)
+    crc_parser = telemetry_parser.StatusParser()
+    methods = [("TELEMETRY_RE.findall", regex_parse, lines, None),
+               ("telemetry_parser (no CRC)", plain_parser.parse, [line.split(b" CRC: ")[0] for line in lines],
+                plain_parser),
+               ("telemetry_parser (with CRC)", crc_parser.parse, lines, crc_parser)]
+
+    # time a pass of each method in turn and keep each one's fastest, so other load on the machine does not skew the
+    # comparison
+    best = [float("inf")] * len(methods)
+    for _ in range(repeats):
+        for i, (_, parse, parse_lines, _) in enumerate(methods):
+            start = time.perf_counter()
+            for line in parse_lines:
+                parse(line)
+            best[i] = min(best[i], time.perf_counter() - start)
+
+    for (name, _, _, parser), seconds in zip(methods, best):
+        print(f"{name:<40} {len(lines) / seconds:12.0f} lines/s")
+
+        if parser is not None:
+            print(f"    {best[0] / seconds:.1f}x the regex, {parser.stats()}")
+
+
+def benchmark_serial(seconds: float = 5.0) -> None:
+    """
+    Streams the simulation files through a pty as fast as it accepts them, and compares reading the other end a
+    line at a time (like the previous read_until loop) against the bulk SerialLineReader. Linux/macOS only.
+    :param seconds: time to read with each method
+    """
+    import os
+    import tty
+    import glob
+    import threading
+    import serial_reader
+
+    data = b""
+    for sim_file in sorted(glob.glob("./simulations/*.dat")):
+        with open(sim_file, "rb") as file:
+            data += file.read()
+
+    def run(name: str, read_lines) -> None:
+        master, slave = os.openpty()
+        stop = threading.Event()
+
+        # raw mode, like pyserial sets up a real port, so carriage returns are not translated
+        tty.setraw(slave)
+
+        def feed():
+            while not stop.is_set():
+                try:
+                    os.write(master, data)
+                except OSError:
+                    return
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        with open(slave, "rb", buffering=0) as stream:
+            start = time.perf_counter()
+            count = read_lines(stream, start + seconds)
+            elapsed = time.perf_counter() - start
+
+        stop.set()
+        os.close(master)
+
+        print(f"{name:<40} {count / elapsed:12.0f} lines/s")
+
+    def line_at_a_time(stream, end: float) -> int:
+        # unbuffered readline, like read_until, costs a read call per byte
+        count = 0
+        while time.perf_counter() < end:
+            stream.readline()
+            count += 1
+        return count
+
+    def bulk(stream, end: float) -> int:
+        lines = serial_reader.LineQueue()
+        reader = serial_reader.SerialLineReader(stream, lines)
+
+        count = 0
+        while time.perf_counter() < end:
+            count += reader.poll()
+
+            # drain like the publishing thread would
+            while lines.get(timeout=0) is not None:
+                pass
+        return count
+
+    run("readline (line at a time)", line_at_a_time)
+    run("SerialLineReader (bulk)", bulk)
+
+
+def benchmark_frame_alloc(frames: int = 500, warmup: int = 50) -> None:
+    """
+    Measures with tracemalloc the peak memory growth of the transmitter's capture -> overlay -> queue -> display
+    steps once warmed up, against the size of one frame. The steps are the transmitter's: VideoCapture.read into a
+    FrameBufferPool buffer (from a video file standing in for the camera), the RGBA->RGB conversion into a pooled
+    buffer, and overlay_utils.overlay_telemetry. The previous allocate-per-frame path is measured for comparison.
+    :param frames: number of frames measured
+    :param warmup: frames run first, to fill the pools and QR cache
+    """
+    import os
+    import cv2
+    import glob
+    import models
+    import utils
+    import tempfile
+    import tracemalloc
+    import numpy as np
+    import qr_renderer
+    import overlay_utils
+    import frame_pipeline
+    import telemetry_codec
+    import telemetry_parser
+
+    config = models.Config('./config.json')
+
+    shape = (config.HEIGHT, config.WIDTH, 3)
+    frame_bytes = int(np.prod(shape))
+
+    # a real telemetry record, from the first status line of the simulations
+    telemetry = None
+    for sim_file in sorted(glob.glob("./simulations/*.dat")):
+        with open(sim_file, "rb") as file:
+            record = next(filter(None, map(telemetry_parser.StatusParser(require_crc=False).parse, file)), None)
+
+        if record is not None:
+            telemetry = record.to_list(1)
+            break
+
+    qr_cache = qr_renderer.QRCache(utils.create_qr_renderer(config, utils.telemetry_payload_length(config)))
+    encoder = telemetry_codec.TelemetryEncoder()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # stand-in for the camera: a short video, rewound when it runs out
+        camera_path = os.path.join(directory, "camera.avi")
+        writer = cv2.VideoWriter(camera_path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (config.WIDTH, config.HEIGHT))
+        for _ in range(30):
+            writer.write(np.random.randint(0, 256, shape, dtype=np.uint8))
+        writer.release()
+
+        video_stream = cv2.VideoCapture(camera_path)
+
+        def run(pooled: bool) -> int:
+            # pools sized as in transmitter_server
+            buffer_count = 2 * config.PIPELINE_QUEUE_SIZE + 3
+            image_pool = frame_pipeline.FrameBufferPool("capture", shape, buffer_count)
+            output_pool = frame_pipeline.FrameBufferPool("overlay", shape, buffer_count)
+            display_queue = frame_pipeline.FrameQueue("display", config.PIPELINE_QUEUE_SIZE)
+
+            def step(sequence: int) -> None:
+                frame = frame_pipeline.Frame(sequence)
+
+                # capture stage
+                buffer = frame.attach(image_pool) if pooled else None
+                s, image = video_stream.read(buffer)
+
+                if not s:
+                    video_stream.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    s, image = video_stream.read(buffer)
+
+                frame.image = image
+
+                # overlay stage
+                payload, is_delta = encoder.encode([telemetry])
+                qr_img = qr_cache.get(payload)
+
+                buffer = frame.attach(output_pool) if pooled else None
+                output = cv2.cvtColor(frame.image, cv2.COLOR_RGBA2RGB, dst=buffer)
+                frame.output = overlay_utils.overlay_telemetry(config, output, qr_img, sequence, 30)
+
+                # hand off to the display, which releases the frame once shown
+                display_queue.put(frame)
+                frame.release()
+                display_queue.get(timeout=0).release()
+
+            for sequence in range(warmup):
+                step(sequence)
+
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+            for sequence in range(warmup, warmup + frames):
+                step(sequence)
+
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            tracemalloc.stop()
+
+            return peak
+
+        print(f"frame size: {frame_bytes} bytes, {frames} frames measured")
+
+        try:
+            allocating = run(False)
+            pooled = run(True)
+        finally:
+            video_stream.release()
+
+    print(f"{'allocating (previous)':<40} {allocating:12d} bytes peak growth")
+    print(f"{'FrameBufferPool':<40} {pooled:12d} bytes peak growth")
+
+
+def benchmark_sink(frames: int = 300) -> None:
+    """
+    Measures frames/s written by the headless output sinks: the framebuffer sink to a file standing in for a 16-bit
+    and a 32-bit framebuffer, and the pipe sink to a FIFO with a reader.
+    :param frames: frames written to each sink
+    """
+    import os
+    import tempfile
+    import threading
+    import numpy as np
+    import output_sinks
+
+    width, height = 720, 576
+    frame = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for bits_per_pixel in (16, 32):
+            fb_path = os.path.join(directory, f"fb{bits_per_pixel}")
+            with open(fb_path, "wb") as file:
+                file.truncate(width * height * bits_per_pixel // 8)
+
+            sink = output_sinks.FramebufferSink(fb_path, width, height, bits_per_pixel)
+            sink.open()
+
+            start = time.perf_counter()
+            for _ in range(frames):
+                sink.show(frame)
+            _report(f"FramebufferSink ({bits_per_pixel} bpp file)", time.perf_counter() - start, frames)
+            sink.close()
+
+        fifo_path = os.path.join(directory, "fifo")
+        os.mkfifo(fifo_path)
+
+        def read_fifo():
+            with open(fifo_path, "rb", buffering=0) as fifo:
+                while fifo.read(1 << 20):
+                    pass
+
+        reader = threading.Thread(target=read_fifo)
+        reader.start()
+
+        sink = output_sinks.PipeSink(fifo_path)
+        sink.open()
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            sink.show(frame)
+        _report("PipeSink (FIFO)", time.perf_counter() - start, frames)
+
+        sink.close()
+        reader.join()
+
+
+def benchmark_codec(frames: int = 2000) -> None:
+    """
+    Measures payloads/s encoded and decoded with the aggregate and keyframe/delta layouts, with the two simulations'
+    controllers
+    :param frames: number of frames encoded and decoded per layout
+    """
+    import telemetry_codec
+    import telemetry_parser
+
+    parser = telemetry_parser.StatusParser(require_crc=False)
+
+    # the status lines of each simulation, as sent by device 1 and 2
+    streams = []
+    for device, sim_file in enumerate(["./simulations/static-simulation.dat", "./simulations/flight-simulation.dat"],
+                                      start=1):
+        with open(sim_file, "rb") as file:
+            streams.append([record.to_list(device) for record in map(parser.parse, file) if record is not None])
+
+    frame_records = [list(records) for records in zip(*streams)][:frames]
+
+    encoder = telemetry_codec.TelemetryEncoder(keyframe_interval=10)
+    decoder = telemetry_codec.TelemetryDecoder()
+
+    def run(name: str, encode, decode) -> None:
+        start = time.perf_counter()
+        for records in frame_records:
+            decode(encode(records))
+        _report(name, time.perf_counter() - start, len(frame_records))
+
+    run("aggregate", telemetry_codec.encode_aggregate_payload, telemetry_codec.decode_payload)
+    run("keyframe/delta", lambda records: encoder.encode(records)[0], decoder.decode)
+
+
+BENCHMARKS = {
+    "qr": benchmark_qr_render,
+    "qr-cache": benchmark_qr_cache,
+    "db-latest": benchmark_db_latest,
+    "db-ingest": benchmark_db_ingest,
+    "parse": benchmark_parse,
+    "codec": benchmark_codec,
+    "serial": benchmark_serial,
+    "frame-alloc": benchmark_frame_alloc,
+    "sink": benchmark_sink,
+}
+
+
+def main():
+    # run the requested benchmarks, or all of them
+    names = sys.argv[1:] or list(BENCHMARKS)
+
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Options: {', '.join(BENCHMARKS)}")
+            continue
+
+        print(f"=== {name} ===")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # Developed By Keagan Bowman
 # Database handler for in-flight data.
 # Using postgresql allows the threaded control handlers to insert new data as it arrives, instead of waiting for a
-# request by the main video stream
+# request by the main video stream. Threads share a pool of connections, borrowed with get_connection().
 #
 # db_handler.py
 
@@ -10,18 +10,52 @@ from __future__ import annotations
 import os
 import json
 import psycopg2
+import threading
+from typing import Iterator
+from contextlib import contextmanager
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extensions import connection
 
-
-def establish_db(wipe_db: bool = False) -> connection:
+# default number of pooled connections, if the pool is created on first use
+DEFAULT_POOL_SIZE = 4
+
+# typed data columns filled from parsed telemetry, in get_telemetry list order (after the device ID)
+TELEMETRY_COLUMNS = {
+    "accel_x": "INTEGER",  # Gs x1000
+    "accel_y": "INTEGER",
+    "accel_z": "INTEGER",
+    "velocity": "INTEGER",  # feet/sec
+    "altitude": "INTEGER",  # feet above ground level
+    "tilt": "INTEGER",  # degrees x10
+    "roll": "INTEGER",
+    "device_time": "TIME",  # Blue Raven clock time
+    "battery": "INTEGER",  # mV
+    "temperature": "INTEGER",  # x100
+    "pressure": "INTEGER",  # atm x10000
+    "gyro_x": "INTEGER",  # deg/sec x100
+    "gyro_y": "INTEGER",
+    "gyro_z": "INTEGER",
+    "hg_x": "INTEGER",  # hi-G Gs x100
+    "hg_y": "INTEGER",
+    "hg_z": "INTEGER",
+}
+
+_TELEMETRY_SELECT = ", ".join(f"d.{column}" for column in TELEMETRY_COLUMNS)
+
+# connections shared by the helpers below, set up by init_pool
+_pool: ThreadedConnectionPool | None = None
+# limits borrowed connections to the pool size, so a busy pool blocks instead of raising PoolError
+_pool_slots: threading.BoundedSemaphore | None = None
+_pool_lock = threading.Lock()
+
+
+def _load_creds() -> dict:
     """
-    Establish a connection to the database, create tables, and wipe tables if needed
-
+    Loads the connection arguments from ./.creds
     :param .creds: List of strings, laid out like so: [database name, host URL, port, username, password]
-    :param wipe_db: Should the database be wiped?
-    :return: psycopg2 Database Connection object
+    :return: keyword arguments for psycopg2.connect
     """
-
     if not os.path.exists("./.creds"):
         raise "Creds file not found at ./.creds"
 
@@ -29,19 +63,135 @@ def establish_db(wipe_db: bool = False) -> connection:
         creds = json.load(f)
         f.close()
 
-    db = psycopg2.connect(
-        database=creds[0].strip(),
-        host=creds[1].strip(),
-        port=creds[2].strip(),
-        user=creds[3].strip(),
-        password=creds[4].strip()
-    )
+    return {
+        "database": creds[0].strip(),
+        "host": creds[1].strip(),
+        "port": creds[2].strip(),
+        "user": creds[3].strip(),
+        "password": creds[4].strip()
+    }
 
-    cursor = db.cursor()
+
+def establish_db(wipe_db: bool = False) -> connection:
+    """
+    Establish a standalone connection to the database, create tables, and wipe tables if needed. The helpers below
+    use the connection pool instead.
+
+    :param wipe_db: Should the database be wiped?
+    :return: psycopg2 Database Connection object
+    """
+    db = psycopg2.connect(**_load_creds())
 
     if wipe_db:
-        cursor.execute("DROP TABLE IF EXISTS data CASCADE")
-        cursor.execute("DROP TABLE IF EXISTS devices CASCADE")
+        _wipe_schema(db)
+
+    create_schema(db)
+
+    return db
+
+
+def init_pool(size: int = DEFAULT_POOL_SIZE, wipe_db: bool = False, **connect_args) -> None:
+    """
+    Creates the connection pool used by the helpers, replacing any existing pool. Credentials are read and the
+    schema is set up once here, instead of for every connection.
+    :param size: Maximum number of open connections
+    :param wipe_db: Should the database be wiped?
+    :param connect_args: Extra psycopg2.connect arguments, ie: options="-c search_path=benchmark"
+    :return: None
+    """
+    if size < 1:
+        raise ValueError(f"Invalid connection pool size '{size}'.")
+
+    with _pool_lock:
+        _create_pool(size, wipe_db, **connect_args)
+
+
+def _create_pool(size: int, wipe_db: bool, **connect_args) -> None:
+    # must be called while holding _pool_lock
+    global _pool, _pool_slots
+
+    if _pool is not None:
+        _pool.closeall()
+
+    _pool = ThreadedConnectionPool(1, size, **_load_creds(), **connect_args)
+    _pool_slots = threading.BoundedSemaphore(size)
+
+    db = _pool.getconn()
+
+    try:
+        if wipe_db:
+            _wipe_schema(db)
+
+        create_schema(db)
+    finally:
+        _pool.putconn(db)
+
+
+def close_pool() -> None:
+    """
+    Closes every connection in the pool
+    :return: None
+    """
+    global _pool, _pool_slots
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+
+        _pool = None
+        _pool_slots = None
+
+
+@contextmanager
+def get_connection() -> Iterator[connection]:
+    """
+    Borrows a connection from the pool, creating the pool on first use. Blocks while every connection is in use,
+    and rolls back uncommitted work if the block raises.
+
+    ie: with db_handler.get_connection() as db:
+    :return: Pooled database connection, returned to the pool when the block exits
+    """
+    with _pool_lock:
+        if _pool is None:
+            _create_pool(DEFAULT_POOL_SIZE, False)
+
+        pool, slots = _pool, _pool_slots
+
+    slots.acquire()
+    try:
+        db = pool.getconn()
+
+        try:
+            yield db
+        except BaseException:
+            if not db.closed:
+                db.rollback()
+            raise
+        finally:
+            # drop broken connections instead of handing them out again
+            pool.putconn(db, close=bool(db.closed))
+    finally:
+        slots.release()
+
+
+def _wipe_schema(db: connection) -> None:
+    cursor = db.cursor()
+
+    cursor.execute("DROP TABLE IF EXISTS device_latest CASCADE")
+    cursor.execute("DROP TABLE IF EXISTS data CASCADE")
+    cursor.execute("DROP TABLE IF EXISTS devices CASCADE")
+
+    cursor.close()
+    db.commit()
+
+
+def create_schema(db: connection) -> None:
+    """
+    Creates the tables, indexes and triggers used by the transmitter, if they do not exist yet
+    :param db: Database connection
+    :return: None
+    """
+    cursor = db.cursor()
 
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS devices (
@@ -55,54 +205,146 @@ def establish_db(wipe_db: bool = False) -> connection:
     CREATE TABLE IF NOT EXISTS data (
         id SERIAL PRIMARY KEY,
         device INTEGER NOT NULL,
-        data TEXT NOT NULL,
+        data TEXT,
         time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (device) REFERENCES devices(id)
     );
     """)
 
-    return db
+    # telemetry is parsed once when it arrives and stored in typed columns, the raw line is optional
+    # (these also upgrade data tables made before the columns existed)
+    cursor.execute("ALTER TABLE data ALTER COLUMN data DROP NOT NULL;")
 
+    for column, column_type in TELEMETRY_COLUMNS.items():
+        cursor.execute(f"ALTER TABLE data ADD COLUMN IF NOT EXISTS {column} {column_type};")
 
-def add_data(db: connection, device_id: int, data: str | bytes) -> None:
+    # latest rows of a device are found by walking this index backwards, instead of sorting the whole table
+    cursor.execute("CREATE INDEX IF NOT EXISTS data_device_time_idx ON data (device, time DESC);")
+
+    # keep device_latest current on every insert of a telemetry row into data, lines that are not telemetry
+    # (events, voltage readings) are only archived
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION update_device_latest() RETURNS TRIGGER AS $$
+    BEGIN
+        IF NEW.device_time IS NULL THEN
+            RETURN NEW;
+        END IF;
+
+        INSERT INTO device_latest (device, data_id, time)
+        VALUES (NEW.device, NEW.id, NEW.time)
+        ON CONFLICT (device) DO UPDATE
+        SET data_id = EXCLUDED.data_id, time = EXCLUDED.time
+        WHERE device_latest.time <= EXCLUDED.time;
+
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+    # check if the latest row table exists, it is only set up (and filled from existing data) once
+    cursor.execute("SELECT to_regclass('device_latest') IS NULL;")
+
+    if cursor.fetchone()[0]:
+        # most recent telemetry row of every device
+        cursor.execute("""
+        CREATE TABLE device_latest (
+            device INTEGER PRIMARY KEY,
+            data_id INTEGER NOT NULL,
+            time TIMESTAMP NOT NULL,
+            FOREIGN KEY (device) REFERENCES devices(id)
+        );
+        """)
+
+        cursor.execute("DROP TRIGGER IF EXISTS data_device_latest ON data;")
+        cursor.execute("""
+        CREATE TRIGGER data_device_latest AFTER INSERT ON data
+        FOR EACH ROW EXECUTE FUNCTION update_device_latest();
+        """)
+
+        # fill in the latest rows already logged
+        cursor.execute("""
+        INSERT INTO device_latest (device, data_id, time)
+        SELECT DISTINCT ON (device) device, id, time FROM data WHERE device_time IS NOT NULL
+        ORDER BY device, time DESC;
+        """)
+
+    cursor.close()
+    db.commit()
+
+
+def telemetry_values(telemetry: list | None) -> tuple:
+    """
+    Orders a parsed telemetry list for the TELEMETRY_COLUMNS columns
+    :param telemetry: telemetry list from telemetry_handler.parse_telemetry, or None if the line is not telemetry
+    :return: column values, all None if there is no telemetry
+    """
+    if telemetry is None:
+        return (None,) * len(TELEMETRY_COLUMNS)
+
+    return tuple(telemetry[1:])
+
+
+def add_data(device_id: int, data: str | bytes | None, telemetry: list | None = None) -> None:
     """
     Add data to the table
-    :param db: Database connection
     :param device_id: Device adding data
-    :param data: Data string (or bytes) to add to database
+    :param data: Raw data string (or bytes) to add to database, or None to only keep the parsed telemetry
+    :param telemetry: Parsed telemetry list of the line, or None if the line is not telemetry
     :return: None
     """
     # if the data is in bytes, cast it to a string
     if isinstance(data, bytes):
         data = data.decode("utf-8")
 
-    cursor = db.cursor()
+    with get_connection() as db:
+        cursor = db.cursor()
 
-    # add new data to the db
-    cursor.execute("INSERT INTO data (device, data) VALUES (%s, %s);", (device_id, data))
+        # add new data to the db
+        cursor.execute(f"INSERT INTO data (device, data, {', '.join(TELEMETRY_COLUMNS)}) "
+                       f"VALUES (%s, %s{', %s' * len(TELEMETRY_COLUMNS)});",
+                       (device_id, data, *telemetry_values(telemetry)))
 
-    cursor.close()
-    db.commit()
+        cursor.close()
+        db.commit()
 
 
-def get_recent_data(db: connection, device_id: int) -> str:
+def add_data_batch(rows: list[tuple]) -> None:
     """
-    Collects the most recent data string from a given device
-    :param db: Database connection
+    Add a batch of data rows to the table in a single transaction
+    :param rows: (device ID, raw data string or None, time received, *telemetry_values) for each row, in the order
+    they arrived
+    :return: None
+    """
+    with get_connection() as db:
+        cursor = db.cursor()
+
+        # add all rows with one statement, rows keep their arrival time instead of the time of the flush
+        execute_values(cursor, f"INSERT INTO data (device, data, time, {', '.join(TELEMETRY_COLUMNS)}) VALUES %s;",
+                       rows, page_size=len(rows))
+
+        cursor.close()
+        db.commit()
+
+
+def get_recent_data(device_id: int) -> str:
+    """
+    Collects the most recent raw telemetry string from a given device
     :param device_id: Device to pull data for
-    :return: Most recent data entry in the database
+    :return: Most recent telemetry line in the database, or an empty string if it was not kept
     """
-    cursor = db.cursor()
+    with get_connection() as db:
+        cursor = db.cursor()
 
-    # select data
-    cursor.execute("SELECT data FROM data WHERE device = %s ORDER BY time DESC LIMIT 1;", (device_id,))
-    # grab selected data
-    data = cursor.fetchone()
+        # select data through the latest row table, which is a primary key lookup however many rows are logged
+        cursor.execute("SELECT d.data FROM device_latest l JOIN data d ON d.id = l.data_id WHERE l.device = %s;",
+                       (device_id,))
+        # grab selected data
+        data = cursor.fetchone()
 
-    cursor.close()
+        cursor.close()
 
     # ensure data isn't empty
-    if data is None:
+    if data is None or data[0] is None:
         data = ""
     else:
         data = data[0]
@@ -110,42 +352,68 @@ def get_recent_data(db: connection, device_id: int) -> str:
     return data
 
 
-def add_device(db: connection, port: str) -> int:
+def get_recent_telemetry(device_id: int) -> list:
+    """
+    Collects the most recent telemetry from a given device, read from the typed columns
+    :param device_id: Device to pull telemetry for
+    :return: telemetry list, laid out like telemetry_handler.get_telemetry, or [device ID] if there is none
+    """
+    with get_connection() as db:
+        cursor = db.cursor()
+
+        cursor.execute(f"SELECT {_TELEMETRY_SELECT} FROM device_latest l JOIN data d ON d.id = l.data_id "
+                       f"WHERE l.device = %s;", (device_id,))
+        values = cursor.fetchone()
+
+        cursor.close()
+
+    if values is None:
+        return [int(device_id)]
+
+    telemetry = [int(device_id), *values]
+
+    # device time is sent as the Blue Raven's HH:MM:SS.mmm string
+    telemetry[8] = telemetry[8].strftime("%H:%M:%S.%f")[:-3]
+
+    return telemetry
+
+
+def add_device(port: str) -> int:
     """
     Adds a new device to the database
-    :param db: Database connection
     :param port: The port identifier of the device
     :return: The ID of the newly inserted device
     """
-    cursor = db.cursor()
+    with get_connection() as db:
+        cursor = db.cursor()
 
-    # add device to database
-    cursor.execute("INSERT INTO devices (port) VALUES (%s) RETURNING id;", (port,))
-    # grab id
-    new_id = cursor.fetchone()[0]
+        # add device to database
+        cursor.execute("INSERT INTO devices (port) VALUES (%s) RETURNING id;", (port,))
+        # grab id
+        new_id = cursor.fetchone()[0]
 
-    # close database & commit
-    cursor.close()
-    db.commit()
+        # close database & commit
+        cursor.close()
+        db.commit()
 
     # return id
     return new_id
 
 
-def get_device(db: connection, port: str) -> int | None:
+def get_device(port: str) -> int | None:
     """
     Gets a device by matching the serial port
-    :param db: Database connection
     :param port: Port to find
     :return: device's ID if found, None if not found
     """
-    cursor = db.cursor()
+    with get_connection() as db:
+        cursor = db.cursor()
 
-    # select device
-    cursor.execute("SELECT id FROM devices WHERE port = %s;", (port,))
-    device = cursor.fetchone()
+        # select device
+        cursor.execute("SELECT id FROM devices WHERE port = %s;", (port,))
+        device = cursor.fetchone()
 
-    cursor.close()
+        cursor.close()
 
     if device is not None:
         device = device[0]
@@ -153,36 +421,36 @@ def get_device(db: connection, port: str) -> int | None:
     return device
 
 
-def set_device_status(db: connection, device: int, status: bool) -> None:
+def set_device_status(device: int, status: bool) -> None:
     """
     Set the status of a device to in-use (True) or inactive (False)
-    :param db: Database connection
     :param device: Device ID
     :param status: New status of the device
     :return:
     """
-    cursor = db.cursor()
+    with get_connection() as db:
+        cursor = db.cursor()
 
-    cursor.execute("UPDATE devices SET is_active = %s WHERE id = %s;", (status, device))
+        cursor.execute("UPDATE devices SET is_active = %s WHERE id = %s;", (status, device))
 
-    cursor.close()
-    db.commit()
+        cursor.close()
+        db.commit()
 
 
-def get_device_status(db: connection, device: int) -> bool | None:
+def get_device_status(device: int) -> bool | None:
     """
     Get the current activity status of a device
-    :param db: Database connection
     :param device: Device to find
     :return: Current status of the device, or None if not found
     """
-    cursor = db.cursor()
+    with get_connection() as db:
+        cursor = db.cursor()
 
-    # grab status from DB
-    cursor.execute("SELECT is_active FROM devices WHERE id = %s;", (device,))
-    status = cursor.fetchone()
+        # grab status from DB
+        cursor.execute("SELECT is_active FROM devices WHERE id = %s;", (device,))
+        status = cursor.fetchone()
 
-    cursor.close()
+        cursor.close()
 
     # check status is found and cast
     if status is not None:
@@ -191,16 +459,16 @@ def get_device_status(db: connection, device: int) -> bool | None:
     return status
 
 
-def reset_device_statuses(db: connection):
+def reset_device_statuses():
     """
     Sets the status of all devices to inactive
-    :param db: Database connection
     :return:
     """
-    cursor = db.cursor()
+    with get_connection() as db:
+        cursor = db.cursor()
 
-    # update devices list
-    cursor.execute("UPDATE devices SET is_active = FALSE;")
+        # update devices list
+        cursor.execute("UPDATE devices SET is_active = FALSE;")
 
-    cursor.close()
-    db.commit()
+        cursor.close()
+        db.commit()
@@ -0,0 +1,498 @@
+# Developed By Keagan Bowman
+# Multi-stage frame pipeline for the transmitter.
+# Capture, overlay, recording and display run as separate stages, connected by bounded queues. A stage never waits
+# on a slower stage downstream of it: when a queue is full, a frame is dropped by the queue's policy instead. Each
+# stage is a single thread reading one FIFO queue, so the frames that do reach a stage are always in capture order.
+# Frame-sized arrays come from FrameBufferPools and go back to them once every stage is done with the frame, so the
+# steady-state loop allocates no frame-sized arrays.
+#
+# frame_pipeline.py
+from __future__ import annotations
+
+import time
+import threading
+import numpy as np
+import stage_metrics
+from collections import deque
+from typing import Callable
+
+# "oldest" drops the longest queued frame to make room (lowest latency), "latest" drops the frame being added
+# (keeps a continuous run of frames, at the cost of latency)
+DROP_POLICIES = ("oldest", "latest")
+
+# guards the reference counts of every frame
+_refs_lock = threading.Lock()
+
+
+class FrameBufferPool:
+    """
+    Reusable frame-sized arrays of one shape. A pool grows when every buffer is in use (ie: while a queue fills up),
+    and keeps its buffers after that, so a loop that releases its buffers stops allocating once it is warmed up.
+    """
+
+    def __init__(self, name: str, shape: tuple, count: int = 0, dtype=np.uint8):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+        self._lock = threading.Lock()
+        self._free = [np.empty(self.shape, dtype) for _ in range(count)]
+
+        # pool statistics
+        self.allocated = count
+
+    def acquire(self) -> np.ndarray:
+        """
+        :return: a free buffer, with undefined contents
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+
+            self.allocated += 1
+
+        return np.empty(self.shape, self.dtype)
+
+    def release(self, buffer: np.ndarray) -> None:
+        """
+        Returns a buffer to the pool, it must no longer be used
+        :param buffer: buffer from acquire
+        """
+        with self._lock:
+            self._free.append(buffer)
+
+    def stats(self) -> str:
+        return f"{self.name} buffers: {self.allocated} allocated, {len(self._free)} free"
+
+
+class Frame:
+    """
+    A captured frame on its way through the pipeline.
+
+    Frames are reference counted: the stage that creates or takes a frame holds one reference, and every queue the
+    frame is waiting in holds one. Once the last reference is released, the buffers attached to the frame go back to
+    their pools.
+    """
+    __slots__ = ("sequence", "captured", "image", "output", "overlay", "_refs", "_buffers")
+
+    def __init__(self, sequence: int, image: np.ndarray | None = None):
+        # capture order, gaps are frames dropped before they reached a stage
+        self.sequence = sequence
+        # time.monotonic() of the capture
+        self.captured = time.monotonic()
+        # frame as captured
+        self.image = image
+        # frame as transmitted (with the overlay), set by the overlay stage
+        self.output: np.ndarray | None = None
+        # (frame marker counter, frame marker fps, delta payload, QR payload) of the overlay, set by the overlay stage
+        self.overlay: tuple[int, int, bool, bytes] | None = None
+
+        # the creator's reference
+        self._refs = 1
+        self._buffers: list[tuple[FrameBufferPool, np.ndarray]] = []
+
+    def attach(self, pool: FrameBufferPool) -> np.ndarray:
+        """
+        Takes a buffer from a pool, returned to the pool when the frame is released
+        :param pool: pool to take the buffer from
+        :return: the buffer
+        """
+        buffer = pool.acquire()
+        self._buffers.append((pool, buffer))
+
+        return buffer
+
+    def retain(self) -> None:
+        with _refs_lock:
+            self._refs += 1
+
+    def release(self) -> None:
+        with _refs_lock:
+            self._refs -= 1
+
+            if self._refs > 0:
+                return
+
+        for pool, buffer in self._buffers:
+            pool.release(buffer)
+
+        self._buffers.clear()
+
+
+class FrameQueue:
+    """
+    Bounded, thread-safe frame queue between two stages. Putting never blocks, a full queue drops a frame by its
+    drop policy. Closing the queue lets the consuming stage finish the frames already queued, then stop.
+
+    A queued frame holds a reference for the queue, which is handed to whoever takes the frame (they release it once
+    done), or released if the frame is dropped.
+    """
+
+    def __init__(self, name: str, maxsize: int = 2, drop_policy: str = "oldest"):
+        if maxsize < 1:
+            raise ValueError(f"Invalid frame queue size '{maxsize}'.")
+
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Invalid drop policy '{drop_policy}', expected one of {DROP_POLICIES}.")
+
+        self.name = name
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+
+        self._frames: deque[Frame] = deque()
+        self._condition = threading.Condition()
+        self.closed = False
+
+        # queue statistics
+        self.added = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, frame: Frame) -> bool:
+        """
+        Adds a frame, dropping a frame if the queue is full
+        :param frame: frame to add
+        :return: False if the frame itself was dropped
+        """
+        with self._condition:
+            if self.closed:
+                return False
+
+            self.added += 1
+
+            if len(self._frames) >= self.maxsize:
+                self.dropped += 1
+
+                if self.drop_policy == "latest":
+                    return False
+
+                self._frames.popleft().release()
+
+            frame.retain()
+            self._frames.append(frame)
+            self.max_depth = max(self.max_depth, len(self._frames))
+
+            self._condition.notify()
+
+        return True
+
+    def get(self, timeout: float | None = None) -> Frame | None:
+        """
+        Removes the oldest frame, waiting for one if the queue is empty
+        :param timeout: seconds to wait, or None to wait until a frame is added or the queue is closed
+        :return: oldest frame (release it once done), or None if the wait timed out or the queue is closed and empty
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frames or self.closed, timeout) or not self._frames:
+                return None
+
+            return self._frames.popleft()
+
+    def get_latest(self) -> tuple[Frame | None, int]:
+        """
+        Removes the newest frame without waiting, dropping every older frame
+        :return: newest frame (release it once done) or None if the queue is empty, and the number of frames dropped
+        """
+        with self._condition:
+            if not self._frames:
+                return None, 0
+
+            frame = self._frames.pop()
+            skipped = len(self._frames)
+
+            while self._frames:
+                self._frames.popleft().release()
+
+            self.dropped += skipped
+
+        return frame, skipped
+
+    def close(self) -> None:
+        """
+        Stops accepting frames, the frames already queued can still be taken
+        """
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def stats(self) -> str:
+        return (f"{self.name} queue: {len(self._frames)}/{self.maxsize} deep ({self.max_depth} max), "
+                f"{self.added} added, {self.dropped} dropped ({self.drop_policy})")
+
+
+class PipelineStage:
+    """
+    One stage of the pipeline, running in its own thread.
+
+    A source stage (no input queue) calls work(frame) with a new, empty frame until the pipeline is stopped. Every
+    other stage calls work(frame) for each frame of its input queue until the queue is closed and empty. Either way,
+    the frame is forwarded unless work returns False (ie: a failed capture). When a stage finishes it closes its
+    output queues, so a stop flows down the pipeline and every queued frame is still processed.
+    """
+
+    def __init__(self, name: str, work: Callable, source: FrameQueue | None, outputs: list[FrameQueue],
+                 stop: threading.Event):
+        self.name = name
+        self.work = work
+        self.source = source
+        self.outputs = outputs
+
+        self._stop = stop
+        self._thread = threading.Thread(target=self._run, name=f"pipeline-{name}", daemon=True)
+
+        # exception that stopped the stage, if any
+        self.error: BaseException | None = None
+
+        # stage statistics
+        self.frames = 0
+        self.busy_seconds = 0.0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def join(self, timeout: float | None = None) -> None:
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            if self.source is None:
+                self._produce()
+            else:
+                self._consume()
+        except Exception as e:
+            self.error = e
+            print(f"Pipeline stage '{self.name}' failed: {e!r}")
+        finally:
+            for queue in self.outputs:
+                queue.close()
+
+    def _produce(self) -> None:
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            frame = Frame(self.frames)
+
+            try:
+                # skip failed captures
+                if self.work(frame) is not False:
+                    self._forward(frame, start)
+            finally:
+                frame.release()
+
+    def _consume(self) -> None:
+        while True:
+            frame = self.source.get()
+
+            if frame is None:
+                # closed, and every queued frame is processed
+                return
+
+            start = time.perf_counter()
+
+            try:
+                if self.work(frame) is not False:
+                    self._forward(frame, start)
+                else:
+                    self._count(start)
+            finally:
+                frame.release()
+
+    def _forward(self, frame: Frame, start: float) -> None:
+        for queue in self.outputs:
+            queue.put(frame)
+
+        self._count(start)
+
+    def _count(self, start: float) -> None:
+        self.frames += 1
+        self.busy_seconds += time.perf_counter() - start
+
+    def stats(self) -> str:
+        busy = self.busy_seconds / self.frames * 1000 if self.frames else 0.0
+
+        return f"{self.name} stage: {self.frames} frames, {busy:.2f} ms/frame"
+
+
+class PacedStage(PipelineStage):
+    """
+    Stage that hands frames on at a constant rate, regardless of the rate they arrive at.
+
+    Every tick (1 / fps apart, on the monotonic clock), the newest frame of the input queue is handed on, and any
+    older queued frames are dropped. When no new frame arrived since the last tick, the last frame is handed on again
+    (duplicated). If a tick is missed (ie: the thread was not scheduled in time), the frame is also repeated for every
+    missed tick, so the number of frames handed on always matches the time passed, and a recording made from them
+    plays back at the right speed. After a stall of more than a second the schedule restarts instead.
+
+    The lateness of every tick against its schedule is the stage's jitter.
+    """
+
+    def __init__(self, name: str, fps: float, source: FrameQueue, outputs: list[FrameQueue], stop: threading.Event,
+                 metrics: stage_metrics.StageMetrics | None = None):
+        if fps <= 0:
+            raise ValueError(f"Invalid paced frame rate '{fps}'.")
+
+        super().__init__(name, lambda _: None, source, outputs, stop)
+
+        self.fps = fps
+        self.interval = 1 / fps
+        self.metrics = metrics
+
+        # pacing statistics
+        self.ticks = 0
+        self.duplicated = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.jitter_seconds = 0.0
+        self.max_jitter_seconds = 0.0
+
+    def _consume(self) -> None:
+        last: Frame | None = None
+        next_tick = time.monotonic()
+
+        try:
+            while True:
+                # wait for the tick
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                now = time.monotonic()
+                start = time.perf_counter()
+
+                frame, skipped = self.source.get_latest()
+                self.dropped += skipped
+
+                if frame is not None:
+                    if last is not None:
+                        last.release()
+
+                    last = frame
+                    repeats = 0
+                elif self.source.closed:
+                    # closed, and every queued frame is handed on
+                    return
+                elif last is not None:
+                    repeats = 1
+                else:
+                    # nothing captured yet
+                    next_tick = now + self.interval
+                    continue
+
+                jitter = now - next_tick
+                due = 1 + int(jitter / self.interval)
+
+                if due > self.fps:
+                    # stalled, restart the schedule rather than catching up on every missed tick
+                    self.resyncs += 1
+                    next_tick = now
+                    jitter = 0.0
+                    due = 1
+
+                # hand the frame on for this tick, and again for each missed tick
+                for _ in range(due):
+                    for queue in self.outputs:
+                        queue.put(last)
+
+                self.ticks += due
+                self.duplicated += repeats + due - 1
+                next_tick += due * self.interval
+
+                self.jitter_seconds += jitter
+                self.max_jitter_seconds = max(self.max_jitter_seconds, jitter)
+
+                if self.metrics is not None:
+                    self.metrics.observe(f"{self.name} jitter", jitter)
+
+                self._count(start)
+        finally:
+            if last is not None:
+                last.release()
+
+    def stats(self) -> str:
+        jitter = self.jitter_seconds / self.frames * 1000 if self.frames else 0.0
+
+        return (f"{self.name} stage: {self.ticks} frames at {self.fps:g} fps, {self.duplicated} duplicated, "
+                f"{self.dropped} dropped, {self.resyncs} resyncs, {jitter:.2f} ms mean jitter "
+                f"({self.max_jitter_seconds * 1000:.2f} ms max)")
+
+
+class FramePipeline:
+    """
+    Stages and the queues that connect them, started and stopped together
+    """
+
+    def __init__(self):
+        self.queues: list[FrameQueue] = []
+        self.stages: list[PipelineStage] = []
+
+        self._stop = threading.Event()
+
+    def queue(self, name: str, maxsize: int = 2, drop_policy: str = "oldest") -> FrameQueue:
+        """
+        Adds a queue between two stages
+        :param name: queue name, for stats
+        :param maxsize: frames the queue holds before dropping
+        :param drop_policy: "oldest" or "latest", see DROP_POLICIES
+        :return: the new queue
+        """
+        queue = FrameQueue(name, maxsize, drop_policy)
+        self.queues.append(queue)
+
+        return queue
+
+    def stage(self, name: str, work: Callable, source: FrameQueue | None = None,
+              outputs: list[FrameQueue] | None = None) -> PipelineStage:
+        """
+        Adds a stage. Stages are stopped in the order they are added, so add them from capture downstream.
+        :param name: stage name, for stats
+        :param work: work(frame) -> bool | None, returning False drops the frame
+        :param source: queue the stage takes frames from, or None for the source stage
+        :param outputs: queues the stage's frames are handed to
+        :return: the new stage
+        """
+        stage = PipelineStage(name, work, source, outputs or [], self._stop)
+        self.stages.append(stage)
+
+        return stage
+
+    def paced_stage(self, name: str, fps: float, source: FrameQueue, outputs: list[FrameQueue] | None = None,
+                    metrics: stage_metrics.StageMetrics | None = None) -> PacedStage:
+        """
+        Adds a stage that hands frames on at a constant rate, dropping and duplicating frames to keep it
+        :param name: stage name, for stats
+        :param fps: frames handed on per second
+        :param source: queue the stage takes frames from
+        :param outputs: queues the stage's frames are handed to
+        :param metrics: metrics the jitter of every tick is recorded to, as the "<name> jitter" stage
+        :return: the new stage
+        """
+        stage = PacedStage(name, fps, source, outputs or [], self._stop, metrics)
+        self.stages.append(stage)
+
+        return stage
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stops capturing, then waits for each stage to finish the frames already queued for it
+        :param timeout: seconds to wait for each stage
+        """
+        self._stop.set()
+
+        for stage in self.stages:
+            stage.join(timeout)
+
+    @property
+    def error(self) -> BaseException | None:
+        """
+        :return: first exception that stopped a stage, or None
+        """
+        return next((stage.error for stage in self.stages if stage.error is not None), None)
+
+    def stats(self) -> str:
+        return "\n".join([stage.stats() for stage in self.stages] + [queue.stats() for queue in self.queues])
@@ -0,0 +1,191 @@
+# Developed By Keagan Bowman
+# Latest-frame-only video capture.
+# A capture device (ie: the receiver's USB capture card) buffers the frames it delivers until they are read. Polling it
+# slower than its frame rate fills that buffer, and every read then returns a frame that is seconds old. This drains
+# the device in its own thread as fast as it delivers frames, and keeps only the newest one, so a read always returns
+# the most recent frame.
+#
+# latest_capture.py
+from __future__ import annotations
+
+import cv2
+import time
+import threading
+import numpy as np
+import stage_metrics
+
+
+class LatestFrameCapture:
+    """
+    Reads a cv2.VideoCapture continuously from a background thread, keeping only the newest frame.
+
+    read() returns each frame at most once, so a reader slower than the device gets the newest frame and skips the
+    ones in between (counted as dropped), and a reader faster than the device waits for the next frame. It takes the
+    same arguments as cv2.VideoCapture.read, so it can replace one.
+
+    The device is read into two buffers that are swapped, and frames are copied out of them, so the steady-state
+    loop allocates no frames when read() is given a buffer.
+
+    With a writer, every frame the device delivers is recorded from the capture thread, including the ones read()
+    skips, so the recording matches the device's frame rate however slowly the reader takes frames.
+    """
+
+    def __init__(self, stream: cv2.VideoCapture, metrics: stage_metrics.StageMetrics | None = None,
+                 writer: cv2.VideoWriter | None = None):
+        """
+        :param stream: opened video capture, released by this object when it is released
+        :param metrics: metrics the age of every frame read is recorded to, as the "frame age" stage, and the time
+            to record each frame, as the "record" stage
+        :param writer: opened video writer every frame is recorded to, released by this object when it is released
+        """
+        self.stream = stream
+        self.metrics = metrics
+        self.writer = writer
+
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="latest-capture", daemon=True)
+
+        # newest frame and the buffer the next frame is read into, swapped after every read
+        self._front: np.ndarray | None = None
+        self._back: np.ndarray | None = None
+
+        # time.monotonic() the newest frame was read at, and its number
+        self._captured = 0.0
+        self._sequence = 0
+        # number of the last frame returned by read
+        self._taken = 0
+
+        # seconds between the capture of the last frame returned by read, and it being returned
+        self.frame_age = 0.0
+
+        # capture statistics
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.record_errors = 0
+        self.max_frame_age = 0.0
+
+    @property
+    def age(self) -> float:
+        """
+        :return: seconds since the newest frame was captured, inf before the first frame
+        """
+        with self._condition:
+            return time.monotonic() - self._captured if self._sequence else float("inf")
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def read(self, image: np.ndarray | None = None, timeout: float = 1.0) -> tuple[bool, np.ndarray | None]:
+        """
+        Returns the newest frame not returned yet, waiting for one if needed
+        :param image: buffer the frame is copied into, a new array is returned without one
+        :param timeout: seconds to wait for a new frame
+        :return: (True, frame), or (False, None) if no new frame arrived in time or the capture is released
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._sequence > self._taken or self._stop.is_set(), timeout):
+                return False, None
+
+            if self._sequence == self._taken:
+                return False, None
+
+            # frames read since the last one returned, that were never returned
+            self.dropped += self._sequence - self._taken - 1
+            self._taken = self._sequence
+
+            if image is not None and image.shape == self._front.shape and image.dtype == self._front.dtype:
+                np.copyto(image, self._front)
+            else:
+                image = self._front.copy()
+
+            self.frame_age = time.monotonic() - self._captured
+
+        self.max_frame_age = max(self.max_frame_age, self.frame_age)
+
+        if self.metrics is not None:
+            self.metrics.observe("frame age", self.frame_age)
+
+        return True, image
+
+    def get(self, prop: int) -> float:
+        """
+        :param prop: cv2.CAP_PROP_* property
+        :return: the property of the video capture
+        """
+        return self.stream.get(prop)
+
+    def isOpened(self) -> bool:
+        return self.stream.isOpened() and not self._stop.is_set()
+
+    def release(self, timeout: float = 5.0) -> None:
+        """
+        Stops reading and releases the video capture
+        :param timeout: seconds to wait for the read in progress
+        """
+        with self._condition:
+            self._stop.set()
+            self._condition.notify_all()
+
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+        # never release the capture or writer under a running read or write
+        if not self._thread.is_alive():
+            self.stream.release()
+
+            if self.writer is not None:
+                self.writer.release()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            # reuses the buffer once the frame size is known
+            s, frame = self.stream.read(self._back)
+
+            if not s or frame is None:
+                self.errors += 1
+
+                if not self.stream.isOpened():
+                    break
+
+                # wait for the device instead of spinning on a failed read
+                self._stop.wait(0.01)
+                continue
+
+            with self._condition:
+                self._back, self._front = self._front, frame
+                self._captured = time.monotonic()
+                self._sequence += 1
+                self.frames += 1
+
+                self._condition.notify_all()
+
+            # the frame is the front buffer now, which only this thread replaces
+            if self.writer is not None:
+                self._record(frame)
+
+        with self._condition:
+            self._stop.set()
+            self._condition.notify_all()
+
+    def _record(self, frame: np.ndarray) -> None:
+        start = time.perf_counter()
+
+        try:
+            self.writer.write(frame)
+        except Exception as e:
+            # keep capturing without the frame, report the first failure
+            if self.record_errors == 0:
+                print(f"Capture failed to record a frame: {e!r}")
+
+            self.record_errors += 1
+            return
+
+        if self.metrics is not None:
+            self.metrics.observe("record", time.perf_counter() - start)
+
+    def stats(self) -> str:
+        return (f"capture: {self.frames} frames, {self.dropped} dropped, {self.errors} failed reads, "
+                f"{self.record_errors} failed writes, "
+                f"{self.frame_age * 1000:.1f} ms frame age ({self.max_frame_age * 1000:.1f} ms max)")
@@ -21,6 +21,8 @@ class Config:
         self.QR_MODE: str = 'border'
         self.QR_PIXEL_SCALE: int = 2
         self.QR_FRAMES_PER_CONTROLLER: int = 2
+        # send every controller's latest telemetry in each frame, instead of rotating through controllers
+        self.QR_AGGREGATE: bool = False
         self.QR_OVERLAY_X: int = 0
         self.QR_OVERLAY_Y: int = 0
 
@@ -31,6 +33,23 @@ class Config:
 
         self.QR_BORDER_SIZE: int = 1
 
+        # QR version to transmit, or 0 to use the smallest version that fits the telemetry payload
+        self.QR_VERSION: int = 0
+
+        # fixed QR mask pattern (0-7) used by the transmitter, instead of scoring all 8 masks every frame
+        self.QR_MASK_PATTERN: int = 0
+
+        # number of rendered QR images kept by the transmitter, keyed by payload
+        self.QR_CACHE_SIZE: int = 32
+
+        # frames between telemetry keyframes, with delta frames sent in between, or 0 to send full records every frame
+        self.QR_KEYFRAME_INTERVAL: int = 0
+
+        # frame sequence marker, a strip of cells carrying the frame counter and fps outside of the QR code
+        self.FRAME_MARKER_X: int = 200
+        self.FRAME_MARKER_Y: int = 470
+        self.FRAME_MARKER_SCALE: int = 6
+
         # camera options
         self.USE_PICAM: bool = False
         # Specified target resolution for transmitter output
@@ -47,6 +66,59 @@ class Config:
         self.BLUE_RAVEN_PORTS = ["COM4"]
         self.SIMULATE = True
         self.SIMULATION_COUNT: int = 2
+        # simulation replay speed, relative to the timestamps in the simulation files (0 replays as fast as possible)
+        self.SIMULATION_SPEED: float = 1.0
+        # synthetic flight controllers for load testing, and the status lines each sends per second. they are
+        # ingested like any other controller, but not sent in the QR code (needs TELEMETRY_ASYNC)
+        self.SYNTHETIC_COUNT: int = 0
+        self.SYNTHETIC_RATE: float = 20.0
+
+        # read every flight controller and simulator from one asyncio event loop, instead of a thread each
+        self.TELEMETRY_ASYNC: bool = True
+
+        # telemetry lines are written to the database in batches, flushed at this many rows or once the oldest
+        # buffered row is this many milliseconds old
+        self.TELEMETRY_BATCH_ROWS: int = 50
+        self.TELEMETRY_BATCH_MS: int = 100
+        # keep the raw telemetry line next to its parsed columns
+        self.TELEMETRY_KEEP_RAW: bool = True
+
+        # number of database connections shared by the telemetry threads and the transmitter
+        self.DB_POOL_SIZE: int = 4
+
+        # read the camera (or capture card) from a background thread that keeps only the newest frame, so frames never
+        # wait in the device's buffer. used by the receiver, and the transmitter without Picamera2
+        self.CAPTURE_LATEST_ONLY: bool = True
+
+        # frames held between the transmitter's capture, overlay and display stages. when a stage falls behind,
+        # "oldest" drops the longest queued frame, "latest" drops the new frame
+        self.PIPELINE_QUEUE_SIZE: int = 2
+        self.PIPELINE_DROP_POLICY: str = "oldest"
+
+        # frame rate the transmitter sends and records at. frames are dropped or duplicated to keep a constant cadence,
+        # 0 sends every frame as soon as it is overlaid (and records at the camera's reported rate)
+        self.TARGET_FPS: float = 30.0
+
+        # frames held for each background video recorder, and the frame dropped when its encoder falls behind
+        self.RECORD_QUEUE_SIZE: int = 30
+        self.RECORD_DROP_POLICY: str = "oldest"
+        # record the overlaid (qr-) video during flight. when disabled, only the raw video is encoded, with a telemetry
+        # sidecar that render_overlay.py rebuilds the overlaid video from
+        self.RECORD_QR_VIDEO: bool = True
+
+        # output to the video transmitter: "window" (OpenCV window, needs X), "framebuffer" (writes to the
+        # framebuffer at DISPLAY_DEVICE) or "pipe" (raw BGR24 frames to the FIFO at DISPLAY_DEVICE)
+        self.DISPLAY_SINK: str = "window"
+        self.DISPLAY_DEVICE: str = "/dev/fb0"
+
+        # per-stage timing metrics of the transmitter and receiver: seconds between dumps to ./metrics-out/ (0 disables
+        # dumps), dump format ("jsonl" or "csv"), and the local port serving them as Prometheus text (0 disables it)
+        self.METRICS_INTERVAL: float = 10.0
+        self.METRICS_FORMAT: str = "jsonl"
+        self.METRICS_PORT: int = 0
+
+        # print one line of frame counters (shown fps, dropped and recorded frames) from the transmitter every second
+        self.PRINT_STATS: bool = False
 
         # specify local video output codec
         # valid codecs include:
@@ -79,6 +151,7 @@ class Config:
                 self.QR_MODE = config_data['QR_MODE']
                 self.QR_PIXEL_SCALE = config_data['QR_PIXEL_SCALE']
                 self.QR_FRAMES_PER_CONTROLLER = config_data['QR_FRAMES_PER_CONTROLLER']
+                self.QR_AGGREGATE = config_data['QR_AGGREGATE']
                 self.QR_OVERLAY_X = config_data['QR_OVERLAY_X']
                 self.QR_OVERLAY_Y = config_data['QR_OVERLAY_Y']
 
@@ -88,6 +161,14 @@ class Config:
                 self.QR_BUFFER_SIZE_BOTTOM = config_data['QR_BUFFER_SIZE_BOTTOM']
 
                 self.QR_BORDER_SIZE = config_data['QR_BORDER_SIZE']
+                self.QR_VERSION = config_data['QR_VERSION']
+                self.QR_MASK_PATTERN = config_data['QR_MASK_PATTERN']
+                self.QR_CACHE_SIZE = config_data['QR_CACHE_SIZE']
+                self.QR_KEYFRAME_INTERVAL = config_data['QR_KEYFRAME_INTERVAL']
+
+                self.FRAME_MARKER_X = config_data['FRAME_MARKER_X']
+                self.FRAME_MARKER_Y = config_data['FRAME_MARKER_Y']
+                self.FRAME_MARKER_SCALE = config_data['FRAME_MARKER_SCALE']
 
                 # camera settings
                 self.USE_PICAM = config_data['USE_PICAM']
@@ -103,6 +184,27 @@ class Config:
                 self.OUTPUT_CODEC = config_data['OUTPUT_CODEC']
                 self.OUTPUT_EXTENSION = config_data['OUTPUT_EXTENSION']
                 self.SIMULATION_COUNT = config_data['SIMULATION_COUNT']
+                self.SIMULATION_SPEED = config_data['SIMULATION_SPEED']
+                self.SYNTHETIC_COUNT = config_data['SYNTHETIC_COUNT']
+                self.SYNTHETIC_RATE = config_data['SYNTHETIC_RATE']
+                self.TELEMETRY_ASYNC = config_data['TELEMETRY_ASYNC']
+                self.TELEMETRY_BATCH_ROWS = config_data['TELEMETRY_BATCH_ROWS']
+                self.TELEMETRY_BATCH_MS = config_data['TELEMETRY_BATCH_MS']
+                self.TELEMETRY_KEEP_RAW = config_data['TELEMETRY_KEEP_RAW']
+                self.DB_POOL_SIZE = config_data['DB_POOL_SIZE']
+                self.CAPTURE_LATEST_ONLY = config_data['CAPTURE_LATEST_ONLY']
+                self.PIPELINE_QUEUE_SIZE = config_data['PIPELINE_QUEUE_SIZE']
+                self.PIPELINE_DROP_POLICY = config_data['PIPELINE_DROP_POLICY']
+                self.TARGET_FPS = config_data['TARGET_FPS']
+                self.RECORD_QUEUE_SIZE = config_data['RECORD_QUEUE_SIZE']
+                self.RECORD_DROP_POLICY = config_data['RECORD_DROP_POLICY']
+                self.RECORD_QR_VIDEO = config_data['RECORD_QR_VIDEO']
+                self.DISPLAY_SINK = config_data['DISPLAY_SINK']
+                self.DISPLAY_DEVICE = config_data['DISPLAY_DEVICE']
+                self.METRICS_INTERVAL = config_data['METRICS_INTERVAL']
+                self.METRICS_FORMAT = config_data['METRICS_FORMAT']
+                self.METRICS_PORT = config_data['METRICS_PORT']
+                self.PRINT_STATS = config_data['PRINT_STATS']
             except KeyError:
                 # value not found - save and reload
                 print("Config is broken, adding missing variables...")
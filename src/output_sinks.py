@@ -0,0 +1,264 @@
+# Developed By Keagan Bowman
+# Output sinks for the transmitter's overlaid video, ie: what is sent to the radio video transmitter.
+# The window sink is the original OpenCV window, which needs X and a GUI event loop. The framebuffer sink writes
+# frames straight into a Linux framebuffer (/dev/fb0), and the pipe sink writes raw frames to a FIFO or pipe (ie: for
+# ffmpeg), so the transmitter can run headless.
+#
+# output_sinks.py
+from __future__ import annotations
+
+import os
+import cv2
+import stat
+import models
+import numpy as np
+
+# available sinks, see create_sink
+SINKS = ("window", "framebuffer", "pipe")
+
+# attempt to import mouse library, used by the window sink
+try:
+    import mouse
+    USING_MOUSE_LIB = True
+except ModuleNotFoundError:
+    import subprocess
+    USING_MOUSE_LIB = False
+
+
+class OutputSink:
+    """
+    Shows frames on an output. Frames are BGR, like every other OpenCV image in the transmitter.
+    """
+
+    def __init__(self):
+        # sink statistics
+        self.frames = 0
+        self.errors = 0
+
+    def open(self) -> None:
+        pass
+
+    def show(self, frame: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> str:
+        return f"{type(self).__name__}: {self.frames} frames shown, {self.errors} errors"
+
+
+class WindowSink(OutputSink):
+    """
+    OpenCV window, placed at the configured offset, with the mouse cursor moved out of the way
+    """
+
+    def __init__(self, width: int, height: int, offset_x: int = 0, offset_y: int = 0, name: str = "outputVideo"):
+        super().__init__()
+
+        self.width = width
+        self.height = height
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.name = name
+
+    def open(self) -> None:
+        # move mouse to bottom of screen
+        if USING_MOUSE_LIB:
+            mouse.move(0, self.height)
+        else:
+            # fall back to XTE commands
+            subprocess.run(["xte", f"mousemove 0 {self.height}"])
+
+        # create viewport window
+        cv2.namedWindow(self.name, cv2.WINDOW_GUI_NORMAL)
+
+        # resize viewport
+        cv2.resizeWindow(self.name, self.width, self.height)
+
+        # move viewport to 0, 0
+        cv2.moveWindow(self.name, 0, 0)
+
+        # apply viewport placement offset
+        cv2.moveWindow(self.name, self.offset_x, self.offset_y)
+
+    def show(self, frame: np.ndarray) -> None:
+        cv2.imshow(self.name, frame)
+        cv2.waitKey(1)
+
+        self.frames += 1
+
+    def close(self) -> None:
+        cv2.destroyWindow(self.name)
+
+
+class FramebufferSink(OutputSink):
+    """
+    Writes frames into a Linux framebuffer device, memory mapped, without any window system. Frames are converted to
+    the framebuffer's pixel format (16-bit RGB565 or 32-bit BGRX) in a reused buffer and copied in at the offset.
+
+    The framebuffer geometry is read from /sys/class/graphics/<device> when the path is a framebuffer device. For
+    anything else (ie: a regular file standing in for /dev/fb0 in tests) the geometry must be given.
+    """
+
+    def __init__(self, path: str = "/dev/fb0", width: int | None = None, height: int | None = None,
+                 bits_per_pixel: int | None = None, offset_x: int = 0, offset_y: int = 0):
+        super().__init__()
+
+        self.path = path
+        self.width = width
+        self.height = height
+        self.bits_per_pixel = bits_per_pixel
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+        # bytes per framebuffer line, can be padded past width * bytes per pixel
+        self.stride: int | None = None
+
+        self._map: np.memmap | None = None
+        self._converted: np.ndarray | None = None
+
+    def _read_geometry(self) -> None:
+        sysfs = f"/sys/class/graphics/{os.path.basename(os.path.realpath(self.path))}"
+
+        def read(name: str) -> str | None:
+            try:
+                with open(f"{sysfs}/{name}") as file:
+                    return file.read().strip()
+            except OSError:
+                return None
+
+        if (size := read("virtual_size")) is not None and self.width is None:
+            self.width, self.height = (int(value) for value in size.split(","))
+
+        if (bits := read("bits_per_pixel")) is not None and self.bits_per_pixel is None:
+            self.bits_per_pixel = int(bits)
+
+        if (stride := read("stride")) is not None:
+            self.stride = int(stride)
+
+    def open(self) -> None:
+        if stat.S_ISCHR(os.stat(self.path).st_mode):
+            self._read_geometry()
+
+        if self.width is None or self.height is None or self.bits_per_pixel is None:
+            raise ValueError(f"Unknown geometry for framebuffer '{self.path}', give its width, height and bits per "
+                             f"pixel.")
+
+        if self.bits_per_pixel not in (16, 32):
+            raise ValueError(f"Unsupported framebuffer depth '{self.bits_per_pixel}', expected 16 or 32.")
+
+        if self.stride is None:
+            self.stride = self.width * self.bits_per_pixel // 8
+
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r+", shape=(self.height, self.stride))
+
+    def show(self, frame: np.ndarray) -> None:
+        pixel_bytes = self.bits_per_pixel // 8
+
+        # clip the frame to the framebuffer
+        height = min(frame.shape[0], self.height - self.offset_y)
+        width = min(frame.shape[1], self.width - self.offset_x)
+
+        if height <= 0 or width <= 0:
+            self.errors += 1
+            return
+
+        # convert into a buffer reused while the frame size stays the same
+        if self._converted is None or self._converted.shape[:2] != frame.shape[:2]:
+            channels = 4 if pixel_bytes == 4 else 2
+            self._converted = np.empty((frame.shape[0], frame.shape[1], channels), dtype=np.uint8)
+
+        code = cv2.COLOR_BGR2BGRA if pixel_bytes == 4 else cv2.COLOR_BGR2BGR565
+        cv2.cvtColor(frame, code, dst=self._converted)
+
+        x = self.offset_x * pixel_bytes
+        self._map[self.offset_y:self.offset_y + height, x:x + width * pixel_bytes] = \
+            self._converted[:height, :width].reshape(height, width * pixel_bytes)
+
+        self.frames += 1
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.flush()
+            self._map = None
+
+
+class PipeSink(OutputSink):
+    """
+    Writes raw BGR24 frames, back to back, to a FIFO or pipe, ie: for
+    ffmpeg -f rawvideo -pix_fmt bgr24 -s <width>x<height> -i <fifo> ...
+    Opening blocks until the reader opens the FIFO. If the reader goes away, frames are counted as errors until the
+    reader opens it again.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+
+        self.path = path
+
+        self._fd: int | None = None
+
+    def open(self) -> None:
+        # create the FIFO if nothing exists at the path yet
+        if not os.path.exists(self.path):
+            os.mkfifo(self.path)
+
+        self._fd = os.open(self.path, os.O_WRONLY)
+
+    def show(self, frame: np.ndarray) -> None:
+        if self._fd is None:
+            self._reopen()
+
+            if self._fd is None:
+                self.errors += 1
+                return
+
+        try:
+            # frames are contiguous, so the array's memory is written without a copy
+            view = memoryview(np.ascontiguousarray(frame)).cast("B")
+
+            while view:
+                view = view[os.write(self._fd, view):]
+        except BrokenPipeError:
+            # reader went away, drop the frame and reopen once a reader is back
+            os.close(self._fd)
+            self._fd = None
+            self.errors += 1
+            return
+
+        self.frames += 1
+
+    def _reopen(self) -> None:
+        try:
+            # does not block without a reader, the frame is dropped instead
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            return
+
+        os.set_blocking(fd, True)
+        self._fd = fd
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def create_sink(config: models.Config) -> OutputSink:
+    """
+    Create the output sink selected by DISPLAY_SINK
+    :param config: Config object to get the sink, device, resolution and window options from
+    :return: unopened OutputSink
+    """
+    if config.DISPLAY_SINK == "window":
+        return WindowSink(config.WIDTH, config.HEIGHT, config.WINDOW_OFFSET_X, config.WINDOW_OFFSET_Y)
+
+    if config.DISPLAY_SINK == "framebuffer":
+        return FramebufferSink(config.DISPLAY_DEVICE, offset_x=config.WINDOW_OFFSET_X,
+                               offset_y=config.WINDOW_OFFSET_Y)
+
+    if config.DISPLAY_SINK == "pipe":
+        return PipeSink(config.DISPLAY_DEVICE)
+
+    raise ValueError(f"Invalid display sink '{config.DISPLAY_SINK}', expected one of {SINKS}.")
@@ -4,13 +4,351 @@
 # overlay_utils.py
 from __future__ import annotations
 
-import cv2
 import math
-import copy
 import models
+import functools
 import numpy as np
 from typing import Literal
 
+# supported QR overlay modes
+QR_MODES = ('border', 'bars', 'quadrants', 'overlay')
+
+# frame marker layout: sync pattern, frame counter, fps, and a CRC-8 over the counter and fps
+FRAME_MARKER_SYNC = (1, 0, 1, 0)
+FRAME_MARKER_COUNTER_BITS = 32
+FRAME_MARKER_FPS_BITS = 8
+FRAME_MARKER_CRC_BITS = 8
+FRAME_MARKER_BITS = len(FRAME_MARKER_SYNC) + FRAME_MARKER_COUNTER_BITS + FRAME_MARKER_FPS_BITS + FRAME_MARKER_CRC_BITS
+
+
+class OverlayPlan:
+    """
+    A compiled QR layout. Flat pixel qr_index[i] of the QR code is placed at flat pixel frame_index[c, i] of the
+    frame for every copy c, so reading and writing are a single take/put each. Layouts made of plain rectangles also
+    keep the rectangles as slices, which numpy copies faster than any index array.
+    """
+    __slots__ = ("qr_index", "frame_index", "regions", "_qr_index_all")
+
+    def __init__(self, qr_index: np.ndarray, frame_index: np.ndarray, regions: list[tuple[tuple, tuple]] | None = None):
+        self.qr_index = qr_index
+        self.frame_index = frame_index
+        self.regions = regions
+
+        # QR pixels repeated for every copy, so all copies can be written at once
+        self._qr_index_all = np.tile(qr_index, frame_index.shape[0])
+
+    @property
+    def copies(self) -> int:
+        return self.frame_index.shape[0]
+
+    def write(self, frame: np.ndarray, qr: np.ndarray) -> np.ndarray:
+        """
+        Scatter the QR code into the frame (in place)
+        :param frame: frame to overlay onto
+        :param qr: QR code to overlay
+        :return: the overlaid frame
+        """
+        if self.regions is not None:
+            for qr_region, frame_region in self.regions:
+                frame[frame_region] = qr[qr_region]
+        else:
+            _copy_pixels(frame, self.frame_index.ravel(), qr, self._qr_index_all)
+
+        return frame
+
+    def read(self, frame: np.ndarray, qr: np.ndarray, copy: int = 0) -> np.ndarray:
+        """
+        Gather one copy of the QR code from the frame (in place)
+        :param frame: frame to read from
+        :param qr: QR code buffer to fill
+        :param copy: which copy of the QR code to read
+        :return: the filled QR code buffer
+        """
+        if self.regions is not None:
+            for qr_region, frame_region in self.regions:
+                qr[qr_region] = frame[frame_region]
+        else:
+            _copy_pixels(qr, self.qr_index, frame, self.frame_index[copy])
+
+        return qr
+
+
+def _copy_pixels(destination: np.ndarray, destination_index: np.ndarray, source: np.ndarray,
+                 source_index: np.ndarray) -> None:
+    """
+    Copies whole pixels between flat pixel indexes of two images
+    """
+    if destination.flags.c_contiguous and source.flags.c_contiguous and destination.dtype == source.dtype and \
+            destination.shape[2:] == source.shape[2:]:
+        # view both images as flat arrays of whole pixels, so every pixel is moved as a single element
+        pixel = np.dtype((np.void, destination.itemsize * int(np.prod(destination.shape[2:], dtype=int))))
+
+        np.put(destination.reshape(-1).view(pixel), destination_index,
+               np.take(source.reshape(-1).view(pixel), source_index))
+    else:
+        destination[np.divmod(destination_index, destination.shape[1])] = \
+            source[np.divmod(source_index, source.shape[1])]
+
+
+def layout_key(config: models.Config) -> tuple:
+    """
+    Collects the calibration values that determine a QR layout
+    :param config: Configuration to pull calibration values from
+    :return: a hashable tuple of calibration values
+    """
+    return (
+        config.QR_MODE,
+        config.QR_PIXEL_SCALE,
+        config.QR_OVERLAY_X,
+        config.QR_OVERLAY_Y,
+        config.QR_BUFFER_SIZE_LEFT,
+        config.QR_BUFFER_SIZE_TOP,
+        config.QR_BUFFER_SIZE_RIGHT,
+        config.QR_BUFFER_SIZE_BOTTOM,
+    )
+
+
+def marker_key(config: models.Config) -> tuple:
+    """
+    Collects the calibration values that determine the frame marker position
+    :param config: Configuration to pull calibration values from
+    :return: a hashable tuple of calibration values
+    """
+    return config.FRAME_MARKER_X, config.FRAME_MARKER_Y, config.FRAME_MARKER_SCALE
+
+
+def get_overlay_plan(config: models.Config, frame_shape: tuple, qr_shape: tuple) -> OverlayPlan:
+    """
+    Gets the compiled layout for the current calibration values, compiling it if it has not been built yet
+    :param config: Configuration to use for qr overlay and frame marker options
+    :param frame_shape: shape of the frame being overlaid / read from
+    :param qr_shape: shape of the QR code being written / read
+    :return: compiled OverlayPlan
+    :raises ValueError: if the QR code or frame marker does not fit into the frame, or they overlap, with the
+        current calibration
+    """
+    return _compile_plan(layout_key(config), marker_key(config), tuple(frame_shape[:2]), tuple(qr_shape[:2]))
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_plan(key: tuple, marker: tuple, frame_shape: tuple, qr_shape: tuple) -> OverlayPlan:
+    """
+    Compiles a QR layout into gather/scatter index arrays, and checks the frame marker against it. Results are cached
+    per (calibration, frame, QR) shape.
+    """
+    plan = _compile_layout(key, frame_shape, qr_shape)
+
+    _check_frame_marker(plan, marker, frame_shape)
+
+    return plan
+
+
+def _check_frame_marker(plan: OverlayPlan, marker: tuple, frame_shape: tuple) -> None:
+    """
+    Checks that the frame marker strip is inside of the frame, and clear of every copy of the QR code
+    """
+    x, y, scale = marker
+
+    if scale < 1 or x < 0 or y < 0 or y + scale > frame_shape[0] or x + FRAME_MARKER_BITS * scale > frame_shape[1]:
+        raise ValueError("Frame marker does not fit inside of the frame with the current calibration.")
+
+    rows, cols = np.meshgrid(np.arange(y, y + scale), np.arange(x, x + FRAME_MARKER_BITS * scale), indexing="ij")
+    marker_index = np.ravel_multi_index((rows.ravel(), cols.ravel()), frame_shape)
+
+    if np.isin(marker_index, plan.frame_index).any():
+        raise ValueError("Frame marker overlaps the QR code with the current calibration.")
+
+
+def _compile_layout(key: tuple, frame_shape: tuple, qr_shape: tuple) -> OverlayPlan:
+    """
+    Compiles a QR layout into gather/scatter index arrays
+    """
+    mode, scale, overlay_x, overlay_y, left, top, right, bottom = key
+
+    if scale < 1:
+        raise ValueError(f"Invalid QR pixel scale '{scale}'.")
+
+    if mode == 'border':
+        origins = [_border_origins(frame_shape, qr_shape, scale, left, top, right, bottom)]
+    elif mode == 'bars':
+        origins = _bars_origins(frame_shape, qr_shape, scale, left, top, right, bottom)
+    elif mode == 'quadrants':
+        return _quadrants_plan(frame_shape, qr_shape, left, top, right, bottom)
+    elif mode == 'overlay':
+        return _overlay_plan(frame_shape, qr_shape, overlay_x, overlay_y)
+    else:
+        raise ValueError(f"Unknown QR overlay mode '{mode}'.")
+
+    # block origins inside the QR code, in the same (row-major) order the blocks are placed
+    qr_block_rows, qr_block_cols = np.meshgrid(np.arange(0, qr_shape[0], scale), np.arange(0, qr_shape[1], scale),
+                                               indexing="ij")
+    qr_block_rows = qr_block_rows.ravel()
+    qr_block_cols = qr_block_cols.ravel()
+
+    # expand every block into its pixels, clipping partial blocks on the right/bottom edges of the QR code
+    offset_rows, offset_cols = np.meshgrid(np.arange(scale), np.arange(scale), indexing="ij")
+    offset_rows = offset_rows.ravel()
+    offset_cols = offset_cols.ravel()
+
+    qr_rows = (qr_block_rows[:, None] + offset_rows[None, :])
+    qr_cols = (qr_block_cols[:, None] + offset_cols[None, :])
+    inside = (qr_rows < qr_shape[0]) & (qr_cols < qr_shape[1])
+
+    frame_rows = np.stack([rows[:, None] + offset_rows[None, :] for rows, _ in origins])[:, inside]
+    frame_cols = np.stack([cols[:, None] + offset_cols[None, :] for _, cols in origins])[:, inside]
+
+    return _finish_plan(frame_shape, qr_shape, qr_rows[inside], qr_cols[inside], frame_rows, frame_cols)
+
+
+def _finish_plan(frame_shape: tuple, qr_shape: tuple, qr_rows: np.ndarray, qr_cols: np.ndarray,
+                 frame_rows: np.ndarray, frame_cols: np.ndarray,
+                 regions: list[tuple[tuple, tuple]] | None = None) -> OverlayPlan:
+    """
+    Checks that a layout fits inside the frame without overlapping itself, and builds the plan
+    """
+    # every destination pixel has to be inside of the frame
+    if frame_rows.size > 0 and (frame_rows.min() < 0 or frame_cols.min() < 0 or
+                                frame_rows.max() >= frame_shape[0] or frame_cols.max() >= frame_shape[1]):
+        raise ValueError("QR code does not fit inside of the frame with the current calibration.")
+
+    frame_index = np.ravel_multi_index((frame_rows, frame_cols), frame_shape)
+
+    # no two QR pixels can be written to the same place
+    if np.unique(frame_index).size != frame_index.size:
+        raise ValueError("QR code overlaps itself with the current calibration.")
+
+    qr_index = np.ravel_multi_index((qr_rows, qr_cols), qr_shape)
+
+    return OverlayPlan(qr_index.astype(np.intp), frame_index.astype(np.intp), regions)
+
+
+def _border_origins(frame_shape: tuple, qr_shape: tuple, scale: int, left: int, top: int, right: int,
+                    bottom: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Walks the QR blocks clockwise around the frame, spiralling inwards once a full cycle is complete
+    :return: frame rows & columns for the origin of each QR block
+    """
+    block_count = math.ceil(qr_shape[0] / scale) * math.ceil(qr_shape[1] / scale)
+
+    rows = np.empty(block_count, dtype=np.intp)
+    cols = np.empty(block_count, dtype=np.intp)
+
+    # declare current x/y
+    current_x = left
+    current_y = top
+
+    # determine max x/y
+    max_x = frame_shape[1] - right
+    max_y = frame_shape[0] - bottom
+
+    # travel direction as an (x, y) step: right, down, left, up
+    steps = ((scale, 0), (0, scale), (-scale, 0), (0, -scale))
+    direction = 0
+
+    completed_cycles = 0
+
+    for block in range(block_count):
+        rows[block] = current_y
+        cols[block] = current_x
+
+        # move to the next block
+        current_x += steps[direction][0]
+        current_y += steps[direction][1]
+
+        offset = completed_cycles * scale
+
+        # turn when the next block would cross the edge of the current cycle
+        if direction == 0 and current_x + scale > max_x - offset:
+            direction = 1
+        elif direction == 1 and current_y + scale > max_y - offset:
+            direction = 2
+        elif direction == 2 and current_x - scale < offset + left:
+            direction = 3
+        elif direction == 3 and current_y - scale < offset + scale + top:
+            direction = 0
+            completed_cycles += 1
+
+    return rows, cols
+
+
+def _bars_origins(frame_shape: tuple, qr_shape: tuple, scale: int, left: int, top: int, right: int,
+                  bottom: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Stacks the QR blocks into columns on the left side of the frame, mirrored on the right side
+    :return: frame rows & columns for the origin of each QR block, for the left and right bars
+    """
+    block_count = math.ceil(qr_shape[0] / scale) * math.ceil(qr_shape[1] / scale)
+
+    # determine max x/y
+    max_x = frame_shape[1] - right
+    max_y = frame_shape[0] - bottom
+
+    # blocks per column before wrapping back to the top buffer
+    column_height = max(math.ceil((max_y - top) / scale), 1)
+
+    block = np.arange(block_count)
+    rows = top + (block % column_height) * scale
+    offsets = (block // column_height + 1) * scale
+
+    return [(rows, left + offsets), (rows, max_x - offsets - scale)]
+
+
+def _quadrants_plan(frame_shape: tuple, qr_shape: tuple, left: int, top: int, right: int,
+                    bottom: int) -> OverlayPlan:
+    """
+    Splits the QR code into 4 quadrants placed in the corners of the frame
+    """
+    # determine max x/y
+    max_x = frame_shape[1] - right
+    max_y = frame_shape[0] - bottom
+
+    # calculate quadrant size
+    quadrant_size = math.ceil(qr_shape[0] / 2)
+
+    # frame origin of the top/left and bottom/right halves of the QR code
+    near_row, far_row = top, max_y - bottom - quadrant_size
+    near_col, far_col = left, max_x - right - quadrant_size
+
+    regions = []
+    for qr_row, frame_row in ((0, near_row), (quadrant_size, far_row)):
+        for qr_col, frame_col in ((0, near_col), (quadrant_size, far_col)):
+            height = min(quadrant_size, qr_shape[0] - qr_row)
+            width = min(quadrant_size, qr_shape[1] - qr_col)
+
+            regions.append(((slice(qr_row, qr_row + height), slice(qr_col, qr_col + width)),
+                            (slice(frame_row, frame_row + height), slice(frame_col, frame_col + width))))
+
+    return _regions_plan(frame_shape, qr_shape, regions)
+
+
+def _overlay_plan(frame_shape: tuple, qr_shape: tuple, overlay_x: int, overlay_y: int) -> OverlayPlan:
+    """
+    Places the full QR code at a point on the frame
+    """
+    regions = [((slice(0, qr_shape[0]), slice(0, qr_shape[1])),
+                (slice(overlay_y, overlay_y + qr_shape[0]), slice(overlay_x, overlay_x + qr_shape[1])))]
+
+    return _regions_plan(frame_shape, qr_shape, regions)
+
+
+def _regions_plan(frame_shape: tuple, qr_shape: tuple, regions: list[tuple[tuple, tuple]]) -> OverlayPlan:
+    """
+    Builds a plan from rectangular regions of the QR code copied to rectangular regions of the frame
+    """
+    qr_rows, qr_cols, frame_rows, frame_cols = [], [], [], []
+
+    for (qr_row, qr_col), (frame_row, frame_col) in regions:
+        rows, cols = np.meshgrid(np.arange(qr_row.start, qr_row.stop), np.arange(qr_col.start, qr_col.stop),
+                                 indexing="ij")
+
+        qr_rows.append(rows.ravel())
+        qr_cols.append(cols.ravel())
+        frame_rows.append(rows.ravel() - qr_row.start + frame_row.start)
+        frame_cols.append(cols.ravel() - qr_col.start + frame_col.start)
+
+    return _finish_plan(frame_shape, qr_shape, np.concatenate(qr_rows), np.concatenate(qr_cols),
+                        np.concatenate(frame_rows)[None, :], np.concatenate(frame_cols)[None, :], regions)
+
 
 def handle_overlay_request(config: models.Config, mode: Literal["read", "write"], frame: np.ndarray, qr: np.ndarray):
     """
@@ -18,7 +356,8 @@ def handle_overlay_request(config: models.Config, mode: Literal["read", "write"]
     :param mode: specify read/write mode
     :param frame: frame to overlay / read from
     :param qr: QR code to overlay / write to
-    :return: Read mode - compiled QR;  Write mode - overlayed frame; None if unknown QR type
+    :return: Read mode - compiled QR;  Write mode - overlayed frame
+    :raises ValueError: if the mode is unknown, or the QR code does not fit with the current calibration
     """
     # ensure mode is valid
     if mode not in ["read", "write"]:
@@ -34,10 +373,10 @@ def handle_overlay_request(config: models.Config, mode: Literal["read", "write"]
     elif config.QR_MODE == 'overlay':
         return handle_qr_overlay(mode, frame, qr, config)
     else:
-        raise f"Unknown QR overlay mode '{config.QR_MODE}'."
+        raise ValueError(f"Unknown QR overlay mode '{config.QR_MODE}'.")
 
 
-def handle_qr_border(mode: Literal["read", "write"], frame: np.ndarray, qr: np.ndarray, config: models.Config) -> np.ndarray | None:
+def handle_qr_border(mode: Literal["read", "write"], frame: np.ndarray, qr: np.ndarray, config: models.Config) -> np.ndarray:
     """
     Takes a qr code (or other image) and converts it to a border for another image
     :param mode: read from qr border or write to qr border?
@@ -46,140 +385,30 @@ def handle_qr_border(mode: Literal["read", "write"], frame: np.ndarray, qr: np.n
     :param config: Configuration to use for qr overlay options
     :return: a np.ndarray with the updated frame or QR code
     """
-    # set cycles
-    completed_cycles = 0
-
-    # declare current x/y
-    current_x = config.QR_BUFFER_SIZE_LEFT
-    current_y = config.QR_BUFFER_SIZE_TOP
-
-    # determine max x/y
-    max_x = frame.shape[1] - config.QR_BUFFER_SIZE_RIGHT
-    max_y = frame.shape[0] - config.QR_BUFFER_SIZE_BOTTOM
-
-    # set current travel direction
-    direction = "r"
-
-    y = 0
-    while y < qr.shape[1]:
-        x = 0
-        while x < qr.shape[0]:
-            try:
-                if mode == "read":
-                    # read pixel from frame
-                    qr[y:y + config.QR_PIXEL_SCALE, x:x + config.QR_PIXEL_SCALE] = frame[current_y:current_y + config.QR_PIXEL_SCALE, current_x:current_x + config.QR_PIXEL_SCALE]
-                else:
-                    # set pixels in frame
-                    frame[current_y:current_y + config.QR_PIXEL_SCALE, current_x:current_x + config.QR_PIXEL_SCALE] = qr[y:y + config.QR_PIXEL_SCALE, x:x + config.QR_PIXEL_SCALE]
-                # increment x on successful replacement
-                x += config.QR_PIXEL_SCALE
-            except ValueError:
-                return None
-
-            # determine next direction adjustment
-            if direction == "r":
-                # increase x by pixel scale
-                current_x += config.QR_PIXEL_SCALE
-            elif direction == "d":
-                # increase y by pixel scale
-                current_y += config.QR_PIXEL_SCALE
-            elif direction == "l":
-                # decrease x by pixel scale
-                current_x -= config.QR_PIXEL_SCALE
-            elif direction == "u":
-                # decrease y by pixel scale
-                current_y -= config.QR_PIXEL_SCALE
-
-            offset = completed_cycles * config.QR_PIXEL_SCALE
-
-            # next x exceeds max x boundary
-            if current_x + config.QR_PIXEL_SCALE > max_x - offset and direction == "r":
-                direction = "d"
-            elif current_y + config.QR_PIXEL_SCALE > max_y - offset and direction == "d":
-                direction = "l"
-            elif current_x - config.QR_PIXEL_SCALE < offset + config.QR_BUFFER_SIZE_LEFT and direction == "l":
-                direction = "u"
-            elif current_y - config.QR_PIXEL_SCALE < offset + config.QR_PIXEL_SCALE + config.QR_BUFFER_SIZE_TOP and direction == "u":
-                direction = "r"
-                completed_cycles += 1
-
-        # increment y
-        y += config.QR_PIXEL_SCALE
+    plan = get_overlay_plan(config, frame.shape, qr.shape)
 
     if mode == "read":
-        return qr
+        return plan.read(frame, qr)
     else:
-        return frame
+        return plan.write(frame, qr)
 
 
-def handle_qr_bars(mode: Literal["read", "write"], frame: np.ndarray, qr: np.ndarray, config: models.Config) -> np.ndarray | tuple[np.ndarray, np.ndarray] | tuple[None, None]:
+def handle_qr_bars(mode: Literal["read", "write"], frame: np.ndarray, qr: np.ndarray, config: models.Config) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
     """
-    Applies a QR code overlay as a "bar" shape on the left side of a frame
+    Applies a QR code overlay as a "bar" shape on the left side of a frame, mirrored on the right side
     :param mode: read from qr border or write to qr border?
     :param frame: image to overlay border onto
     :param qr: qr code (or other image) to overlay
     :param config: Configuration to use for qr overlay options
     :return: The frame with the applied QR code, or the read QR codes from both sides
     """
-    qr_left = None
-    qr_right = None
+    plan = get_overlay_plan(config, frame.shape, qr.shape)
 
     if mode == "read":
-        # deep copy qr for left
-        qr_left = copy.deepcopy(qr)
-        # set right qr
-        qr_right = qr
-
-    # declare current x/y
-    min_x = config.QR_BUFFER_SIZE_LEFT
-    current_y = config.QR_BUFFER_SIZE_TOP
-
-    # determine max x/y
-    max_x = frame.shape[1] - config.QR_BUFFER_SIZE_RIGHT
-    max_y = frame.shape[0] - config.QR_BUFFER_SIZE_BOTTOM
-
-    current_x = config.QR_PIXEL_SCALE
-
-    y = 0
-    while y < qr.shape[0]:
-        x = 0
-        while x < qr.shape[1]:
-            # update left pixels
-            try:
-                if mode == "read":
-                    # read from left bar
-                    qr_left[y:y + config.QR_PIXEL_SCALE, x:x + config.QR_PIXEL_SCALE] = frame[current_y:current_y + config.QR_PIXEL_SCALE, min_x + current_x:min_x + current_x + config.QR_PIXEL_SCALE]
-                    # read from right bar
-                    qr_right[y:y + config.QR_PIXEL_SCALE, x:x + config.QR_PIXEL_SCALE] = frame[current_y:current_y + config.QR_PIXEL_SCALE, max_x - current_x - config.QR_PIXEL_SCALE:max_x - current_x]
-                else:
-                    # write to left side of frame
-                    frame[current_y:current_y + config.QR_PIXEL_SCALE, min_x + current_x:min_x + current_x + config.QR_PIXEL_SCALE] = qr[y:y + config.QR_PIXEL_SCALE, x:x + config.QR_PIXEL_SCALE]
-                    # write to right side of frame
-                    frame[current_y:current_y + config.QR_PIXEL_SCALE, max_x - current_x - config.QR_PIXEL_SCALE:max_x - current_x] = qr[y:y + config.QR_PIXEL_SCALE, x:x + config.QR_PIXEL_SCALE]
-
-                # increment x on successful place
-                x += config.QR_PIXEL_SCALE
-            except ValueError:
-                return None, None
-
-            # increase x
-            current_y += config.QR_PIXEL_SCALE
-
-            # ensure the qr code is still within bounds
-            if current_y >= max_y:
-                # increase x
-                current_x += config.QR_PIXEL_SCALE
-                # reset y
-                current_y = config.QR_BUFFER_SIZE_TOP
-
-        # increment y
-        y += config.QR_PIXEL_SCALE
-
-    if mode == "read":
-        # return read qr codes
-        return qr_left, qr_right
+        # read left bar into a copy, and right bar into the given qr
+        return plan.read(frame, qr.copy(), 0), plan.read(frame, qr, 1)
     else:
-        return frame
+        return plan.write(frame, qr)
 
 
 def handle_qr_quadrants(mode: Literal["read", "write"], frame: np.ndarray, qr: np.ndarray, config: models.Config) -> np.ndarray:
@@ -189,74 +418,132 @@ def handle_qr_quadrants(mode: Literal["read", "write"], frame: np.ndarray, qr: n
     :param frame: frame to read from / overlay onto
     :param qr: QR code to read to or write from
     :param config: Configuration to use for qr overlay options
-    :return:
+    :return: The frame with the applied QR code, or the read QR code
     """
-    # determine max x/y
-    max_x = frame.shape[1] - config.QR_BUFFER_SIZE_RIGHT
-    max_y = frame.shape[0] - config.QR_BUFFER_SIZE_BOTTOM
-
-    # calculate quadrant size
-    quadrant_size = math.ceil(qr.shape[0] / 2)
-
-    if mode == "read":
-        # read from top left
-        qr[0:quadrant_size, 0:quadrant_size] = frame[config.QR_BUFFER_SIZE_TOP:config.QR_BUFFER_SIZE_TOP + quadrant_size,
-                                               config.QR_BUFFER_SIZE_LEFT:config.QR_BUFFER_SIZE_LEFT + quadrant_size]
-
-        # read from top right
-        qr[0:quadrant_size, quadrant_size:] = frame[config.QR_BUFFER_SIZE_TOP:config.QR_BUFFER_SIZE_TOP + quadrant_size,
-                                              max_x - config.QR_BUFFER_SIZE_RIGHT - quadrant_size:max_x - config.QR_BUFFER_SIZE_RIGHT]
-
-        # read from bottom left
-        qr[quadrant_size:, 0:quadrant_size] = frame[max_y - config.QR_BUFFER_SIZE_BOTTOM - quadrant_size:max_y - config.QR_BUFFER_SIZE_BOTTOM,
-                                              config.QR_BUFFER_SIZE_LEFT:config.QR_BUFFER_SIZE_LEFT + quadrant_size]
-
-        # read from bottom right
-        qr[quadrant_size:, quadrant_size:] = frame[max_y - config.QR_BUFFER_SIZE_BOTTOM - quadrant_size:max_y - config.QR_BUFFER_SIZE_BOTTOM,
-                                             max_x - config.QR_BUFFER_SIZE_RIGHT - quadrant_size:max_x - config.QR_BUFFER_SIZE_RIGHT]
-    else:
-        # write to top left
-        frame[config.QR_BUFFER_SIZE_TOP:config.QR_BUFFER_SIZE_TOP + quadrant_size, config.QR_BUFFER_SIZE_LEFT:config.QR_BUFFER_SIZE_LEFT + quadrant_size] = qr[0:quadrant_size,
-                                                                                                  0:quadrant_size]
-
-        # write to top right
-        frame[config.QR_BUFFER_SIZE_TOP:config.QR_BUFFER_SIZE_TOP + quadrant_size, max_x - config.QR_BUFFER_SIZE_RIGHT - quadrant_size:max_x - config.QR_BUFFER_SIZE_RIGHT] = qr[
-                                                                                                                  0:quadrant_size,
-                                                                                                                  quadrant_size:]
-
-        # write to bottom left
-        frame[max_y - config.QR_BUFFER_SIZE_BOTTOM - quadrant_size:max_y - config.QR_BUFFER_SIZE_BOTTOM, config.QR_BUFFER_SIZE_LEFT:config.QR_BUFFER_SIZE_LEFT + quadrant_size] = qr[
-                                                                                                                  quadrant_size:,
-                                                                                                                  0:quadrant_size]
+    plan = get_overlay_plan(config, frame.shape, qr.shape)
 
-        # write to bottom right
-        frame[max_y - config.QR_BUFFER_SIZE_BOTTOM - quadrant_size:max_y - config.QR_BUFFER_SIZE_BOTTOM,
-        max_x - config.QR_BUFFER_SIZE_RIGHT - quadrant_size:max_x - config.QR_BUFFER_SIZE_RIGHT] = qr[quadrant_size:, quadrant_size:]
-
-    # determine return value based on mode
     if mode == "read":
-        return qr
+        return plan.read(frame, qr)
     else:
-        return frame
+        return plan.write(frame, qr)
 
 
 def handle_qr_overlay(mode: Literal["read", "write"], frame: np.ndarray, qr: np.ndarray, config: models.Config) -> np.ndarray:
     """
-    Overlay a QR code onto a point ona  frame
+    Overlay a QR code onto a point on a frame
     :param mode: read from qr border or write to qr border?
     :param frame: Frame to overlay QR onto or read QR from
     :param qr: Qr to overlay onto frame or to read into
     :param config: Configuration to use for qr overlay options
     :return: The overlaid QR code or the read QR code
     """
-    if mode == "read":
-        # read QR code
-        qr = frame[config.QR_OVERLAY_Y:qr.shape[0] + config.QR_OVERLAY_Y, config.QR_OVERLAY_X:qr.shape[1] + config.QR_OVERLAY_X]
-    else:
-        # overlay QR code
-        frame[config.QR_OVERLAY_Y:qr.shape[0] + config.QR_OVERLAY_Y, config.QR_OVERLAY_X:qr.shape[1] + config.QR_OVERLAY_X] = qr
+    plan = get_overlay_plan(config, frame.shape, qr.shape)
 
     if mode == "read":
-        return qr
+        return plan.read(frame, qr)
     else:
-        return frame
+        return plan.write(frame, qr)
+
+
+def overlay_telemetry(config: models.Config, frame: np.ndarray, qr: np.ndarray, frame_id: int, fps: int) -> np.ndarray:
+    """
+    Applies the transmitter's overlay: the QR code in the configured mode, then the frame marker. Used live by the
+    transmitter and offline by render_overlay.py, so both produce the same frame.
+    :param config: Configuration to pull the QR layout and marker position from
+    :param frame: RGB frame to overlay onto (in place)
+    :param qr: rendered QR code
+    :param frame_id: frame marker counter
+    :param fps: frame marker fps
+    :return: the overlaid frame
+    """
+    frame = handle_overlay_request(config, "write", frame, qr)
+
+    # frame sequence marker, kept out of the QR code so identical telemetry reuses the same QR image
+    return write_frame_marker(config, frame, frame_id, fps)
+
+
+def _crc8(data: bytes) -> int:
+    """
+    CRC-8 (polynomial 0x07) of a short byte string
+    """
+    crc = 0
+
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+
+    return crc
+
+
+def _frame_marker_cells(config: models.Config, frame: np.ndarray) -> np.ndarray:
+    """
+    Views the frame marker region as (cell row, bit, cell column, channel). The position is checked against the QR
+    layout (see _check_frame_marker) whenever the QR code is overlaid or read, this only checks the marker fits.
+    :raises ValueError: if the marker does not fit inside of the frame
+    """
+    scale = config.FRAME_MARKER_SCALE
+    x = config.FRAME_MARKER_X
+    y = config.FRAME_MARKER_Y
+
+    if scale < 1 or x < 0 or y < 0 or y + scale > frame.shape[0] or x + FRAME_MARKER_BITS * scale > frame.shape[1]:
+        raise ValueError("Frame marker does not fit inside of the frame with the current calibration.")
+
+    region = frame[y:y + scale, x:x + FRAME_MARKER_BITS * scale]
+
+    # splitting the width into (bit, cell column) is always possible without a copy
+    return region.reshape(scale, FRAME_MARKER_BITS, scale, -1)
+
+
+def write_frame_marker(config: models.Config, frame: np.ndarray, frame_id: int, fps: int) -> np.ndarray:
+    """
+    Writes the frame sequence marker, a strip of black (0) and white (1) cells carrying the frame counter and fps
+    :param config: Configuration to pull the marker position from
+    :param frame: frame to write the marker onto (in place)
+    :param frame_id: frame counter, wrapped to 32 bits
+    :param fps: transmitter frame rate, clamped to 8 bits
+    :return: the frame with the marker
+    """
+    frame_id &= (1 << FRAME_MARKER_COUNTER_BITS) - 1
+    fps = min(max(int(fps), 0), (1 << FRAME_MARKER_FPS_BITS) - 1)
+
+    data = frame_id.to_bytes(FRAME_MARKER_COUNTER_BITS // 8, "big") + fps.to_bytes(FRAME_MARKER_FPS_BITS // 8, "big")
+    data += bytes([_crc8(data)])
+
+    bits = np.concatenate((np.array(FRAME_MARKER_SYNC, dtype=np.uint8), np.unpackbits(np.frombuffer(data, np.uint8))))
+
+    cells = _frame_marker_cells(config, frame)
+    cells[:] = (bits * 255)[None, :, None, None]
+
+    return frame
+
+
+def read_frame_marker(config: models.Config, frame: np.ndarray) -> tuple[int, int] | None:
+    """
+    Reads the frame sequence marker
+    :param config: Configuration to pull the marker position from
+    :param frame: frame to read the marker from
+    :return: (frame counter, fps), or None if no valid marker was found
+    """
+    cells = _frame_marker_cells(config, frame)
+
+    # ignore the edges of each cell, which blur into their neighbours
+    if config.FRAME_MARKER_SCALE >= 3:
+        cells = cells[1:-1, :, 1:-1]
+
+    bits = (cells.mean(axis=(0, 2, 3)) >= 128).astype(np.uint8)
+
+    # check alignment
+    if tuple(bits[:len(FRAME_MARKER_SYNC)]) != FRAME_MARKER_SYNC:
+        return None
+
+    data = np.packbits(bits[len(FRAME_MARKER_SYNC):]).tobytes()
+
+    # check the marker wasn't corrupted
+    if _crc8(data[:-1]) != data[-1]:
+        return None
+
+    frame_id = int.from_bytes(data[:FRAME_MARKER_COUNTER_BITS // 8], "big")
+    fps = data[FRAME_MARKER_COUNTER_BITS // 8]
+
+    return frame_id, fps
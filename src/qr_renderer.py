@@ -0,0 +1,625 @@
+# Developed By Keagan Bowman
+# Fixed-template QR code renderer for the transmitter frame loop.
+# Function patterns, format/version information, the data module order, and the mask are all computed once per
+# (version, error correction, mask), so rendering a payload only encodes the data/ECC codewords and writes those
+# modules straight into a reusable RGB pixel buffer.
+#
+# qr_renderer.py
+from __future__ import annotations
+
+import time
+import numpy as np
+from collections import OrderedDict
+
+# format information bits for each error correction level
+ERROR_CORRECTION_FORMAT_BITS = {'L': 1, 'M': 0, 'Q': 3, 'H': 2}
+
+# error correction codewords per block, indexed by version (index 0 unused)
+_ECC_CODEWORDS_PER_BLOCK = {
+    'L': (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28,
+          30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'M': (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28,
+          28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    'Q': (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28,
+          30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'H': (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30,
+          30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+
+# number of error correction blocks, indexed by version (index 0 unused)
+_NUM_ECC_BLOCKS = {
+    'L': (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16,
+          17, 18, 19, 19, 20, 21, 22, 24, 25),
+    'M': (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28,
+          29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    'Q': (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38,
+          40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    'H': (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42,
+          45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+
+# mask patterns, as functions of module (row, column)
+_MASK_PATTERNS = (
+    lambda r, c: (r + c) % 2 == 0,
+    lambda r, c: r % 2 == 0,
+    lambda r, c: c % 3 == 0,
+    lambda r, c: (r + c) % 3 == 0,
+    lambda r, c: (r // 2 + c // 3) % 2 == 0,
+    lambda r, c: (r * c) % 2 + (r * c) % 3 == 0,
+    lambda r, c: ((r * c) % 2 + (r * c) % 3) % 2 == 0,
+    lambda r, c: ((r + c) % 2 + (r * c) % 3) % 2 == 0,
+)
+
+# segment mode indicators
+_MODE_ALPHANUMERIC = 0b0010
+_MODE_BYTE = 0b0100
+
+# alphanumeric mode character set, in value order
+ALPHANUMERIC_CHARSET = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+_ALPHANUMERIC_VALUES = {char: value for value, char in enumerate(ALPHANUMERIC_CHARSET)}
+
+
+def _build_gf_tables() -> tuple[np.ndarray, np.ndarray]:
+    """
+    Builds exponent/logarithm tables for GF(256) with the QR code polynomial (0x11D)
+    """
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+
+    value = 1
+    for i in range(255):
+        exp[i] = value
+        log[value] = i
+
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x11D
+
+    # duplicate the table so products of logs never need a modulo
+    exp[255:510] = exp[:255]
+
+    return exp, log
+
+
+_GF_EXP, _GF_LOG = _build_gf_tables()
+
+
+def _gf_multiply(a: np.ndarray | int, b: np.ndarray | int) -> np.ndarray:
+    """
+    Multiplies two GF(256) values (or arrays of values)
+    """
+    a = np.asarray(a, dtype=np.int32)
+    b = np.asarray(b, dtype=np.int32)
+
+    product = _GF_EXP[_GF_LOG[a] + _GF_LOG[b]]
+
+    return np.where((a == 0) | (b == 0), 0, product)
+
+
+def _reed_solomon_table(degree: int) -> np.ndarray:
+    """
+    Builds the Reed-Solomon generator polynomial for the given degree, multiplied by every possible byte
+    :return: (256, degree) table, where row f is the generator (without its leading term) multiplied by f
+    """
+    divisor = [0] * (degree - 1) + [1]
+
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            divisor[j] = int(_gf_multiply(divisor[j], root))
+
+            if j + 1 < degree:
+                divisor[j] ^= divisor[j + 1]
+
+        root = int(_gf_multiply(root, 2))
+
+    return _gf_multiply(np.arange(256)[:, None], np.array(divisor)[None, :]).astype(np.uint8)
+
+
+def symbol_size(version: int) -> int:
+    """
+    :param version: QR version (1-40)
+    :return: the width of a QR symbol of this version, in modules
+    """
+    return version * 4 + 17
+
+
+def alignment_pattern_positions(version: int) -> list[int]:
+    """
+    :param version: QR version (1-40)
+    :return: the row/column centers of the alignment patterns for this version
+    """
+    if version == 1:
+        return []
+
+    count = version // 7 + 2
+    step = (version * 8 + count * 3 + 5) // (count * 4 - 4) * 2
+
+    positions = [symbol_size(version) - 7 - i * step for i in range(count - 1)]
+
+    return [6] + positions[::-1]
+
+
+def raw_data_modules(version: int) -> int:
+    """
+    :param version: QR version (1-40)
+    :return: number of modules available for data/ECC codewords (including remainder bits)
+    """
+    result = (16 * version + 128) * version + 64
+
+    if version >= 2:
+        count = version // 7 + 2
+        result -= (25 * count - 10) * count - 55
+
+        if version >= 7:
+            result -= 36
+
+    return result
+
+
+def data_codewords(version: int, error_correction: str) -> int:
+    """
+    :param version: QR version (1-40)
+    :param error_correction: error correction level (L, M, Q, H)
+    :return: number of data codewords available in a symbol
+    """
+    return raw_data_modules(version) // 8 - \
+        _ECC_CODEWORDS_PER_BLOCK[error_correction][version] * _NUM_ECC_BLOCKS[error_correction][version]
+
+
+def _count_bits(version: int, alphanumeric: bool) -> int:
+    """
+    :return: width of the character count field for a segment
+    """
+    if alphanumeric:
+        return 9 if version < 10 else 11 if version < 27 else 13
+
+    return 8 if version < 10 else 16
+
+
+def is_alphanumeric(data: bytes) -> bool:
+    """
+    :param data: payload to check
+    :return: whether the payload can be encoded in alphanumeric mode
+    """
+    return all(char in _ALPHANUMERIC_VALUES for char in data)
+
+
+def byte_capacity(version: int, error_correction: str) -> int:
+    """
+    :param version: QR version (1-40)
+    :param error_correction: error correction level (L, M, Q, H)
+    :return: number of payload bytes that fit into a byte mode symbol
+    """
+    return (data_codewords(version, error_correction) * 8 - 4 - _count_bits(version, False)) // 8
+
+
+def alphanumeric_capacity(version: int, error_correction: str) -> int:
+    """
+    :param version: QR version (1-40)
+    :param error_correction: error correction level (L, M, Q, H)
+    :return: number of characters that fit into an alphanumeric mode symbol
+    """
+    bits = data_codewords(version, error_correction) * 8 - 4 - _count_bits(version, True)
+
+    # 11 bits per pair of characters, 6 bits for a trailing single character
+    return bits // 11 * 2 + (1 if bits % 11 >= 6 else 0)
+
+
+def smallest_version(length: int, error_correction: str, alphanumeric: bool = False, minimum: int = 1) -> int:
+    """
+    Finds the smallest QR version that fits a payload
+    :param length: payload length, in bytes (or characters for alphanumeric payloads)
+    :param error_correction: error correction level (L, M, Q, H)
+    :param alphanumeric: whether the payload is encoded in alphanumeric mode
+    :param minimum: smallest version to consider
+    :return: QR version (1-40)
+    :raises ValueError: if the payload does not fit into any QR version
+    """
+    capacity = alphanumeric_capacity if alphanumeric else byte_capacity
+
+    for version in range(max(minimum, 1), 41):
+        if capacity(version, error_correction) >= length:
+            return version
+
+    raise ValueError(f"Payload of {length} {'characters' if alphanumeric else 'bytes'} does not fit into any "
+                     f"QR version.")
+
+
+class QRTemplate:
+    """
+    Everything about a QR symbol that does not depend on its payload, for a fixed version, error correction level,
+    and mask pattern.
+    """
+
+    def __init__(self, version: int = 13, error_correction: str = 'H', mask_pattern: int = 0):
+        if not 1 <= version <= 40:
+            raise ValueError(f"Invalid QR version '{version}'.")
+
+        if error_correction not in ERROR_CORRECTION_FORMAT_BITS:
+            raise ValueError(f"Invalid error correction level '{error_correction}'.")
+
+        if not 0 <= mask_pattern <= 7:
+            raise ValueError(f"Invalid mask pattern '{mask_pattern}'.")
+
+        self.version = version
+        self.error_correction = error_correction
+        self.mask_pattern = mask_pattern
+        self.size = symbol_size(version)
+
+        # function pattern modules (True = dark) and which modules are function modules
+        self.modules = np.zeros((self.size, self.size), dtype=bool)
+        self._is_function = np.zeros((self.size, self.size), dtype=bool)
+
+        self._draw_function_patterns()
+
+        # data module placement order and mask
+        self._build_data_placement()
+
+        # codeword block layout
+        self._build_blocks()
+
+    def _set_function_module(self, row: int, col: int, dark: bool) -> None:
+        self.modules[row, col] = dark
+        self._is_function[row, col] = True
+
+    def _draw_function_patterns(self) -> None:
+        size = self.size
+
+        # timing patterns
+        for i in range(size):
+            self._set_function_module(6, i, i % 2 == 0)
+            self._set_function_module(i, 6, i % 2 == 0)
+
+        # finder patterns (and separators)
+        for center_row, center_col in ((3, 3), (3, size - 4), (size - 4, 3)):
+            for dr in range(-4, 5):
+                for dc in range(-4, 5):
+                    row = center_row + dr
+                    col = center_col + dc
+
+                    if 0 <= row < size and 0 <= col < size:
+                        self._set_function_module(row, col, max(abs(dr), abs(dc)) not in (2, 4))
+
+        # alignment patterns, skipping the three that would overlap finder patterns
+        positions = alignment_pattern_positions(self.version)
+        last = len(positions) - 1
+        for i, center_row in enumerate(positions):
+            for j, center_col in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+
+                for dr in range(-2, 3):
+                    for dc in range(-2, 3):
+                        self._set_function_module(center_row + dr, center_col + dc, max(abs(dr), abs(dc)) != 1)
+
+        self._draw_format_bits()
+        self._draw_version_bits()
+
+    def _draw_format_bits(self) -> None:
+        size = self.size
+
+        # format data is the error correction level and mask, protected by a BCH code
+        data = ERROR_CORRECTION_FORMAT_BITS[self.error_correction] << 3 | self.mask_pattern
+        remainder = data
+        for _ in range(10):
+            remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+        bits = (data << 10 | remainder) ^ 0x5412
+
+        def bit(i):
+            return (bits >> i) & 1 != 0
+
+        # first copy, around the top left finder pattern
+        for i in range(0, 6):
+            self._set_function_module(i, 8, bit(i))
+        self._set_function_module(7, 8, bit(6))
+        self._set_function_module(8, 8, bit(7))
+        self._set_function_module(8, 7, bit(8))
+        for i in range(9, 15):
+            self._set_function_module(8, 14 - i, bit(i))
+
+        # second copy, split between the top right and bottom left finder patterns
+        for i in range(0, 8):
+            self._set_function_module(8, size - 1 - i, bit(i))
+        for i in range(8, 15):
+            self._set_function_module(size - 15 + i, 8, bit(i))
+
+        # dark module
+        self._set_function_module(size - 8, 8, True)
+
+    def _draw_version_bits(self) -> None:
+        if self.version < 7:
+            return
+
+        remainder = self.version
+        for _ in range(12):
+            remainder = (remainder << 1) ^ ((remainder >> 11) * 0x1F25)
+        bits = self.version << 12 | remainder
+
+        for i in range(18):
+            dark = (bits >> i) & 1 != 0
+            a = self.size - 11 + i % 3
+            b = i // 3
+
+            self._set_function_module(b, a, dark)
+            self._set_function_module(a, b, dark)
+
+    def _build_data_placement(self) -> None:
+        size = self.size
+
+        rows = []
+        cols = []
+
+        # data modules are placed in 2 module wide columns, zig-zagging from the bottom right, skipping the timing
+        # column
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+
+            upward = ((right + 1) & 2) == 0
+            for vertical in range(size):
+                row = size - 1 - vertical if upward else vertical
+
+                for col in (right, right - 1):
+                    if not self._is_function[row, col]:
+                        rows.append(row)
+                        cols.append(col)
+
+            right -= 2
+
+        self._data_index = np.ravel_multi_index((np.array(rows), np.array(cols)), (size, size))
+
+        # mask bits for each data module, in placement order
+        mask = _MASK_PATTERNS[self.mask_pattern](np.array(rows), np.array(cols))
+        self._data_mask = mask.astype(np.uint8)
+
+        # placement bits, including remainder bits which are always left light before masking
+        self._bits = np.zeros(len(rows), dtype=np.uint8)
+
+    def _build_blocks(self) -> None:
+        version = self.version
+        block_ecc = _ECC_CODEWORDS_PER_BLOCK[self.error_correction][version]
+        block_count = _NUM_ECC_BLOCKS[self.error_correction][version]
+
+        raw_codewords = raw_data_modules(version) // 8
+        short_blocks = block_count - raw_codewords % block_count
+        short_data = raw_codewords // block_count - block_ecc
+
+        self.data_codewords = data_codewords(version, self.error_correction)
+
+        # data is laid out as a (block, long block length) matrix; short blocks are padded with a leading zero, which
+        # leaves their Reed-Solomon remainder unchanged
+        long_data = short_data + 1
+        self._block_data = np.zeros((block_count, long_data), dtype=np.uint8)
+        self._block_ecc = np.zeros((block_count, block_ecc), dtype=np.uint8)
+
+        # flat position of every data codeword inside of the block matrix
+        slots = []
+        for block in range(block_count):
+            if block < short_blocks:
+                slots.extend(block * long_data + 1 + i for i in range(short_data))
+            else:
+                slots.extend(block * long_data + i for i in range(long_data))
+        self._data_slots = np.array(slots, dtype=np.intp)
+
+        # interleaved codeword order, as flat indexes into the block data followed by the block ECC
+        order = []
+        for i in range(long_data):
+            for block in range(block_count):
+                if block < short_blocks:
+                    if i < short_data:
+                        order.append(block * long_data + 1 + i)
+                else:
+                    order.append(block * long_data + i)
+        for i in range(block_ecc):
+            for block in range(block_count):
+                order.append(block_count * long_data + block * block_ecc + i)
+        self._interleave = np.array(order, dtype=np.intp)
+
+        self._rs_table = _reed_solomon_table(block_ecc)
+
+    def _pad_codewords(self, data: bytes) -> bytes:
+        """
+        Encodes a payload as a single segment (alphanumeric mode when possible, byte mode otherwise) and pads it to
+        the symbol's data capacity
+        """
+        alphanumeric = is_alphanumeric(data)
+        count_bits = _count_bits(self.version, alphanumeric)
+        capacity_bits = self.data_codewords * 8
+
+        if alphanumeric:
+            # mode indicator and character count, then 11 bits per pair of characters and 6 for a trailing one
+            value = _MODE_ALPHANUMERIC << count_bits | len(data)
+            length = 4 + count_bits
+
+            for i in range(0, len(data) - 1, 2):
+                value = value << 11 | _ALPHANUMERIC_VALUES[data[i]] * 45 + _ALPHANUMERIC_VALUES[data[i + 1]]
+            length += len(data) // 2 * 11
+
+            if len(data) % 2 == 1:
+                value = value << 6 | _ALPHANUMERIC_VALUES[data[-1]]
+                length += 6
+        else:
+            # mode indicator, character count, and data
+            value = (_MODE_BYTE << count_bits | len(data)) << len(data) * 8 | int.from_bytes(data, "big")
+            length = 4 + count_bits + len(data) * 8
+
+        if len(data) >= 1 << count_bits or length > capacity_bits:
+            raise ValueError(f"Payload of {len(data)} bytes does not fit into a version {self.version}-"
+                             f"{self.error_correction} QR code.")
+
+        # terminator, then pad to a byte boundary
+        padding = min(4, capacity_bits - length)
+        padding += (8 - (length + padding) % 8) % 8
+        value <<= padding
+        length += padding
+
+        codewords = value.to_bytes(length // 8, "big")
+
+        # fill remaining capacity with alternating pad bytes
+        pad_count = self.data_codewords - len(codewords)
+        return codewords + (b"\xEC\x11" * (pad_count // 2 + 1))[:pad_count]
+
+    def encode(self, data: bytes, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        Encodes a payload into a module matrix
+        :param data: payload to encode
+        :param out: optional (size, size) bool array to write the modules into
+        :return: module matrix, True for dark modules
+        """
+        codewords = np.frombuffer(self._pad_codewords(data), dtype=np.uint8)
+
+        # split data into blocks
+        blocks = self._block_data
+        blocks.ravel()[self._data_slots] = codewords
+
+        # compute Reed-Solomon ECC for all blocks at once
+        remainder = self._block_ecc
+        remainder[:] = 0
+        for i in range(blocks.shape[1]):
+            factor = blocks[:, i] ^ remainder[:, 0]
+            remainder[:, :-1] = remainder[:, 1:]
+            remainder[:, -1] = 0
+            remainder ^= self._rs_table[factor]
+
+        # interleave blocks and expand to bits
+        interleaved = np.concatenate((blocks.ravel(), remainder.ravel()))[self._interleave]
+        bits = np.unpackbits(interleaved)
+        self._bits[:bits.size] = bits
+
+        # place masked data bits on top of the function patterns
+        if out is None:
+            out = np.empty((self.size, self.size), dtype=bool)
+        out[:] = self.modules
+        out.ravel()[self._data_index] = self._bits ^ self._data_mask
+
+        return out
+
+
+class QRRenderer:
+    """
+    Renders payloads into a reusable RGB pixel buffer, scaled up by box_size with a light border
+    """
+
+    def __init__(self, version: int = 13, error_correction: str = 'H', mask_pattern: int = 0, box_size: int = 4,
+                 border: int = 1):
+        self.template = QRTemplate(version, error_correction, mask_pattern)
+        self.box_size = box_size
+        self.border = border
+
+        # width of the rendered image, in modules and in pixels
+        self._width = self.template.size + 2 * border
+        self.pixel_size = self._width * box_size
+
+        self._modules = np.empty((self.template.size, self.template.size), dtype=bool)
+
+        # reusable output buffer, pre-filled with the light border
+        self._buffer = np.full((self.pixel_size, self.pixel_size, 3), 255, dtype=np.uint8)
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self._buffer.shape
+
+    def render(self, data: bytes | str, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        Renders a payload as a QR code image
+        :param data: payload to encode
+        :param out: optional (pixel_size, pixel_size, 3) uint8 array to render into; defaults to the renderer's own
+        reusable buffer, which is overwritten by the next call
+        :return: RGB QR code image (0 for dark modules, 255 for light modules)
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        modules = self.template.encode(data, self._modules)
+
+        if out is None:
+            out = self._buffer
+        elif out is not self._buffer:
+            out[:] = 255
+
+        # view the image as (module row, pixel row, module column, pixel column, channel) and fill each module
+        scale = self.box_size
+        blocks = out.reshape(self._width, scale, self._width, scale, 3)
+        inner = slice(self.border, self.border + self.template.size)
+        blocks[inner, :, inner, :, :] = np.where(modules, 0, 255).astype(np.uint8)[:, None, :, None, None]
+
+        return out
+
+
+class QRCache:
+    """
+    Bounded LRU cache of rendered QR images, keyed by payload bytes. Cached images are read-only and shared, so they
+    must not be modified by the caller.
+    """
+
+    def __init__(self, renderer: QRRenderer, max_size: int = 32):
+        if max_size < 1:
+            raise ValueError(f"Invalid QR cache size '{max_size}'.")
+
+        self.renderer = renderer
+        self.max_size = max_size
+
+        self._images: OrderedDict[bytes, np.ndarray] = OrderedDict()
+
+        # cache statistics
+        self.hits = 0
+        self.misses = 0
+        self.render_seconds = 0.0
+
+    def get(self, payload: bytes | str) -> np.ndarray:
+        """
+        Gets the rendered QR image for a payload, rendering it on a miss
+        :param payload: payload to encode
+        :return: read-only RGB QR code image
+        """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+
+        image = self._images.get(payload)
+
+        if image is not None:
+            # mark as most recently used
+            self._images.move_to_end(payload)
+            self.hits += 1
+
+            return image
+
+        self.misses += 1
+
+        # reuse the least recently used image buffer once the cache is full
+        if len(self._images) >= self.max_size:
+            _, image = self._images.popitem(last=False)
+            image.flags.writeable = True
+        else:
+            image = np.empty(self.renderer.shape, dtype=np.uint8)
+
+        start = time.perf_counter()
+        self.renderer.render(payload, out=image)
+        self.render_seconds += time.perf_counter() - start
+
+        image.flags.writeable = False
+        self._images[payload] = image
+
+        return image
+
+    def clear(self) -> None:
+        self._images.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        """
+        Estimated render time saved by cache hits, based on the average render time of a miss
+        """
+        return self.hits * self.render_seconds / self.misses if self.misses > 0 else 0.0
+
+    def stats(self) -> str:
+        return (f"QR cache: {self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate), "
+                f"{self.saved_seconds * 1000:.1f} ms of rendering saved")
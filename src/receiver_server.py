@@ -6,15 +6,20 @@
 
 # TODO
 # add controller data to DB on receive
+from __future__ import annotations
 
 import cv2
-import json
+import queue
 import utils
-import qrcode
 import models
 import tkinter
+import threading
 import numpy as np
+import qr_renderer
 import overlay_utils
+import stage_metrics
+import latest_capture
+import telemetry_codec
 from tkinter import ttk
 from pyzbar import pyzbar
 from PIL import Image, ImageTk
@@ -24,8 +29,9 @@ from pyzbar.pyzbar import ZBarSymbol
 config = models.Config('./config.json')
 
 # global variables
-QR: qrcode.main.QRCode = None
-VIDEO_STREAM: cv2.VideoCapture = None
+QR_RENDERERS: list[qr_renderer.QRRenderer] = []
+TELEMETRY_DECODER = telemetry_codec.TelemetryDecoder()
+VIDEO_STREAM: cv2.VideoCapture | latest_capture.LatestFrameCapture = None
 OUTPUT_WRITER: cv2.VideoWriter = None
 IMAGE_LABEL: tkinter.Label = None
 CALIBRATION_IMAGE_LABEL: tkinter.Label = None
@@ -33,30 +39,74 @@ CALIBRATION_QR_LABEL: tkinter.Label = None
 CONTROLLER_UIs: list[models.ControllerUIObject] = []
 ID_TO_CONTROLLER: dict[int, models.ControllerUIObject] = {}
 DEVICE_ID_VAR: tkinter.StringVar = None
+FRAME_STATUS_VAR: tkinter.StringVar = None
+LAST_FRAME_ID: int | None = None
+SKIPPED_FRAMES: int = 0
+
+# milliseconds between UI redraws
+UPDATE_INTERVAL_MS = 50
+
+# newest frame as read, for the calibration menu
+LATEST_FRAME: np.ndarray | None = None
+
+# newest decoded frame, handed from the decode thread to the UI
+RESULTS: queue.Queue[DecodeResult] = queue.Queue(maxsize=1)
+DECODE_STOP = threading.Event()
+
+# time spent in each stage of decode_loop and update_ui
+METRICS = stage_metrics.StageMetrics("receiver")
+
+
+class DecodeResult:
+    """
+    A frame read and decoded by the decode thread, with the telemetry of every frame decoded since the UI last took a
+    result, so no controller's update is lost when the UI redraws slower than frames are decoded
+    """
+    __slots__ = ("frame", "marker", "skipped", "records")
+
+    def __init__(self, frame: np.ndarray, marker: tuple[int, int] | None, skipped: int, records: dict[int, list]):
+        # zoomed frame, as displayed
+        self.frame = frame
+        # (frame counter, transmitter fps) of the frame marker
+        self.marker = marker
+        # transmitter frames never read here, up to this frame
+        self.skipped = skipped
+        # newest decoded telemetry record, by device id
+        self.records = records
+
+    def merge(self, older: DecodeResult) -> None:
+        """
+        Takes the telemetry and frame marker of an older result the UI has not taken yet
+        :param older: result replaced by this one
+        """
+        if self.marker is None:
+            self.marker = older.marker
+
+        for device_id, data in older.records.items():
+            # records without telemetry never replace one with telemetry
+            if device_id not in self.records or (len(self.records[device_id]) == 1 and len(data) > 1):
+                self.records[device_id] = data
 
 
 def main():
-    global QR, VIDEO_STREAM, OUTPUT_WRITER, IMAGE_LABEL, CONTROLLER_UIs
+    global QR_RENDERERS, VIDEO_STREAM, OUTPUT_WRITER, IMAGE_LABEL, CONTROLLER_UIs, FRAME_STATUS_VAR
 
-    # create QR object
-    QR = qrcode.main.QRCode(
-        version=13,  # force QR code scale
-        error_correction=qrcode.constants.ERROR_CORRECT_H,  # best error correction (up to 30%)
-        box_size=config.QR_PIXEL_SCALE,  # set pixels for each module of QR code
-        border=config.QR_BORDER_SIZE,  # set QR code border
-    )
+    # create QR objects
+    QR_RENDERERS = create_qr()
 
-    # get video stream
-    VIDEO_STREAM = utils.establish_video_feed(config)
+    # get video stream, drained in the background so the newest frame is always decoded. every frame of the feed is
+    # recorded by the capture thread, including the frames too new to be decoded, at the rate the feed reports
+    if config.CAPTURE_LATEST_ONLY:
+        VIDEO_STREAM = utils.create_latest_capture(config, METRICS, record=True)
+    else:
+        VIDEO_STREAM = utils.establish_video_feed(config)
 
-    # open video writer
-    OUTPUT_WRITER = utils.create_video_writer(config)
+        # open video writer, every frame is decoded and recorded at the rate the video feed reports (else the
+        # transmitter's rate)
+        OUTPUT_WRITER = utils.create_video_writer(config, fps=VIDEO_STREAM.get(cv2.CAP_PROP_FPS))
 
     # figure out number of controllers based on simulating or not
-    num_controllers = len(config.BLUE_RAVEN_PORTS)
-
-    if config.SIMULATE:
-        num_controllers = config.SIMULATION_COUNT
+    num_controllers = utils.controller_count(config)
 
     # === UI ===
 
@@ -80,6 +130,11 @@ def main():
                                              command=lambda: create_calibration_menu(root, receiver_panel))
     calibration_menu_button.grid(row=6, column=int(num_controllers / 2))
 
+    # create frame marker status label
+    FRAME_STATUS_VAR = tkinter.StringVar(receiver_panel, value="No frame marker")
+    frame_status_label = tkinter.Label(receiver_panel, textvariable=FRAME_STATUS_VAR)
+    frame_status_label.grid(row=8, column=0, columnspan=num_controllers * 4)
+
     # populate controller UI list
     for i in range(num_controllers):
         # create object
@@ -89,56 +144,123 @@ def main():
 
         CONTROLLER_UIs.append(ui_obj)
 
+    # read and decode frames at the camera's rate, in the background
+    decode_thread = threading.Thread(target=decode_loop, name="receiver-decode", daemon=True)
+    decode_thread.start()
+
     # start UI update loop
     update_ui(receiver_panel)
 
     receiver_panel.grid(row=0, column=0)
 
-    root.mainloop()
+    # dump and serve the stage metrics
+    exporter = utils.create_metrics_exporter(config, METRICS)
 
+    try:
+        root.mainloop()
+    finally:
+        # stop decoding before the video file is finalized
+        DECODE_STOP.set()
+        decode_thread.join(5.0)
+
+        if not decode_thread.is_alive():
+            # the latest-only capture finalizes its own recording
+            VIDEO_STREAM.release()
+
+            if config.CAPTURE_LATEST_ONLY:
+                print(VIDEO_STREAM.stats())
+            else:
+                OUTPUT_WRITER.release()
 
-def update_ui(root: tkinter.Frame):
-    # load in a frame
-    s, frame = VIDEO_STREAM.read()
+        exporter.stop()
 
-    # ensure frame was loaded
-    if frame is not None:
-        # loop exactly once - allows us to quit the loop if an error is thrown
-        # and then reschedule the update
-        for i in range(1):
-            # save frame to file
-            OUTPUT_WRITER.write(frame)
 
-            # apply zoom to frame
-            try:
-                frame = cv2.resize(frame, None, fx=config.WINDOW_ZOOM_X, fy=config.WINDOW_ZOOM_Y, interpolation=cv2.INTER_LINEAR)
-            except cv2.error:
-                pass
+def decode_loop():
+    """
+    Reads, records and decodes frames of the video feed (with CAPTURE_LATEST_ONLY, always its newest frame, recorded
+    by the capture instead), handing the newest result to the UI. Runs in its own thread, so decoding never holds up the Tk event loop (OpenCV and
+    pyzbar release the GIL while they work).
+    """
+    global LATEST_FRAME
 
-            # update UI
-            update_image(IMAGE_LABEL, frame)
+    while not DECODE_STOP.is_set():
+        # load in a frame
+        with METRICS.timer("read"):
+            s, frame = VIDEO_STREAM.read()
 
-            # clear QR code data
-            QR.clear()
+        # wait for the feed instead of spinning on a failed read
+        if frame is None:
+            DECODE_STOP.wait(UPDATE_INTERVAL_MS / 1000)
+            continue
 
-            # make qr code
-            QR.make()
+        LATEST_FRAME = frame
 
-            # build QR image
-            qr_img = QR.make_image()
+        # save frame to file
+        if OUTPUT_WRITER is not None:
+            with METRICS.timer("record"):
+                OUTPUT_WRITER.write(frame)
 
-            # get qr code image as numpy array
-            qr_img = np.array(qr_img, dtype=np.uint8) * 255
+        result = decode_frame(frame)
 
-            # cast color scale
-            qr_img = cv2.cvtColor(qr_img, cv2.COLOR_GRAY2RGB)
+        # replace the result the UI has not taken yet, keeping its telemetry. this is the only thread putting
+        # results, so the queue always has room after the get
+        try:
+            result.merge(RESULTS.get_nowait())
+        except queue.Empty:
+            pass
 
-            # read in QR code
+        RESULTS.put_nowait(result)
+
+
+def decode_frame(frame: np.ndarray) -> DecodeResult:
+    """
+    Reads the frame marker and telemetry of a frame
+    :param frame: frame as read from the video feed
+    :return: DecodeResult of the zoomed frame
+    """
+    global LAST_FRAME_ID, SKIPPED_FRAMES
+
+    # apply zoom to frame
+    with METRICS.timer("resize"):
+        try:
+            frame = cv2.resize(frame, None, fx=config.WINDOW_ZOOM_X, fy=config.WINDOW_ZOOM_Y,
+                               interpolation=cv2.INTER_LINEAR)
+        except cv2.error:
+            pass
+
+    # read frame sequence marker
+    with METRICS.timer("frame marker"):
+        try:
+            marker = overlay_utils.read_frame_marker(config, frame)
+        except ValueError:
+            marker = None
+
+    # count frames the transmitter sent that were never read here
+    if marker is not None:
+        frame_id = marker[0]
+
+        if LAST_FRAME_ID is not None and frame_id > LAST_FRAME_ID:
+            SKIPPED_FRAMES += frame_id - LAST_FRAME_ID - 1
+
+        LAST_FRAME_ID = frame_id
+
+    result = DecodeResult(frame, marker, SKIPPED_FRAMES, {})
+
+    # try each QR size the transmitter sends, most frequent first
+    decoded = []
+    for renderer in QR_RENDERERS:
+        # create empty QR image to read into
+        with METRICS.timer("qr template"):
+            qr_img = np.zeros(renderer.shape, dtype=np.uint8)
+
+        # read in QR code
+        with METRICS.timer("overlay read"):
             try:
                 qr = overlay_utils.handle_overlay_request(config, "read", frame, qr_img)
             except ValueError:
                 break
 
+        with METRICS.timer("decode"):
             # cast back to grayscale
             try:
                 qr = cv2.cvtColor(qr, cv2.COLOR_RGB2GRAY)
@@ -148,33 +270,83 @@ def update_ui(root: tkinter.Frame):
             # decode data from QR
             decoded = pyzbar.decode(qr)
 
-            # ensure decoded objects exist
-            if len(decoded) > 0:
-                # decode bytes & load as JSON
-                try:
-                    data = json.loads(decoded[0].data.decode('utf-8'))
-                except json.JSONDecodeError:
-                    break
+        if len(decoded) > 0:
+            break
 
-                # attempt to assign to controller
-                try:
-                    # update controller with ID
-                    try:
-                        ID_TO_CONTROLLER[data[0]].update_variables(data)
-                    except TypeError:
-                        pass
-                except KeyError:
-                    try:
-                        # set new ID for controller if one doesn't exist
-                        controller_ui = CONTROLLER_UIs.pop(0)
-                        ID_TO_CONTROLLER[data[0]] = controller_ui
-
-                        controller_ui.update_variables(data)
-                    except IndexError:
-                        raise "Too many controllers active"
+    # ensure decoded objects exist
+    if len(decoded) > 0:
+        # decode telemetry records from the payload, rebuilding delta payloads from their keyframe
+        try:
+            records = TELEMETRY_DECODER.decode(decoded[0].data)
+        except ValueError:
+            records = []
+
+        for data in records:
+            result.records[data[0]] = data
+
+    return result
+
+
+def update_ui(root: tkinter.Frame):
+    # take the newest decoded frame, if there is one since the last update
+    try:
+        result = RESULTS.get_nowait()
+    except queue.Empty:
+        result = None
+
+    if result is not None:
+        # update UI
+        with METRICS.timer("display"):
+            update_image(IMAGE_LABEL, result.frame)
+
+        if result.marker is not None:
+            update_frame_status(*result.marker, result.skipped)
+
+        for data in result.records.values():
+            update_controller(data)
 
     # schedule next update
-    root.after(50, update_ui, root)
+    root.after(UPDATE_INTERVAL_MS, update_ui, root)
+
+
+def update_controller(data: list) -> None:
+    """
+    Updates the UI of the controller that sent a telemetry record, assigning a UI to new controllers
+    :param data: decoded telemetry list
+    :return: None
+    """
+    controller_ui = ID_TO_CONTROLLER.get(data[0])
+
+    # set new ID for controller if one doesn't exist
+    if controller_ui is None:
+        if len(CONTROLLER_UIs) == 0:
+            raise RuntimeError("Too many controllers active")
+
+        controller_ui = CONTROLLER_UIs.pop(0)
+        ID_TO_CONTROLLER[data[0]] = controller_ui
+
+    # skip controllers that have not sent telemetry yet
+    if len(data) > 1:
+        controller_ui.update_variables(data)
+
+
+def create_qr() -> list[qr_renderer.QRRenderer]:
+    """
+    Creates the QR renderers used to size the QR images read from each frame
+    :return: QRRenderers matching each size of the transmitter's QR codes
+    """
+    return utils.create_qr_renderers(config)
+
+
+def update_frame_status(frame_id: int, fps: int, skipped: int) -> None:
+    """
+    Updates the frame marker status with a newly read frame counter
+    :param frame_id: transmitter frame counter
+    :param fps: transmitter frame rate
+    :param skipped: transmitter frames never read here
+    :return: None
+    """
+    FRAME_STATUS_VAR.set(f"Frame: {frame_id}  Transmitter FPS: {fps}  Frames skipped: {skipped}")
 
 
 def update_image(label: tkinter.Label, frame: np.ndarray) -> None:
@@ -326,17 +498,12 @@ def create_calibration_menu(root: tkinter.Tk, receiver_panel: tkinter.Frame):
         config.QR_MODE = qr_mode_var.get()
 
     def update_qr_pixel_scale(*_):
-        global QR
+        global QR_RENDERERS
 
         if validate_input(qr_pixel_scale_var):
             config.QR_PIXEL_SCALE = qr_pixel_scale_var.get()
 
-            QR = qrcode.main.QRCode(
-                version=13,  # force QR code scale
-                error_correction=qrcode.constants.ERROR_CORRECT_H,  # best error correction (up to 30%)
-                box_size=config.QR_PIXEL_SCALE,  # set pixels for each module of QR code
-                border=config.QR_BORDER_SIZE,  # set QR code border
-            )
+            QR_RENDERERS = create_qr()
 
     def update_qr_overlay_x(*_):
         if validate_input(qr_overlay_x_var):
@@ -375,16 +542,11 @@ def create_calibration_menu(root: tkinter.Tk, receiver_panel: tkinter.Frame):
             pass
 
     def update_qr_border_size(*_):
-        global QR
+        global QR_RENDERERS
         if validate_input(qr_border_size_var):
             config.QR_BORDER_SIZE = qr_border_size_var.get()
 
-            QR = qrcode.main.QRCode(
-                version=13,  # force QR code scale
-                error_correction=qrcode.constants.ERROR_CORRECT_H,  # best error correction (up to 30%)
-                box_size=config.QR_PIXEL_SCALE,  # set pixels for each module of QR code
-                border=config.QR_BORDER_SIZE,  # set QR code border
-            )
+            QR_RENDERERS = create_qr()
 
     # bind events
     qr_mode_var.trace_add("write", update_qr_mode)
@@ -414,9 +576,8 @@ def create_calibration_menu(root: tkinter.Tk, receiver_panel: tkinter.Frame):
 
 
 def update_calibration_ui(panel: tkinter.Frame):
-    global QR
-    # load in frame
-    s, frame = VIDEO_STREAM.read()
+    # newest frame read by the decode thread, which owns the video feed
+    frame = LATEST_FRAME
 
     # ensure frame was loaded
     if frame is not None:
@@ -429,23 +590,14 @@ def update_calibration_ui(panel: tkinter.Frame):
             except cv2.error:
                 pass
 
-            # clear QR code data
-            QR.clear()
-
-            # make qr code
-            QR.make()
-
-            # build QR image
-            qr_img = QR.make_image()
+            # calibrate against the largest QR code the transmitter sends
+            qr_shape = QR_RENDERERS[-1].shape
 
-            # get qr code image as numpy array
-            qr_img = np.array(qr_img, dtype=np.uint8) * 255
+            # create empty QR image to read into
+            qr_img = np.zeros(qr_shape, dtype=np.uint8)
 
             # generate calibration qr data
-            calibration_qr = np.zeros(qr_img.shape, dtype=np.uint8)
-
-            # convert to RGBA
-            calibration_qr = cv2.cvtColor(calibration_qr, cv2.COLOR_RGB2RGBA)
+            calibration_qr = np.zeros((*qr_shape[:2], 4), dtype=np.uint8)
 
             # set channels
             calibration_qr[:, :, 0] = 255  # red
@@ -466,9 +618,6 @@ def update_calibration_ui(panel: tkinter.Frame):
             # set calibration label image
             update_image(CALIBRATION_IMAGE_LABEL, calibration_frame)
 
-            # cast color scale
-            qr_img = cv2.cvtColor(qr_img, cv2.COLOR_GRAY2RGB)
-
             # read in QR code
             qr = overlay_utils.handle_overlay_request(config, "read", frame, qr_img)
 
@@ -486,15 +635,12 @@ def update_calibration_ui(panel: tkinter.Frame):
 
             # ensure decoded objects exist
             if len(decoded) > 0:
-                # decode bytes & load as JSON
+                # decode telemetry records from the payload
                 try:
-                    data = json.loads(decoded[0].data.decode('utf-8'))
+                    records = TELEMETRY_DECODER.decode(decoded[0].data)
 
-                    try:
-                        DEVICE_ID_VAR.set(data[0])
-                    except TypeError:
-                        DEVICE_ID_VAR.set("No ID Found")
-                except AttributeError:
+                    DEVICE_ID_VAR.set(", ".join(str(data[0]) for data in records))
+                except ValueError:
                     DEVICE_ID_VAR.set("No ID Found")
             else:
                 DEVICE_ID_VAR.set("No ID Found")
@@ -503,7 +649,7 @@ def update_calibration_ui(panel: tkinter.Frame):
             update_image(CALIBRATION_QR_LABEL, qr)
 
     # schedule next update
-    panel.after(50, update_calibration_ui, panel)
+    panel.after(UPDATE_INTERVAL_MS, update_calibration_ui, panel)
 
 
 def validate_input(inp: tkinter.IntVar):
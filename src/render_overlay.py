@@ -0,0 +1,90 @@
+# Developed By Keagan Bowman
+# Rebuilds the overlaid (qr-) video of a raw-only recording from the raw video and its telemetry sidecar.
+# Run from the project root, ie: python src/render_overlay.py video-out/10-05-2024-15-29-46.avi
+#
+# render_overlay.py
+from __future__ import annotations
+
+import os
+import cv2
+import sys
+import utils
+import models
+import qr_renderer
+import overlay_utils
+import telemetry_sidecar
+
+
+def render_overlay(video_path: str, output_path: str | None = None) -> int:
+    """
+    Renders the overlaid video of a raw recording, with the QR code and frame marker of every frame as transmitted
+    :param video_path: raw video recorded with RECORD_QR_VIDEO disabled
+    :param output_path: overlaid video path, defaults to the raw video's name with the "qr-" prefix
+    :return: number of frames rendered
+    """
+    overlay_config, frames = telemetry_sidecar.read_sidecar(telemetry_sidecar.sidecar_path(video_path))
+
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(video_path), "qr-" + os.path.basename(video_path))
+
+    # use the overlay settings the video was recorded with, not the current calibration
+    config = models.Config('./config.json')
+
+    for key, value in overlay_config.items():
+        setattr(config, key, value)
+
+    # same QR sizes as the transmitter
+    qr_cache = qr_renderer.QRCache(utils.create_qr_renderer(config, utils.telemetry_payload_length(config)))
+
+    if config.QR_KEYFRAME_INTERVAL > 0:
+        delta_qr_cache = qr_renderer.QRCache(
+            utils.create_qr_renderer(config, utils.telemetry_payload_length(config, delta=True)))
+    else:
+        delta_qr_cache = qr_cache
+
+    video = cv2.VideoCapture(video_path)
+    # same frame rate as the raw video
+    writer = utils.create_video_writer(config, path=output_path, fps=video.get(cv2.CAP_PROP_FPS))
+
+    rendered = 0
+    index = 0
+
+    try:
+        for frame_index, frame_id, fps, is_delta, payload in frames:
+            # frames without an overlay (none are expected) are copied as they are
+            while index <= frame_index:
+                s, frame = video.read()
+
+                if frame is None:
+                    return rendered
+
+                if index == frame_index:
+                    # reshape frame, like the transmitter
+                    if frame.shape[2] == 4:
+                        frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
+
+                    qr_img = (delta_qr_cache if is_delta else qr_cache).get(payload)
+                    frame = overlay_utils.overlay_telemetry(config, frame, qr_img, frame_id, fps)
+                    rendered += 1
+
+                writer.write(frame)
+                index += 1
+    finally:
+        video.release()
+        writer.release()
+
+    return rendered
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python src/render_overlay.py <raw video> [overlaid video]")
+        sys.exit(1)
+
+    rendered = render_overlay(*sys.argv[1:])
+
+    print(f"Rendered {rendered} frames.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Developed By Keagan Bowman
+# Bulk serial line reader for the Blue Raven flight controllers.
+# Instead of one read_until() call per line, every byte waiting on the port is read at once, complete lines are
+# split out of a reused buffer, and handed to a bounded queue. Parsing and publishing happen on the other side of
+# the queue, so a slow consumer can never stall the serial port.
+#
+# serial_reader.py
+from __future__ import annotations
+
+import threading
+from collections import deque
+
+# lines buffered between the serial port and the telemetry consumer, about 1 s of the fastest Blue Raven output
+DEFAULT_QUEUE_SIZE = 256
+
+# serial lines end in \r\n, lines are split on \r and the \n is stripped from the start of the next line
+LINE_END = b"\r"
+
+# start of a status line, which can be dropped in favour of newer status lines
+_STATUS_PREFIX = b"@ BLR_STAT"
+
+
+class LineQueue:
+    """
+    Bounded, thread-safe queue of serial lines.
+
+    Backpressure policy: the producer (the serial port) never blocks. When the queue is full, the oldest BLR_STAT
+    status line is dropped to make room, since a newer status line replaces its values anyway. Event lines (state
+    changes, voltage readings, ...) are only dropped, oldest first, once the queue holds nothing else. Under
+    sustained overload the consumer therefore sees a decimated but current stream of status lines, and every event.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_QUEUE_SIZE):
+        if maxsize < 1:
+            raise ValueError(f"Invalid line queue size '{maxsize}'.")
+
+        self.maxsize = maxsize
+
+        self._lines: deque[bytes] = deque()
+        self._condition = threading.Condition()
+
+        # queue statistics
+        self.queued = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, line: bytes) -> None:
+        """
+        Adds a line, dropping an older line if the queue is full
+        :param line: serial line
+        """
+        with self._condition:
+            if len(self._lines) >= self.maxsize:
+                self._drop_one()
+
+            self._lines.append(line)
+            self.queued += 1
+            self.max_depth = max(self.max_depth, len(self._lines))
+
+            self._condition.notify()
+
+    def get(self, timeout: float | None = None) -> bytes | None:
+        """
+        Removes the oldest line, waiting for one if the queue is empty
+        :param timeout: seconds to wait, or None to wait forever
+        :return: oldest line, or None if the wait timed out
+        """
+        with self._condition:
+            if not self._lines and not self._condition.wait_for(lambda: self._lines, timeout):
+                return None
+
+            return self._lines.popleft()
+
+    def _drop_one(self) -> None:
+        # oldest status line first
+        for index, line in enumerate(self._lines):
+            if line.startswith(_STATUS_PREFIX):
+                del self._lines[index]
+                break
+        else:
+            self._lines.popleft()
+
+        self.dropped += 1
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def stats(self) -> str:
+        return (f"line queue: {self.queued} queued, {self.dropped} dropped, {len(self._lines)}/{self.maxsize} deep "
+                f"({self.max_depth} max)")
+
+
+class SerialLineReader:
+    """
+    Reads a serial stream in bulk and splits it into lines. The stream only needs a read(size) method: pyserial ports
+    are read up to their in_waiting byte count, and anything else (a pty or pipe opened in unbuffered binary mode,
+    for testing) is read up to chunk_size bytes at a time.
+    """
+
+    def __init__(self, stream, lines: LineQueue, chunk_size: int = 4096, max_line_length: int = 1024):
+        self.stream = stream
+        self.lines = lines
+        self.chunk_size = chunk_size
+        self.max_line_length = max_line_length
+
+        # bytes of the incomplete line at the end of the last read, reused between reads
+        self._buffer = bytearray()
+
+        # reader statistics
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.discarded_bytes = 0
+
+    def poll(self) -> int:
+        """
+        Reads every waiting byte (blocking for at most the stream's timeout if there are none), and queues the
+        complete lines
+        :return: number of lines queued
+        """
+        waiting = getattr(self.stream, "in_waiting", None)
+
+        # wait for at least one byte, then take everything that is waiting
+        data = self.stream.read(max(waiting, 1) if waiting is not None else self.chunk_size)
+
+        if not data:
+            return 0
+
+        self.bytes_read += len(data)
+
+        buffer = self._buffer
+        buffer += data
+
+        count = 0
+        start = 0
+        while True:
+            end = buffer.find(LINE_END, start)
+
+            if end < 0:
+                break
+
+            line = bytes(buffer[start:end]).strip(b"\r\n")
+            start = end + len(LINE_END)
+
+            if line:
+                self.lines.put(line)
+                count += 1
+
+        del buffer[:start]
+
+        # a line without an end is noise (or a baud rate mismatch), drop it rather than growing forever
+        if len(buffer) > self.max_line_length:
+            self.discarded_bytes += len(buffer)
+            buffer.clear()
+
+        self.lines_read += count
+
+        return count
+
+    def stats(self) -> str:
+        return (f"serial reader: {self.bytes_read} bytes, {self.lines_read} lines, "
+                f"{self.discarded_bytes} bytes discarded, {self.lines.stats()}")
@@ -0,0 +1,332 @@
+# Developed By Keagan Bowman
+# Per-stage timing for the transmitter and receiver hot paths.
+# Each stage of a frame (capture, QR build, overlay, decode, ...) is timed with the monotonic perf_counter clock into
+# a fixed-bucket histogram. The histograms are dumped periodically as CSV or JSON lines, and served as Prometheus text
+# from a local HTTP endpoint, so it is visible where frame time goes under flight load.
+#
+# stage_metrics.py
+from __future__ import annotations
+
+import os
+import csv
+import json
+import time
+import bisect
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# histogram bucket upper bounds, in seconds (100 us to 1 s), the last bucket holds everything slower
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# dump formats
+METRICS_FORMATS = ("jsonl", "csv")
+
+# dump columns
+_COLUMNS = ("time", "component", "stage", "count", "total_seconds", "max_seconds", "interval_count", "interval_mean",
+            "interval_p50", "interval_p95", "interval_p99")
+
+
+class Histogram:
+    """
+    Timing histogram of one stage. Observations come from the stage's own thread, and are read by the exporter from
+    another, so they are taken under a lock.
+    """
+    __slots__ = ("counts", "count", "total", "max", "_lock")
+
+    def __init__(self):
+        # one count per bucket, plus the overflow bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self) -> tuple[list[int], int, float, float]:
+        """
+        :return: (bucket counts, count, total seconds, max seconds)
+        """
+        with self._lock:
+            return list(self.counts), self.count, self.total, self.max
+
+
+def quantile(counts: list[int], q: float) -> float:
+    """
+    Estimates a quantile from bucket counts, as the upper bound of the bucket it falls in
+    :param counts: bucket counts, as in Histogram.counts
+    :param q: quantile, 0 to 1
+    :return: estimate in seconds, inf if it falls in the overflow bucket, 0 without observations
+    """
+    total = sum(counts)
+
+    if total == 0:
+        return 0.0
+
+    rank = q * total
+    seen = 0
+    for bound, count in zip(BUCKETS + (float("inf"),), counts):
+        seen += count
+
+        if seen >= rank:
+            return bound
+
+    return float("inf")
+
+
+class StageTimer:
+    """
+    Times a block into a stage's histogram: with metrics.timer("capture"): ...
+    A timer keeps its start time, so it must only be used by one thread at a time, like a stage.
+    """
+    __slots__ = ("histogram", "_start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self) -> StageTimer:
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.histogram.observe(time.perf_counter() - self._start)
+
+
+class StageMetrics:
+    """
+    Stage histograms of one component (ie: the transmitter)
+    """
+
+    def __init__(self, component: str):
+        self.component = component
+
+        self._lock = threading.Lock()
+        self._histograms: dict[str, Histogram] = {}
+        self._timers: dict[str, StageTimer] = {}
+
+    def histogram(self, stage: str) -> Histogram:
+        histogram = self._histograms.get(stage)
+
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, Histogram())
+
+        return histogram
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Records one stage time
+        :param stage: stage name
+        :param seconds: time spent, from time.perf_counter() or time.monotonic()
+        """
+        self.histogram(stage).observe(seconds)
+
+    def timer(self, stage: str) -> StageTimer:
+        """
+        :param stage: stage name
+        :return: reusable timer for the stage
+        """
+        timer = self._timers.get(stage)
+
+        if timer is None:
+            timer = self._timers[stage] = StageTimer(self.histogram(stage))
+
+        return timer
+
+    def snapshots(self) -> dict[str, tuple[list[int], int, float, float]]:
+        """
+        :return: Histogram.snapshot() of every stage, in the order stages were first timed
+        """
+        with self._lock:
+            histograms = list(self._histograms.items())
+
+        return {stage: histogram.snapshot() for stage, histogram in histograms}
+
+    def prometheus_text(self) -> str:
+        """
+        :return: every stage histogram in the Prometheus text exposition format
+        """
+        name = f"{self.component}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each {self.component} stage per frame.", f"# TYPE {name} histogram"]
+
+        for stage, (counts, count, total, _) in self.snapshots().items():
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        name = f"{self.component}_stage_max_seconds"
+        lines += [f"# HELP {name} Slowest time of each {self.component} stage.", f"# TYPE {name} gauge"]
+        lines += [f'{name}{{stage="{stage}"}} {snapshot[3]}' for stage, snapshot in self.snapshots().items()]
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        :return: one line per stage, with its mean and p95
+        """
+        lines = []
+        for stage, (counts, count, total, maximum) in self.snapshots().items():
+            mean = total / count * 1000 if count else 0.0
+            lines.append(f"{self.component} {stage}: {count} frames, {mean:.2f} ms mean, "
+                         f"<= {quantile(counts, 0.95) * 1000:g} ms p95, {maximum * 1000:.2f} ms max")
+
+        return "\n".join(lines)
+
+
+class MetricsExporter:
+    """
+    Dumps a component's stage metrics every interval, to CSV or JSON lines in ./metrics-out/, and serves them as
+    Prometheus text at http://<host>:<port>/metrics. Dumped percentiles cover the interval since the last dump.
+    """
+
+    def __init__(self, metrics: StageMetrics, interval: float = 10.0, dump_format: str = "jsonl", port: int = 0,
+                 host: str = "127.0.0.1"):
+        """
+        :param metrics: metrics to export
+        :param interval: seconds between dumps, 0 disables dumps
+        :param dump_format: "jsonl" or "csv"
+        :param port: HTTP port of the Prometheus endpoint, 0 disables the endpoint
+        :param host: address the endpoint listens on
+        """
+        if dump_format not in METRICS_FORMATS:
+            raise ValueError(f"Invalid metrics format '{dump_format}', expected one of {METRICS_FORMATS}.")
+
+        self.metrics = metrics
+        self.interval = interval
+        self.dump_format = dump_format
+        self.port = port
+        self.host = host
+
+        self.path: str | None = None
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._server: ThreadingHTTPServer | None = None
+
+        # (bucket counts, count, total seconds) at the last dump, by stage
+        self._last: dict[str, tuple[list[int], int, float]] = {}
+
+    def start(self) -> None:
+        if self.interval > 0:
+            # check if metrics-out directory exists
+            if not os.path.exists("./metrics-out/"):
+                os.mkdir("./metrics-out/")
+
+            name = datetime.datetime.now().strftime("%m-%d-%Y-%H-%M-%S")
+            self.path = f"./metrics-out/{self.metrics.component}-{name}.{self.dump_format}"
+
+            if self.dump_format == "csv":
+                with open(self.path, "w", newline="") as file:
+                    csv.writer(file).writerow(_COLUMNS)
+
+            self._thread = threading.Thread(target=self._run, name="metrics-dump", daemon=True)
+            self._thread.start()
+
+        if self.port > 0:
+            self._server = ThreadingHTTPServer((self.host, self.port), _handler(self.metrics))
+            self._server.daemon_threads = True
+
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Writes a last dump and closes the endpoint
+        """
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+        self.dump()
+
+    def rows(self) -> list[dict]:
+        """
+        :return: one dump row per stage, with percentiles of the interval since the last call
+        """
+        now = datetime.datetime.now().isoformat(timespec="milliseconds")
+        rows = []
+
+        for stage, (counts, count, total, maximum) in self.metrics.snapshots().items():
+            last_counts, last_count, last_total = self._last.get(stage, ([0] * len(counts), 0, 0.0))
+            self._last[stage] = (counts, count, total)
+
+            interval = [current - previous for current, previous in zip(counts, last_counts)]
+            interval_count = count - last_count
+
+            rows.append({
+                "time": now,
+                "component": self.metrics.component,
+                "stage": stage,
+                "count": count,
+                "total_seconds": total,
+                "max_seconds": maximum,
+                "interval_count": interval_count,
+                "interval_mean": (total - last_total) / interval_count if interval_count else 0.0,
+                "interval_p50": _finite(quantile(interval, 0.5)),
+                "interval_p95": _finite(quantile(interval, 0.95)),
+                "interval_p99": _finite(quantile(interval, 0.99)),
+            })
+
+        return rows
+
+    def dump(self) -> None:
+        rows = self.rows()
+
+        with open(self.path, "a", newline="") as file:
+            if self.dump_format == "csv":
+                writer = csv.DictWriter(file, _COLUMNS)
+                writer.writerows(rows)
+            else:
+                file.writelines(json.dumps(row) + "\n" for row in rows)
+
+
+def _finite(seconds: float) -> float | None:
+    # percentiles past the last bucket are unknown, and JSON has no infinity
+    return seconds if seconds != float("inf") else None
+
+
+def _handler(metrics: StageMetrics) -> type[BaseHTTPRequestHandler]:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = metrics.prometheus_text().encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            # scrapes are not worth a line on the console
+            pass
+
+    return MetricsHandler
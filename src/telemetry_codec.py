@@ -0,0 +1,565 @@
+# Developed By Keagan Bowman
+# Compact QR payload format for Blue Raven telemetry.
+# Records are packed into fixed-width little-endian binary, then base45 encoded. Base45 only uses the QR
+# alphanumeric character set, so the payload is carried in alphanumeric mode (5.5 bits per character) and survives
+# QR readers that treat byte mode payloads as text.
+#
+# telemetry_codec.py
+from __future__ import annotations
+
+import struct
+
+# version of the payload layout, first byte of every payload
+FORMAT_VERSION = 1
+
+# version of the aggregate payload layout, which carries every controller in one payload
+AGGREGATE_FORMAT_VERSION = 2
+
+# version of the keyframe payload layout, an aggregate payload tagged with a keyframe ID
+KEYFRAME_FORMAT_VERSION = 3
+
+# version of the delta payload layout, which carries each record as its difference from a keyframe
+DELTA_FORMAT_VERSION = 4
+
+# base45 alphabet (RFC 9285), which is the QR alphanumeric character set in value order
+BASE45_CHARSET = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+_BASE45_VALUES = {char: value for value, char in enumerate(BASE45_CHARSET)}
+
+# payload header: format version, record count
+_HEADER = struct.Struct("<BB")
+
+# telemetry record, in packing order:
+# device ID, has data flag, device time (ms since midnight), hi-G acceleration X/Y/Z (Gs x100),
+# acceleration X/Y/Z (Gs x1000), pressure (atm x10000), temperature (x100), battery (mV), gyro X/Y/Z (deg/sec x100),
+# tilt, roll (degrees x10), velocity (feet/sec), altitude (feet)
+_RECORD = struct.Struct("<HBI3i3hHhH3i2hhi")
+
+# get_telemetry list index for each packed field after the has data flag (8 is the device time string)
+_RECORD_INDEXES = (8, 15, 16, 17, 1, 2, 3, 11, 10, 9, 12, 13, 14, 6, 7, 4, 5)
+
+# aggregate payload header: format version, record count, base device ID, base device time (ms since midnight)
+_AGGREGATE_HEADER = struct.Struct("<BBHI")
+
+# aggregate telemetry record: the same fields as a record, but the device ID is an offset from the base device ID
+# and the device time is a delta (ms) from the base device time. the delta is 32-bit, since controllers that were
+# started apart (ie: the two simulations) are minutes apart
+_AGGREGATE_RECORD = struct.Struct("<BBi3i3hHhH3i2hhi")
+
+# keyframe payload header: format version, record count, keyframe ID, base device ID, base device time
+_KEYFRAME_HEADER = struct.Struct("<BBBHI")
+
+# delta payload header: format version, record count, ID of the keyframe the deltas are from
+_DELTA_HEADER = struct.Struct("<BBB")
+
+# delta telemetry record: device ID offset, has data flag, then the difference of every aggregate record field from
+# the keyframe's record for the device
+_DELTA_RECORD = struct.Struct("<BB17h")
+
+# number of keyframes kept by a TelemetryDecoder for delta payloads to refer to
+KEYFRAME_HISTORY = 32
+
+# number of fields in a full get_telemetry list
+TELEMETRY_LENGTH = 18
+
+
+def _field_limits(format_chars: str) -> list[tuple[int, int]]:
+    limits = {
+        "B": (0, 0xFF),
+        "H": (0, 0xFFFF),
+        "h": (-0x8000, 0x7FFF),
+        "I": (0, 0xFFFFFFFF),
+        "i": (-0x80000000, 0x7FFFFFFF),
+    }
+
+    result = []
+    count = ""
+    for char in format_chars:
+        if char.isdigit():
+            count += char
+        elif char in limits:
+            result.extend([limits[char]] * int(count or 1))
+            count = ""
+
+    return result
+
+
+# (minimum, maximum) of every packed field after the has data flag; values outside of these saturate
+_LIMITS = _field_limits(_RECORD.format)[2:]
+_AGGREGATE_LIMITS = _field_limits(_AGGREGATE_RECORD.format)[2:]
+_DELTA_LIMITS = _field_limits(_DELTA_RECORD.format)[2:]
+
+
+def _whitening_sequence(length: int, seed: int = 0x39B) -> bytes:
+    # fixed pseudo-random bytes from a linear congruential generator, identical on every platform
+    sequence = bytearray()
+    for _ in range(length):
+        seed = (seed * 1103515245 + 12345) & 0x7FFFFFFF
+        sequence.append(seed >> 16 & 0xFF)
+
+    return bytes(sequence)
+
+
+# keyframe and delta records are mostly zero bytes, which render as large regular areas that QR readers struggle with
+# under a fixed mask pattern, so their payload bodies are XORed with this sequence
+_WHITENING = _whitening_sequence(_AGGREGATE_RECORD.size * 0x100)
+
+
+def base45_encode(data: bytes) -> bytes:
+    """
+    Encodes bytes as base45 text (RFC 9285)
+    :param data: bytes to encode
+    :return: base45 text, 3 characters per 2 bytes
+    """
+    output = bytearray()
+
+    for i in range(0, len(data) - 1, 2):
+        value = data[i] << 8 | data[i + 1]
+        value, c = divmod(value, 45)
+        e, d = divmod(value, 45)
+        output += bytes((BASE45_CHARSET[c], BASE45_CHARSET[d], BASE45_CHARSET[e]))
+
+    # trailing single byte is 2 characters
+    if len(data) % 2 == 1:
+        e, c = divmod(data[-1], 45)
+        output += bytes((BASE45_CHARSET[c], BASE45_CHARSET[e]))
+
+    return bytes(output)
+
+
+def base45_decode(text: bytes) -> bytes:
+    """
+    Decodes base45 text (RFC 9285)
+    :param text: base45 text to decode
+    :return: decoded bytes
+    :raises ValueError: if the text is not valid base45
+    """
+    try:
+        values = [_BASE45_VALUES[char] for char in text]
+    except KeyError:
+        raise ValueError("Invalid base45 character.")
+
+    if len(values) % 3 == 1:
+        raise ValueError("Invalid base45 length.")
+
+    output = bytearray()
+
+    for i in range(0, len(values), 3):
+        chunk = values[i:i + 3]
+        value = sum(v * 45 ** n for n, v in enumerate(chunk))
+
+        if len(chunk) == 3:
+            if value > 0xFFFF:
+                raise ValueError("Invalid base45 chunk.")
+            output += value.to_bytes(2, "big")
+        else:
+            if value > 0xFF:
+                raise ValueError("Invalid base45 chunk.")
+            output.append(value)
+
+    return bytes(output)
+
+
+def _time_to_ms(time_string: str) -> int:
+    hours, minutes, seconds = time_string.split(":")
+
+    return round((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+
+
+def _ms_to_time(ms: int) -> str:
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours:02}:{minutes:02}:{seconds:02}.{ms:03}"
+
+
+def _record_values(telemetry: list, limits: list[tuple[int, int]], base_time: int = 0) -> list[int]:
+    """
+    Collects the packed field values of a get_telemetry list, saturated to each field's limits
+    """
+    values = []
+    for index, (minimum, maximum) in zip(_RECORD_INDEXES, limits):
+        value = telemetry[index]
+
+        if index == 8:
+            value = _time_to_ms(value) - base_time
+
+        values.append(min(max(int(value), minimum), maximum))
+
+    return values
+
+
+def _telemetry_list(device: int, has_data: int, values: tuple | list, base_time: int = 0) -> list:
+    """
+    Rebuilds a get_telemetry list from packed field values
+    """
+    if not has_data:
+        return [device]
+
+    telemetry = [0] * TELEMETRY_LENGTH
+    telemetry[0] = device
+
+    for index, value in zip(_RECORD_INDEXES, values):
+        telemetry[index] = value
+
+    telemetry[8] = _ms_to_time(telemetry[8] + base_time)
+
+    return telemetry
+
+
+def pack_record(telemetry: list) -> bytes:
+    """
+    Packs a get_telemetry list into a fixed-width record
+    :param telemetry: telemetry list, or [device ID] when the device has no data yet
+    :return: packed record
+    """
+    if len(telemetry) < TELEMETRY_LENGTH:
+        # no telemetry yet, send an empty record for the device
+        return _RECORD.pack(int(telemetry[0]), 0, *[0] * len(_LIMITS))
+
+    return _RECORD.pack(int(telemetry[0]), 1, *_record_values(telemetry, _LIMITS))
+
+
+def unpack_record(record: bytes | memoryview) -> list:
+    """
+    Unpacks a fixed-width record into a get_telemetry list
+    :param record: packed record
+    :return: telemetry list, or [device ID] when the device had no data
+    """
+    device, has_data, *values = _RECORD.unpack(record)
+
+    return _telemetry_list(device, has_data, values)
+
+
+def payload_length(record_count: int, aggregate: bool = False, keyframe: bool = False, delta: bool = False) -> int:
+    """
+    :param record_count: number of records in a payload
+    :param aggregate: whether the payload uses the aggregate layout
+    :param keyframe: whether the payload uses the keyframe layout
+    :param delta: whether the payload uses the delta layout
+    :return: length of the encoded payload, in characters
+    """
+    if delta:
+        size = _DELTA_HEADER.size + _DELTA_RECORD.size * record_count
+    elif keyframe:
+        size = _KEYFRAME_HEADER.size + _AGGREGATE_RECORD.size * record_count
+    elif aggregate:
+        size = _AGGREGATE_HEADER.size + _AGGREGATE_RECORD.size * record_count
+    else:
+        size = _HEADER.size + _RECORD.size * record_count
+
+    return size // 2 * 3 + (2 if size % 2 == 1 else 0)
+
+
+def encode_payload(records: list[list]) -> bytes:
+    """
+    Encodes telemetry lists into a QR payload
+    :param records: get_telemetry lists to encode
+    :return: base45 payload text
+    """
+    data = _HEADER.pack(FORMAT_VERSION, len(records)) + b"".join(pack_record(record) for record in records)
+
+    return base45_encode(data)
+
+
+def _aggregate_records(records: list[list]) -> tuple[int, int, list[tuple]]:
+    """
+    Collects the aggregate record fields of telemetry lists
+    :return: base device ID, base device time, and (device ID offset, has data flag, *values) for each record
+    """
+    base_device = min((int(record[0]) for record in records), default=0)
+    base_time = min((_time_to_ms(record[8]) for record in records if len(record) >= TELEMETRY_LENGTH), default=0)
+
+    fields = []
+    for record in records:
+        offset = int(record[0]) - base_device
+
+        if offset > 0xFF:
+            raise ValueError(f"Device ID {record[0]} is too far from device ID {base_device} to aggregate.")
+
+        if len(record) < TELEMETRY_LENGTH:
+            fields.append((offset, 0, *[0] * len(_AGGREGATE_LIMITS)))
+        else:
+            fields.append((offset, 1, *_record_values(record, _AGGREGATE_LIMITS, base_time)))
+
+    return base_device, base_time, fields
+
+
+def encode_aggregate_payload(records: list[list]) -> bytes:
+    """
+    Encodes the latest telemetry of every controller into one QR payload. The device ID and device time are shared
+    in the header, and each record only carries its offset from them.
+    :param records: get_telemetry lists to encode, one per controller
+    :return: base45 payload text
+    """
+    base_device, base_time, fields = _aggregate_records(records)
+
+    data = _AGGREGATE_HEADER.pack(AGGREGATE_FORMAT_VERSION, len(records), base_device, base_time)
+    data += b"".join(_AGGREGATE_RECORD.pack(*record) for record in fields)
+
+    return base45_encode(data)
+
+
+def _unpack_records(data: bytes, header: struct.Struct, record: struct.Struct) -> tuple[tuple, list[tuple]]:
+    """
+    Splits a decoded payload into its header fields and record fields
+    :raises ValueError: if the payload length does not match its header
+    """
+    if len(data) < header.size:
+        raise ValueError("Payload is too short.")
+
+    _, count, *shared = header.unpack_from(data)
+
+    if len(data) != header.size + record.size * count:
+        raise ValueError("Payload length does not match its record count.")
+
+    return tuple(shared), [record.unpack_from(data, offset) for offset in range(header.size, len(data), record.size)]
+
+
+def _whiten(data: bytes | bytearray) -> bytes:
+    """
+    XORs data with the whitening sequence, which both whitens and restores it
+    """
+    return bytes(byte ^ key for byte, key in zip(data, _WHITENING))
+
+
+def _payload_bytes(payload: bytes | str) -> bytes:
+    """
+    Decodes payload text into bytes, restoring whitened payload bodies
+    """
+    if isinstance(payload, str):
+        payload = payload.encode("ascii", errors="replace")
+
+    data = base45_decode(payload)
+
+    if len(data) < 1:
+        raise ValueError("Payload is too short.")
+
+    if data[0] == KEYFRAME_FORMAT_VERSION:
+        data = data[:_KEYFRAME_HEADER.size] + _whiten(data[_KEYFRAME_HEADER.size:])
+    elif data[0] == DELTA_FORMAT_VERSION:
+        data = data[:_DELTA_HEADER.size] + _whiten(data[_DELTA_HEADER.size:])
+
+    return data
+
+
+def _decode_records(data: bytes) -> list[list]:
+    """
+    Decodes the records of any payload that does not depend on an earlier payload
+    """
+    version = data[0]
+
+    if version == FORMAT_VERSION:
+        _, records = _unpack_records(data, _HEADER, _RECORD)
+
+        return [_telemetry_list(device, has_data, values) for device, has_data, *values in records]
+
+    if version == AGGREGATE_FORMAT_VERSION:
+        header = _AGGREGATE_HEADER
+    elif version == KEYFRAME_FORMAT_VERSION:
+        header = _KEYFRAME_HEADER
+    elif version == DELTA_FORMAT_VERSION:
+        raise ValueError("Delta payloads can only be decoded by a TelemetryDecoder that has seen their keyframe.")
+    else:
+        raise ValueError(f"Unsupported payload format version '{version}'.")
+
+    shared, records = _unpack_records(data, header, _AGGREGATE_RECORD)
+    base_device, base_time = shared[-2:]
+
+    return [
+        _telemetry_list(base_device + offset, has_data, values, base_time)
+        for offset, has_data, *values in records
+    ]
+
+
+def decode_payload(payload: bytes | str) -> list[list]:
+    """
+    Decodes a QR payload into telemetry lists
+    :param payload: base45 payload text
+    :return: decoded get_telemetry lists
+    :raises ValueError: if the payload is invalid, or is a delta payload
+    """
+    return _decode_records(_payload_bytes(payload))
+
+
+class _Keyframe:
+    """
+    Aggregate record fields of a keyframe, which delta payloads are built against
+    """
+    __slots__ = ("keyframe_id", "base_device", "base_time", "records", "age")
+
+    def __init__(self, keyframe_id: int, base_device: int, base_time: int, records: list[tuple]):
+        self.keyframe_id = keyframe_id
+        self.base_device = base_device
+        self.base_time = base_time
+
+        # (device ID offset, has data flag, *values) for each record
+        self.records = records
+
+        # frames sent from this keyframe, including the keyframe itself
+        self.age = 1
+
+
+class TelemetryEncoder:
+    """
+    Encodes telemetry payloads frame by frame. When a keyframe interval is set, a full keyframe is sent for a set of
+    controllers every keyframe_interval frames, and the frames in between only carry each record's difference from
+    that keyframe. Deltas are always taken from the keyframe rather than the previous frame, so a lost delta frame
+    never affects the frames after it.
+    """
+
+    def __init__(self, keyframe_interval: int = 0, aggregate: bool = False):
+        """
+        :param keyframe_interval: frames between keyframes for the same controllers, or 0 to send full payloads
+        :param aggregate: whether full payloads use the aggregate layout, when no keyframe interval is set
+        """
+        self.keyframe_interval = keyframe_interval
+        self.aggregate = aggregate
+
+        # payload counters, for reporting
+        self.keyframes = 0
+        self.deltas = 0
+
+        # device IDs of a payload -> last keyframe sent for them
+        self._keyframes: dict[tuple, _Keyframe] = {}
+        self._next_keyframe_id = 0
+
+    def encode(self, records: list[list]) -> tuple[bytes, bool]:
+        """
+        Encodes the telemetry for the next frame
+        :param records: get_telemetry lists to encode
+        :return: base45 payload text, and whether it is a delta payload
+        """
+        if self.keyframe_interval <= 0:
+            self.keyframes += 1
+
+            if self.aggregate:
+                return encode_aggregate_payload(records), False
+
+            return encode_payload(records), False
+
+        devices = tuple(int(record[0]) for record in records)
+        keyframe = self._keyframes.get(devices)
+
+        if keyframe is not None and keyframe.age < self.keyframe_interval:
+            deltas = _delta_records(keyframe, records)
+
+            # fall through to a keyframe when a record has moved too far from the keyframe to fit a delta
+            if deltas is not None:
+                keyframe.age += 1
+                self.deltas += 1
+
+                data = _DELTA_HEADER.pack(DELTA_FORMAT_VERSION, len(records), keyframe.keyframe_id)
+                data += _whiten(b"".join(_DELTA_RECORD.pack(*record) for record in deltas))
+
+                return base45_encode(data), True
+
+        keyframe = _Keyframe(self._next_keyframe_id, *_aggregate_records(records))
+
+        self._keyframes[devices] = keyframe
+        self._next_keyframe_id = (self._next_keyframe_id + 1) % 0x100
+        self.keyframes += 1
+
+        data = _KEYFRAME_HEADER.pack(KEYFRAME_FORMAT_VERSION, len(records), keyframe.keyframe_id,
+                                     keyframe.base_device, keyframe.base_time)
+        data += _whiten(b"".join(_AGGREGATE_RECORD.pack(*record) for record in keyframe.records))
+
+        return base45_encode(data), False
+
+    def stats(self) -> str:
+        total = self.keyframes + self.deltas
+
+        return (f"telemetry payloads: {self.keyframes} keyframes, {self.deltas} deltas "
+                f"({self.deltas / total if total else 0:.1%} deltas)")
+
+
+def _delta_records(keyframe: _Keyframe, records: list[list]) -> list[tuple] | None:
+    """
+    Builds the delta records of telemetry lists against a keyframe for the same devices
+    :return: (device ID offset, has data flag, *deltas) for each record, or None if a record cannot be sent as a delta
+    """
+    deltas = []
+    for record, (offset, key_has_data, *key_values) in zip(records, keyframe.records):
+        if len(record) < TELEMETRY_LENGTH:
+            if key_has_data:
+                return None
+
+            deltas.append((offset, 0, *[0] * len(_DELTA_LIMITS)))
+            continue
+
+        # a record that had no data at the keyframe needs a new keyframe
+        if not key_has_data:
+            return None
+
+        values = _record_values(record, _AGGREGATE_LIMITS, keyframe.base_time)
+        differences = [value - key_value for value, key_value in zip(values, key_values)]
+
+        for difference, (minimum, maximum) in zip(differences, _DELTA_LIMITS):
+            if difference < minimum or difference > maximum:
+                return None
+
+        deltas.append((offset, 1, *differences))
+
+    return deltas
+
+
+class TelemetryDecoder:
+    """
+    Decodes telemetry payloads frame by frame, rebuilding full records from delta payloads and the keyframe they were
+    built against. Delta payloads whose keyframe was lost raise ValueError until the next keyframe is received.
+    """
+
+    def __init__(self, max_keyframes: int = KEYFRAME_HISTORY):
+        """
+        :param max_keyframes: number of recent keyframes kept for delta payloads to refer to
+        """
+        self.max_keyframes = max_keyframes
+
+        # keyframe ID -> keyframe, oldest first
+        self._keyframes: dict[int, _Keyframe] = {}
+
+    def decode(self, payload: bytes | str) -> list[list]:
+        """
+        Decodes a QR payload into telemetry lists
+        :param payload: base45 payload text
+        :return: decoded get_telemetry lists
+        :raises ValueError: if the payload is invalid, or is a delta payload without its keyframe
+        """
+        data = _payload_bytes(payload)
+        version = data[0]
+
+        if version == KEYFRAME_FORMAT_VERSION:
+            (keyframe_id, base_device, base_time), records = _unpack_records(data, _KEYFRAME_HEADER,
+                                                                             _AGGREGATE_RECORD)
+
+            # replace any older keyframe with the same (wrapped) ID
+            self._keyframes.pop(keyframe_id, None)
+            self._keyframes[keyframe_id] = _Keyframe(keyframe_id, base_device, base_time, records)
+
+            # forget the oldest keyframe
+            if len(self._keyframes) > self.max_keyframes:
+                del self._keyframes[next(iter(self._keyframes))]
+
+            return [
+                _telemetry_list(base_device + offset, has_data, values, base_time)
+                for offset, has_data, *values in records
+            ]
+
+        if version != DELTA_FORMAT_VERSION:
+            return _decode_records(data)
+
+        (keyframe_id,), deltas = _unpack_records(data, _DELTA_HEADER, _DELTA_RECORD)
+        keyframe = self._keyframes.get(keyframe_id)
+
+        if keyframe is None or len(keyframe.records) != len(deltas):
+            raise ValueError(f"Keyframe {keyframe_id} for delta payload was not received.")
+
+        telemetry = []
+        for (offset, has_data, *differences), (key_offset, _, *key_values) in zip(deltas, keyframe.records):
+            if offset != key_offset:
+                raise ValueError(f"Delta payload does not match keyframe {keyframe_id}.")
+
+            values = [key_value + difference for key_value, difference in zip(key_values, differences)]
+            telemetry.append(_telemetry_list(keyframe.base_device + offset, has_data, values, keyframe.base_time))
+
+        return telemetry
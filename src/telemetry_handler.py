@@ -4,74 +4,96 @@
 # telemetry_handler.py
 from __future__ import annotations
 
-import re
 import time
 import serial
 import threading
 import db_handler
-from psycopg2.extensions import connection
-
-"""
-# regex expression for the telemetry data. the resulting groups (on a successful match) should look like the following:
-group 1: current year
-group 2: current month
-group 3: current day
-group 4: current time
-groups 5-7: hi-G Acceleration X, Y, Z (in Gs  x100)
-groups 8-10: Acceleration X, Y, Z (in Gs x1000)
-groups 11, 12: barometric pressure (atm x10000) and temperature (x100)
-group 13: battery voltage (in mV)
-groups 14-16: gryo X, Y, Z (in deg/sec x100)
-groups 17, 18: tilt angle, roll angle  (in degrees x10)
-group 19: vertical velocity (feet/sec)
-group 20: altitude above ground level (feet)
-"""
-
-TELEMETRY_RE = re.compile(r"([0-9]*)\s([0-9]*)\s([0-9]*)\s([0-9]*:[0-9]*:[0-9]*.[0-9]*)\sHG:\s*(-?[0-9]*)\s*(-?["
-                          r"0-9]*)\s*(-?[0-9]*)\s*XYZ:\s*(-?[0-9]*)\s*(-?[0-9]*)\s*(-?[0-9]*)\s*Bo:\s*(-?[0-9]*)\s*("
-                          r"-?[0-9]*)\s*bt:\s*(-?[0-9]*)\s*gy:\s*(-?[0-9]*)\s*(-?[0-9]*)\s*(-?[0-9]*)\s*ang:\s*(-?["
-                          r"0-9]*)\s*(-?[0-9]*)\s*vel\s*(-?[0-9]*)\s*AGL\s*(-?[0-9]*)")
-
-
-def get_telemetry(db: connection, device: int) -> list:
-    """
-    Grabs telemetry logged in database by a specific device, parses it, and returns a dictionary
-    :return:
+import serial_reader
+import telemetry_store
+import telemetry_parser
+import telemetry_writer
+import telemetry_simulation
+
+# set to stop the reader and simulator threads
+STOP_STREAMS = threading.Event()
+
+# reader and simulator threads started by this module
+_stream_threads: list[threading.Thread] = []
+
+
+def parse_telemetry(device: int, data: str | bytes) -> list | None:
+    """
+    Parses a Blue Raven telemetry line
+    :param device: id of the device that sent the line
+    :param data: telemetry line
+    :return: telemetry list, or None if the line is not telemetry or fails its CRC
     """
+    record = telemetry_parser.parse_status(data)
 
-    # grab most recent data from the database
-    data = db_handler.get_recent_data(db, device)
+    if record is None:
+        return None
 
-    # match data with regex string
-    try:
-        data = TELEMETRY_RE.findall(data)[0]
-    except IndexError:
-        # data not found, return empty telemetry
-        return [int(device)]
-
-    # assign telemetry data.
-    telemetry = [
-        int(device),    # 0 - device ID
-        int(data[7]),   # 1 - Acceleration X
-        int(data[8]),   # 2 - Acceleration Y
-        int(data[9]),   # 3 - Acceleration Z
-        int(data[18]),  # 4 - Velocity
-        int(data[19]),  # 5 - Altitude
-        int(data[16]),  # 6 - Tilt
-        int(data[17]),  # 7 - Roll
-        data[3],        # 8 - Time
-        int(data[12]),  # 9 - Battery
-        int(data[11])   # 10 - Temperature
-    ]
-
-    return telemetry
-
-
-def start_raven_streams(db: connection, ports: list[str]) -> list[int]:
+    return record.to_list(device)
+
+
+def get_telemetry(device: int, store: telemetry_store.TelemetryStore = telemetry_store.STORE) -> list:
+    """
+    Grabs the latest telemetry published by a specific device
+    :param device: id of the device
+    :param store: store the telemetry threads publish to
+    :return: telemetry list, or [device ID] if the device has not sent telemetry yet
+    """
+    return store.get(device)[1]
+
+
+def publish_telemetry(writer: telemetry_writer.TelemetryWriter, device: int, data: bytes,
+                      store: telemetry_store.TelemetryStore = telemetry_store.STORE,
+                      record: telemetry_parser.StatusRecord | None = None) -> None:
+    """
+    Parses a telemetry line once, publishes it to the latest-value store, then queues it to be archived in the
+    database
+    :param writer: batched writer that archives the line
+    :param device: id of the device that sent the line
+    :param data: telemetry line
+    :param store: store to publish to
+    :param record: already parsed record of the line (ie: from a preloaded simulation), skips parsing
+    :return: None
+    """
+    if record is not None:
+        telemetry = record.to_list(device)
+    else:
+        telemetry = parse_telemetry(device, data)
+
+    # publish first, so the video loop never waits on the database
+    if telemetry is not None:
+        store.publish(device, telemetry)
+
+    # queue the line and its parsed values for the next database batch
+    writer.add(device, data, telemetry)
+
+
+def register_device(port: str) -> int:
+    """
+    Gets the ID of a device, adding it to the database if it is new
+    :param port: port identifier of the device (or simulator name)
+    :return: device ID
+    """
+    # attempt to get the device ID
+    device = db_handler.get_device(port)
+
+    # check if device was found
+    if device is None:
+        # no device found, create a new one
+        device = db_handler.add_device(port)
+
+    return device
+
+
+def start_raven_streams(ports: list[str], writer: telemetry_writer.TelemetryWriter) -> list[int]:
     """
     Start the Blue Raven monitor program
-    :param db: Database connection
     :param ports: Ports to attempt to connect to
+    :param writer: batched writer shared by the reader threads
     :return: A list of the devices IDs in the order the ports were passed in
     """
     threads = []
@@ -79,34 +101,33 @@ def start_raven_streams(db: connection, ports: list[str]) -> list[int]:
 
     # loop through all given ports for the raven streams
     for port in ports:
-        # attempt to get the device ID
-        device = db_handler.get_device(db, port)
-
-        # check if device was found
-        if device is None:
-            # no device found, create a new one
-            device = db_handler.add_device(db, port)
+        # get the device ID, adding the device if needed
+        device = register_device(port)
 
         # grab device IDs
         device_ids.append(device)
 
         # create new thread and append it to thread list
-        threads.append(threading.Thread(target=telemetry_reader, args=[port, device]))
+        threads.append(threading.Thread(target=telemetry_reader, args=[port, device, writer]))
 
     # start threads
     for thread in threads:
         thread.start()
 
+    _stream_threads.extend(threads)
+
     # return collected device IDs
     return device_ids
 
 
-def simulate_raven_streams(db: connection, count: int, simulation_files: list[str]) -> list[int]:
+def simulate_raven_streams(count: int, simulation_files: list[str], writer: telemetry_writer.TelemetryWriter,
+                           speed: float = 1.0) -> list[int]:
     """
     Starts a simulation of a Blue Raven Flight Controller using the information located in ./simulations/
-    :param db: Database connection
     :param count: Number of simulated flight controllers to start
     :param simulation_files: List of files to use for simulation
+    :param writer: batched writer shared by the simulator threads
+    :param speed: replay speed, relative to the file's timestamps (0 replays as fast as possible)
     :return: A list of "ids" that correlate to the simulated ravens
     """
     threads = []
@@ -116,48 +137,58 @@ def simulate_raven_streams(db: connection, count: int, simulation_files: list[st
     for i in range(1, count + 1):
         simulator = f"SIMULATOR-{i}"
 
-        # attempt to get the device ID
-        device = db_handler.get_device(db, simulator)
-
-        # check if device was found
-        if device is None:
-            # no device found, create a new one
-            device = db_handler.add_device(db, simulator)
+        # get the device ID, adding the device if needed
+        device = register_device(simulator)
 
         # grab device IDs
         device_ids.append(device)
 
         # create new thread and append it to thread list
         threads.append(threading.Thread(target=telemetry_simulator,
-                                        args=[simulation_files[i % len(simulation_files)], device])
+                                        args=[simulation_files[i % len(simulation_files)], device, writer, speed])
                        )
 
     # start threads
     for thread in threads:
         thread.start()
 
+    _stream_threads.extend(threads)
+
     # return collected device IDs
     return device_ids
 
 
-def telemetry_reader(port: str, device: int) -> None:
+def stop_streams(timeout: float = 5.0) -> None:
+    """
+    Stops the reader and simulator threads and waits for them to exit, so no more lines are given to their writer
+    :param timeout: seconds to wait for each thread
+    :return: None
+    """
+    STOP_STREAMS.set()
+
+    for thread in _stream_threads:
+        thread.join(timeout)
+
+    _stream_threads.clear()
+
+
+def telemetry_reader(port: str, device: int, writer: telemetry_writer.TelemetryWriter) -> None:
     """
     Telemetry reader made to run in a separate thread
     :param port: Port where serial stream is located
     :param device: id of the device being read
+    :param writer: batched writer that archives the telemetry lines
     :return:
     """
 
-    # create database connection
-    db = db_handler.establish_db()
-
     # create connection to port
     conn = serial.Serial(
         port=port,
         baudrate=921600,
         bytesize=serial.EIGHTBITS,
         parity=serial.PARITY_NONE,
-        stopbits=serial.STOPBITS_ONE
+        stopbits=serial.STOPBITS_ONE,
+        timeout=0.1  # return from reads periodically to check for shutdown
     )
 
     # close the connection if it already exists
@@ -168,53 +199,77 @@ def telemetry_reader(port: str, device: int) -> None:
     conn.open()
 
     # mark device as active in database
-    db_handler.set_device_status(db, device, True)
+    db_handler.set_device_status(device, True)
 
-    while True:
-        # read in data until next carriage return
-        data = conn.read_until(b"\r")
+    try:
+        read_stream(conn, device, writer)
+    finally:
+        conn.close()
 
-        # add data to database
-        db_handler.add_data(db, device, data)
 
+def read_stream(stream, device: int, writer: telemetry_writer.TelemetryWriter,
+                queue_size: int = serial_reader.DEFAULT_QUEUE_SIZE) -> None:
+    """
+    Reads a serial stream in bulk on a second thread, and publishes its lines until the streams are stopped. Lines
+    are passed through a bounded serial_reader.LineQueue, see it for the policy used when publishing falls behind.
+    :param stream: open serial port, or a stand-in with a read(size) method (ie: a pty opened with buffering=0)
+    :param device: id of the device being read
+    :param writer: batched writer that archives the telemetry lines
+    :param queue_size: number of lines buffered between the stream and publishing
+    :return: None
+    """
+    lines = serial_reader.LineQueue(queue_size)
+    reader = serial_reader.SerialLineReader(stream, lines)
 
-def telemetry_simulator(sim_file: str, device: int) -> None:
+    def pump():
+        # pull every waiting byte off the stream, never waiting on publishing or the database
+        while not STOP_STREAMS.is_set():
+            reader.poll()
+
+    pump_thread = threading.Thread(target=pump, name=f"serial-reader-{device}", daemon=True)
+    pump_thread.start()
+
+    while not STOP_STREAMS.is_set():
+        line = lines.get(timeout=0.5)
+
+        if line is not None:
+            # publish data and queue it for the database
+            publish_telemetry(writer, device, line)
+
+    pump_thread.join()
+
+    # publish the lines read before the streams were stopped
+    while (line := lines.get(timeout=0)) is not None:
+        publish_telemetry(writer, device, line)
+
+    print(reader.stats())
+
+
+def telemetry_simulator(sim_file: str, device: int, writer: telemetry_writer.TelemetryWriter,
+                        speed: float = 1.0) -> None:
     """
     Telemetry simulator made to run in a seperated thread
     :param sim_file: Data file that contains the simulated data
     :param device: id of the device being read
+    :param writer: batched writer that archives the telemetry lines
+    :param speed: replay speed, relative to the file's timestamps (0 replays as fast as possible)
     :return:
     """
-    # create database connection
-    db = db_handler.establish_db()
-
     # mark device as active in database
-    db_handler.set_device_status(db, device, True)
-
-    # create an infinite loop of opening, reading, and reopening
-    while True:
-        # open and real file as bytes
-        with open(sim_file, "rb") as file:
-            # loop until data is None
-            while True:
-                # read in line from file
-                data = file.readline()
-
-                if not data:
-                    # close when file has ended
-                    file.close()
-                    break
-
-                # ensure this is ONLY telemetry data (since event data is unused right now)
-                if b"@ BLR_STAT" not in data:
-                    # retrieve next line
-                    continue
-
-                # clean data of newlines/carriage returns
-                data = data.replace(b"\n", b"").replace(b"\r", b"")
-
-                # add data to database
-                db_handler.add_data(db, device, data)
-
-                # wait to simulate blue raven write speeds, which is about 0.22 seconds
-                time.sleep(0.22)
+    db_handler.set_device_status(device, True)
+
+    trace = telemetry_simulation.load_trace(sim_file)
+    start = time.monotonic()
+
+    # replay the file on its own timestamps until the streams are stopped
+    for offset, data, record in trace.schedule():
+        if speed > 0:
+            delay = start + offset / speed - time.monotonic()
+
+            if delay > 0 and STOP_STREAMS.wait(delay):
+                return
+        elif STOP_STREAMS.is_set():
+            return
+
+        # publish data and queue it for the database
+        publish_telemetry(writer, device, data, record=record)
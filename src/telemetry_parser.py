@@ -0,0 +1,304 @@
+# Developed By Keagan Bowman
+# Fixed-layout parser for the Blue Raven "BLR_STAT" status line.
+# Status lines are split into whitespace separated tokens, checked against the field labels at their fixed
+# positions, and verified against the CRC at the end of the line, so corrupt or truncated serial lines are dropped
+# instead of being partially matched.
+#
+# telemetry_parser.py
+from __future__ import annotations
+
+import operator
+
+"""
+# a status line looks like the following:
+@ BLR_STAT 189 2024 10 05 15:29:46.565 HG:     -3     11   -102 XYZ:     14     40   -993 Bo:  9987 7608 bt: 3283 gy:     0     0     0 ang:      0      0 vel      0 AGL      -1 CRC: DD72
+
+token 2: line length field (unused)
+tokens 3-5: current year, month, day
+token 6: current time
+tokens 8-10: hi-G Acceleration X, Y, Z (in Gs  x100)
+tokens 12-14: Acceleration X, Y, Z (in Gs x1000)
+tokens 16, 17: barometric pressure (atm x10000) and temperature (x100)
+token 19: battery voltage (in mV)
+tokens 21-23: gryo X, Y, Z (in deg/sec x100)
+tokens 25, 26: tilt angle, roll angle  (in degrees x10)
+token 28: vertical velocity (feet/sec)
+token 30: altitude above ground level (feet)
+
+the CRC is a CRC-16/BUYPASS (polynomial 0x8005, no reflection, initial value 0) of every byte before " CRC: "
+"""
+
+# number of tokens in a status line, without the CRC
+STATUS_TOKENS = 31
+
+# field labels and their token positions
+_LABELS = ((1, b"BLR_STAT"), (7, b"HG:"), (11, b"XYZ:"), (15, b"Bo:"), (18, b"bt:"), (20, b"gy:"), (24, b"ang:"),
+           (27, b"vel"), (29, b"AGL"))
+
+# the label tokens of a line, and the labels they must match, compared in one step
+_LABEL_TOKENS = operator.itemgetter(*[index for index, _ in _LABELS])
+_LABEL_VALUES = tuple(label for _, label in _LABELS)
+
+# the integer tokens of a line, in StatusRecord field order (the time, token 6, is kept as text)
+_INTEGER_TOKENS = operator.itemgetter(3, 4, 5, 8, 9, 10, 12, 13, 14, 16, 17, 19, 21, 22, 23, 25, 26, 28, 30)
+
+_CRC_MARKER = b" CRC: "
+
+# distinct integer tokens kept by _INTEGERS
+_INTEGER_CACHE_SIZE = 4096
+
+
+class _IntegerCache(dict):
+    """
+    Integer value of each token, converted once. Readings repeat from line to line (and across devices), so most
+    tokens are a dictionary hit instead of an int() call. Once full, new tokens are converted without being kept
+    """
+
+    def __missing__(self, token: bytes) -> int:
+        value = int(token)
+
+        if len(self) < _INTEGER_CACHE_SIZE:
+            self[token] = value
+
+        return value
+
+
+_INTEGERS = _IntegerCache()
+
+
+def _crc_table(poly: int) -> list[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+
+    return table
+
+
+# CRC of a single byte
+_CRC_TABLE = _crc_table(0x8005)
+
+# The CRC is the remainder of the line, as a polynomial over GF(2), times x^16 and divided by
+# x^16 + x^15 + x^2 + 1 = (x + 1)(x^15 + x + 1). Rather than stepping through the line a byte at a time in Python, the
+# whole line is taken as one integer and reduced with a few integer operations: the remainder by (x + 1) is the
+# line's bit parity, and since x^(15 * 2^j) = x^(2^j) + 1 modulo the trinomial x^15 + x + 1, everything above bit
+# 15 * 2^j is folded down with two shifts and XORs. The remainder of the product is then rebuilt from both.
+_CRC_TRINOMIAL = 0x8003
+
+# lines up to this long are folded, so the folds below always bring them down to 30 bits
+_CRC_FOLD_BYTES = 255
+
+# masks of the bits below each fold
+_CRC_MASK_960 = (1 << 960) - 1
+_CRC_MASK_480 = (1 << 480) - 1
+_CRC_MASK_240 = (1 << 240) - 1
+_CRC_MASK_120 = (1 << 120) - 1
+_CRC_MASK_60 = (1 << 60) - 1
+_CRC_MASK_30 = (1 << 30) - 1
+
+
+def _crc_fold_table(shift: int) -> list[int]:
+    """
+    Builds a table of the remainders by x^15 + x + 1 of each 15-bit value times x^shift
+    :param shift: power of x the values are multiplied by
+    :return: 2^15 remainders, indexed by value
+    """
+    # remainder of each single bit times x^shift
+    bits = []
+    remainder = 1
+    for power in range(shift + 15):
+        if power >= shift:
+            bits.append(remainder)
+
+        remainder <<= 1
+        if remainder & 0x8000:
+            remainder ^= _CRC_TRINOMIAL
+
+    # the remainder of a value is the XOR of the remainders of its bits
+    table = [0] * (1 << 15)
+    for value in range(1, 1 << 15):
+        low_bit = value & -value
+        table[value] = table[value ^ low_bit] ^ bits[low_bit.bit_length() - 1]
+
+    return table
+
+
+# remainder by x^15 + x + 1 of the high and low 15 bits of a folded line, times x^16
+_CRC_FOLD_HIGH = _crc_fold_table(31)
+_CRC_FOLD_LOW = _crc_fold_table(16)
+
+
+def crc16(data: bytes) -> int:
+    """
+    CRC-16/BUYPASS of a byte string, as used by the Blue Raven serial output
+    :param data: bytes to check
+    :return: 16-bit CRC
+    """
+    if len(data) > _CRC_FOLD_BYTES:
+        # longer than any status line, a byte at a time
+        crc = 0
+        for byte in data:
+            crc = ((crc << 8) & 0xFFFF) ^ _CRC_TABLE[(crc >> 8) ^ byte]
+
+        return crc
+
+    crc = int.from_bytes(data, "big")
+    parity = crc.bit_count() & 1
+
+    # fold at bit 15 * 2^j for j = 6, 5, 4, 4, 3, 2, 1, 1 (unrolled, since this runs for every line)
+    high = crc >> 960
+    crc = (crc & _CRC_MASK_960) ^ high ^ (high << 64)
+    high = crc >> 480
+    crc = (crc & _CRC_MASK_480) ^ high ^ (high << 32)
+    high = crc >> 240
+    crc = (crc & _CRC_MASK_240) ^ high ^ (high << 16)
+    high = crc >> 240
+    crc = (crc & _CRC_MASK_240) ^ high ^ (high << 16)
+    high = crc >> 120
+    crc = (crc & _CRC_MASK_120) ^ high ^ (high << 8)
+    high = crc >> 60
+    crc = (crc & _CRC_MASK_60) ^ high ^ (high << 4)
+    high = crc >> 30
+    crc = (crc & _CRC_MASK_30) ^ high ^ (high << 2)
+    high = crc >> 30
+    crc = (crc & _CRC_MASK_30) ^ high ^ (high << 2)
+
+    crc = _CRC_FOLD_HIGH[crc >> 15] ^ _CRC_FOLD_LOW[crc & 0x7FFF]
+
+    # the remainder by x^15 + x + 1 with the wrong parity differs from the CRC by x^15 + x + 1 (which has odd parity)
+    if (crc.bit_count() & 1) != parity:
+        crc ^= _CRC_TRINOMIAL
+
+    return crc
+
+
+class StatusRecord:
+    """
+    Values of one BLR_STAT line, in the units sent by the Blue Raven
+    """
+
+    __slots__ = ("year", "month", "day", "time", "hg_x", "hg_y", "hg_z", "accel_x", "accel_y", "accel_z",
+                 "pressure", "temperature", "battery", "gyro_x", "gyro_y", "gyro_z", "tilt", "roll", "velocity",
+                 "altitude")
+
+    def __init__(self, tokens: list[bytes]):
+        (self.year, self.month, self.day, self.hg_x, self.hg_y, self.hg_z, self.accel_x, self.accel_y, self.accel_z,
+         self.pressure, self.temperature, self.battery, self.gyro_x, self.gyro_y, self.gyro_z, self.tilt, self.roll,
+         self.velocity, self.altitude) = map(_INTEGERS.__getitem__, _INTEGER_TOKENS(tokens))
+        self.time = tokens[6].decode("ascii")
+
+    def to_list(self, device: int) -> list:
+        """
+        :param device: id of the device that sent the line
+        :return: telemetry list, laid out like telemetry_handler.get_telemetry
+        """
+        return [
+            int(device),        # 0 - device ID
+            self.accel_x,       # 1 - Acceleration X
+            self.accel_y,       # 2 - Acceleration Y
+            self.accel_z,       # 3 - Acceleration Z
+            self.velocity,      # 4 - Velocity
+            self.altitude,      # 5 - Altitude
+            self.tilt,          # 6 - Tilt
+            self.roll,          # 7 - Roll
+            self.time,          # 8 - Time
+            self.battery,       # 9 - Battery
+            self.temperature,   # 10 - Temperature
+            self.pressure,      # 11 - Pressure
+            self.gyro_x,        # 12 - Gyro X
+            self.gyro_y,        # 13 - Gyro Y
+            self.gyro_z,        # 14 - Gyro Z
+            self.hg_x,          # 15 - Hi-G Acceleration X
+            self.hg_y,          # 16 - Hi-G Acceleration Y
+            self.hg_z           # 17 - Hi-G Acceleration Z
+        ]
+
+    def __repr__(self) -> str:
+        return f"StatusRecord({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+class StatusParser:
+    """
+    Parses BLR_STAT lines, keeping counts of the lines it rejects
+    """
+
+    def __init__(self, require_crc: bool = True):
+        # reject status lines that have no CRC field
+        self.require_crc = require_crc
+
+        # parser statistics
+        self.parsed = 0
+        self.crc_failures = 0
+        self.malformed = 0
+
+    def parse(self, line: bytes | str) -> StatusRecord | None:
+        """
+        Parses a status line
+        :param line: serial line, surrounding whitespace (carriage returns, newlines) is ignored
+        :return: parsed record, or None if the line is not a status line, is malformed, or fails its CRC
+        """
+        if isinstance(line, str):
+            line = line.encode("utf-8", errors="replace")
+
+        line = line.strip()
+
+        # cheap check for other line types (events, voltage readings)
+        if not line.startswith(b"@ BLR_STAT"):
+            return None
+
+        # split off the CRC
+        marker = line.rfind(_CRC_MARKER)
+
+        if marker >= 0:
+            body = line[:marker]
+        elif self.require_crc:
+            self.malformed += 1
+            return None
+        else:
+            body = line
+
+        # check the layout first, it is cheaper than the CRC
+        tokens = body.split()
+
+        if len(tokens) != STATUS_TOKENS or _LABEL_TOKENS(tokens) != _LABEL_VALUES:
+            self.malformed += 1
+            return None
+
+        if marker >= 0:
+            try:
+                crc = int(line[marker + len(_CRC_MARKER):], 16)
+            except ValueError:
+                self.malformed += 1
+                return None
+
+            if crc16(body) != crc:
+                self.crc_failures += 1
+                return None
+
+        try:
+            record = StatusRecord(tokens)
+        except (ValueError, UnicodeDecodeError):
+            self.malformed += 1
+            return None
+
+        self.parsed += 1
+
+        return record
+
+    def stats(self) -> str:
+        return f"status parser: {self.parsed} parsed, {self.crc_failures} CRC failures, {self.malformed} malformed"
+
+
+def parse_status(line: bytes | str) -> StatusRecord | None:
+    """
+    Parses a status line, requiring a valid CRC
+    :param line: serial line
+    :return: parsed record, or None if the line is not a valid status line
+    """
+    return PARSER.parse(line)
+
+
+# parser shared by the telemetry threads
+PARSER = StatusParser()
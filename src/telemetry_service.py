@@ -0,0 +1,256 @@
+# Developed By Keagan Bowman
+# asyncio runtime for Blue Raven telemetry.
+# Every serial port, simulator and synthetic device runs as a task on one event loop (in one background thread), and all of them share
+# one batched database writer, so adding flight controllers or simulators for ground testing adds neither threads nor
+# database connections.
+#
+# telemetry_service.py
+from __future__ import annotations
+
+import io
+import asyncio
+import serial
+import threading
+import db_handler
+import serial_reader
+import telemetry_store
+import telemetry_parser
+import telemetry_writer
+import telemetry_handler
+import telemetry_simulation
+from typing import Awaitable, Callable
+
+# seconds before a failed serial port is reopened, doubled after every failure in a row up to the maximum
+REOPEN_DELAY = 1.0
+MAX_REOPEN_DELAY = 30.0
+
+
+class TelemetryService:
+    """
+    Reads serial ports, pty/pipe stand-ins and simulation files from a single event loop, and publishes their lines
+    with telemetry_handler.publish_telemetry.
+
+    Streams with a file descriptor are read when the loop reports them readable (non-blocking, no threads). Where
+    the loop cannot watch a stream (ie: serial ports on Windows), the blocking read is offloaded to the loop's
+    default thread pool instead.
+
+    A source that fails is printed and counted in source_errors, and the other sources keep running. Serial ports
+    are reopened after a backoff whenever they fail or close, so an unplugged flight controller comes back once it
+    is plugged in again.
+    """
+
+    def __init__(self, writer: telemetry_writer.TelemetryWriter,
+                 store: telemetry_store.TelemetryStore = telemetry_store.STORE):
+        self.writer = writer
+        self.store = store
+
+        # (name, coroutine function, reopen on failure) started with the loop, one per source
+        self._sources: list[tuple[str, Callable[[], Awaitable[None]], bool]] = []
+        self._readers: list[serial_reader.SerialLineReader] = []
+
+        self._thread: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop: asyncio.Event | None = None
+        self._started = threading.Event()
+
+        # service statistics
+        self.lines_published = 0
+        self.source_errors = 0
+
+    def add_port(self, port: str) -> int:
+        """
+        Adds a Blue Raven serial port
+        :param port: Port where serial stream is located
+        :return: device ID of the port
+        """
+        device = telemetry_handler.register_device(port)
+
+        self._sources.append((port, lambda: self._read_port(port, device), True))
+
+        return device
+
+    def add_stream(self, stream, device: int) -> None:
+        """
+        Adds an already open stream, ie: a pty opened in raw mode as a stand-in for a flight controller
+        :param stream: object with a read(size) method, and a fileno() method to be read without a thread
+        :param device: id of the device the stream belongs to
+        """
+        self._sources.append((f"stream of device {device}", lambda: self._read_stream(stream, device), False))
+
+    def add_simulator(self, sim_file: str, name: str, speed: float = 1.0) -> int:
+        """
+        Adds a simulated Blue Raven, replaying a simulation file on its own timestamps
+        :param sim_file: Data file that contains the simulated data
+        :param name: name the simulator is registered under, ie: SIMULATOR-1
+        :param speed: replay speed (0 replays as fast as possible)
+        :return: device ID of the simulator
+        """
+        device = telemetry_handler.register_device(name)
+        trace = telemetry_simulation.load_trace(sim_file)
+
+        self._sources.append((name, lambda: self._replay(trace, device, speed), False))
+
+        return device
+
+    def add_synthetic(self, name: str, rate: float, speed: float = 1.0, seed: int = 0) -> int:
+        """
+        Adds a synthetic Blue Raven, for load testing
+        :param name: name the device is registered under, ie: SYNTHETIC-1
+        :param rate: status lines sent per second
+        :param speed: rate multiplier (0 sends as fast as possible)
+        :param seed: varies the device's flight, so devices differ
+        :return: device ID of the synthetic device
+        """
+        device = telemetry_handler.register_device(name)
+        synthetic = telemetry_simulation.SyntheticDevice(rate, seed=seed)
+
+        self._sources.append((name, lambda: self._replay(synthetic, device, speed), False))
+
+        return device
+
+    def start(self) -> None:
+        """
+        Starts the event loop thread, and every source added so far
+        """
+        self._thread = threading.Thread(target=asyncio.run, args=[self._run()], name="telemetry-service", daemon=True)
+        self._thread.start()
+
+        self._started.wait()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stops every source and the event loop, publishing the lines already read
+        :param timeout: seconds to wait for the loop to exit
+        """
+        if self._thread is None:
+            return
+
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout)
+        self._thread = None
+
+    async def _run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._started.set()
+
+        tasks = [asyncio.create_task(self._supervise(*source)) for source in self._sources]
+
+        await self._stop.wait()
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _supervise(self, name: str, source: Callable[[], Awaitable[None]], reopen: bool) -> None:
+        delay = REOPEN_DELAY
+
+        while True:
+            start = asyncio.get_running_loop().time()
+
+            try:
+                await source()
+            except Exception as e:
+                # the other sources keep running
+                self.source_errors += 1
+                print(f"Telemetry source {name} failed: {e!r}")
+
+            if not reopen:
+                return
+
+            # back off while the source keeps failing straight away, start over once it ran for a while
+            if asyncio.get_running_loop().time() - start >= MAX_REOPEN_DELAY:
+                delay = REOPEN_DELAY
+
+            print(f"Reopening telemetry source {name} in {delay:g} s")
+            await asyncio.sleep(delay)
+
+            delay = min(delay * 2, MAX_REOPEN_DELAY)
+
+    def _publish(self, device: int, data: bytes, record: telemetry_parser.StatusRecord | None = None) -> None:
+        telemetry_handler.publish_telemetry(self.writer, device, data, self.store, record)
+        self.lines_published += 1
+
+    def _drain(self, reader: serial_reader.SerialLineReader, device: int) -> None:
+        # lines are published as soon as they are read, the queue only holds one read's worth of lines
+        while (line := reader.lines.get(timeout=0)) is not None:
+            self._publish(device, line)
+
+    async def _read_port(self, port: str, device: int) -> None:
+        # non-blocking port, reads return whatever is waiting
+        conn = serial.Serial(
+            port=port,
+            baudrate=921600,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=0
+        )
+
+        # mark device as active in database
+        await asyncio.to_thread(db_handler.set_device_status, device, True)
+
+        try:
+            await self._read_stream(conn, device)
+        finally:
+            conn.close()
+
+    async def _read_stream(self, stream, device: int) -> None:
+        reader = serial_reader.SerialLineReader(stream, serial_reader.LineQueue())
+        self._readers.append(reader)
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            fd = stream.fileno()
+            readable = asyncio.Event()
+
+            loop.add_reader(fd, readable.set)
+        except (AttributeError, NotImplementedError, io.UnsupportedOperation):
+            # the loop cannot watch this stream, block in the thread pool instead
+            if isinstance(stream, serial.Serial):
+                stream.timeout = 0.1
+
+            while True:
+                await asyncio.to_thread(reader.poll)
+                self._drain(reader, device)
+
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+
+                try:
+                    reader.poll()
+                except OSError as e:
+                    # device unplugged, or the stand-in was closed
+                    self.source_errors += 1
+                    print(f"Telemetry stream for device {device} closed: {e}")
+                    return
+
+                self._drain(reader, device)
+        finally:
+            loop.remove_reader(fd)
+
+    async def _replay(self, source, device: int, speed: float) -> None:
+        # mark device as active in database
+        await asyncio.to_thread(db_handler.set_device_status, device, True)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        # send each line at its scheduled time until the service is stopped
+        for offset, data, record in source.schedule():
+            # always yield to the loop, even when running behind (or as fast as possible), so other sources still run
+            delay = start + offset / speed - loop.time() if speed > 0 else 0
+
+            await asyncio.sleep(max(delay, 0))
+
+            self._publish(device, data, record)
+
+    def stats(self) -> str:
+        dropped = sum(reader.lines.dropped for reader in self._readers)
+
+        return (f"telemetry service: {len(self._sources)} sources, {self.lines_published} lines published, "
+                f"{dropped} dropped, {self.source_errors} stream errors")
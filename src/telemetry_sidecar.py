@@ -0,0 +1,96 @@
+# Developed By Keagan Bowman
+# Telemetry sidecar for raw-only recordings.
+# Instead of encoding the overlaid video during flight, the transmitter can record only the raw video, plus this
+# append-only text file with the exact QR payload and frame marker of every recorded frame. render_overlay.py
+# rebuilds the overlaid video from the two files after the flight.
+#
+# The first line is a JSON header with the settings that determine the overlay, every other line is one recorded
+# frame, tab separated:
+#   <frame index in the raw video> <frame marker counter> <frame marker fps> <1 for a delta payload, else 0> <payload>
+#
+# telemetry_sidecar.py
+from __future__ import annotations
+
+import os
+import json
+import models
+from typing import Iterator
+
+SIDECAR_EXTENSION = ".telemetry"
+
+SIDECAR_FORMAT = 1
+
+# config values the overlaid video depends on: QR layout and size, payload size, and frame marker position
+OVERLAY_CONFIG_KEYS = (
+    "QR_MODE", "QR_PIXEL_SCALE", "QR_OVERLAY_X", "QR_OVERLAY_Y", "QR_BUFFER_SIZE_LEFT", "QR_BUFFER_SIZE_TOP",
+    "QR_BUFFER_SIZE_RIGHT", "QR_BUFFER_SIZE_BOTTOM", "QR_BORDER_SIZE", "QR_VERSION", "QR_MASK_PATTERN",
+    "QR_AGGREGATE", "QR_KEYFRAME_INTERVAL", "SIMULATE", "SIMULATION_COUNT", "BLUE_RAVEN_PORTS",
+    "FRAME_MARKER_X", "FRAME_MARKER_Y", "FRAME_MARKER_SCALE", "WIDTH", "HEIGHT", "OUTPUT_CODEC",
+)
+
+
+def sidecar_path(video_path: str) -> str:
+    """
+    :param video_path: path of a raw video
+    :return: path of the video's sidecar
+    """
+    return os.path.splitext(video_path)[0] + SIDECAR_EXTENSION
+
+
+class SidecarWriter:
+    """
+    Appends one line per recorded frame. The file is line buffered, so a crash loses at most the frame being written.
+    """
+
+    def __init__(self, path: str, config: models.Config):
+        self.path = path
+        self._file = open(path, "a", buffering=1, encoding="ascii")
+
+        header = {"format": SIDECAR_FORMAT, "config": {key: getattr(config, key) for key in OVERLAY_CONFIG_KEYS}}
+        self._file.write(json.dumps(header) + "\n")
+
+    def write(self, index: int, frame_id: int, fps: int, is_delta: bool, payload: bytes) -> None:
+        """
+        Records the overlay of one frame
+        :param index: index of the frame in the raw video
+        :param frame_id: frame marker counter
+        :param fps: frame marker fps
+        :param is_delta: whether the payload is a delta, and uses the delta QR size
+        :param payload: QR payload (alphanumeric)
+        """
+        self._file.write(f"{index}\t{frame_id}\t{fps}\t{int(is_delta)}\t{payload.decode('ascii')}\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_sidecar(path: str) -> tuple[dict, Iterator[tuple[int, int, int, bool, bytes]]]:
+    """
+    Opens a sidecar
+    :param path: sidecar path
+    :return: overlay config values, and an iterator of (index, frame_id, fps, is_delta, payload) for each frame
+    :raises ValueError: if the file is not a sidecar this version can read
+    """
+    file = open(path, "r", encoding="ascii")
+
+    try:
+        header = json.loads(file.readline())
+    except json.JSONDecodeError:
+        header = None
+
+    if not isinstance(header, dict) or header.get("format") != SIDECAR_FORMAT:
+        file.close()
+        raise ValueError(f"'{path}' is not a telemetry sidecar.")
+
+    def frames():
+        with file:
+            for line in file:
+                # a crash can leave the last line incomplete
+                if not line.endswith("\n"):
+                    break
+
+                index, frame_id, fps, is_delta, payload = line.rstrip("\n").split("\t")
+
+                yield int(index), int(frame_id), int(fps), is_delta == "1", payload.encode("ascii")
+
+    return header["config"], frames()
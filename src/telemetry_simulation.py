@@ -0,0 +1,159 @@
+# Developed By Keagan Bowman
+# Simulated Blue Raven telemetry for ground testing.
+# Simulation files are loaded and parsed once, then replayed on the timing of their own device timestamps, at any
+# speed. Synthetic devices generate valid (CRC-checked) status lines at a set rate, so ingestion and the transmitter
+# can be load tested with hundreds of virtual flight controllers and no hardware.
+#
+# telemetry_simulation.py
+from __future__ import annotations
+
+import math
+import datetime
+import telemetry_parser
+from typing import Iterator
+
+
+class SimulationTrace:
+    """
+    Status lines of a simulation file, parsed once, with the time of each line (in seconds from the first line) taken
+    from the Blue Raven's own timestamps
+    """
+
+    def __init__(self, sim_file: str):
+        self.sim_file = sim_file
+
+        parser = telemetry_parser.StatusParser(require_crc=False)
+
+        self.lines: list[bytes] = []
+        self.records: list[telemetry_parser.StatusRecord] = []
+        self.offsets: list[float] = []
+
+        start = None
+
+        # open and read file as bytes
+        with open(sim_file, "rb") as file:
+            for data in file:
+                # ensure this is ONLY telemetry data (since event data is unused right now)
+                record = parser.parse(data)
+
+                if record is None:
+                    continue
+
+                timestamp = _record_timestamp(record)
+
+                if start is None:
+                    start = timestamp
+
+                # clean data of newlines/carriage returns
+                self.lines.append(data.strip(b"\r\n"))
+                self.records.append(record)
+                self.offsets.append((timestamp - start).total_seconds())
+
+        if not self.lines:
+            raise ValueError(f"No telemetry found in simulation file '{sim_file}'.")
+
+        # time from the last line back to the first when looping, the average line interval
+        self.period = self.offsets[-1] / (len(self.offsets) - 1) if len(self.offsets) > 1 else 0.22
+        self.duration = self.offsets[-1] + self.period
+
+    def schedule(self) -> Iterator[tuple[float, bytes, telemetry_parser.StatusRecord]]:
+        """
+        Replays the trace forever
+        :return: (seconds from the start of the replay at 1x speed, line, parsed record) for each line
+        """
+        loop_start = 0.0
+
+        while True:
+            for offset, line, record in zip(self.offsets, self.lines, self.records):
+                yield loop_start + offset, line, record
+
+            loop_start += self.duration
+
+
+# traces already loaded, by file, shared by every simulator replaying the file
+_traces: dict[str, SimulationTrace] = {}
+
+
+def load_trace(sim_file: str) -> SimulationTrace:
+    """
+    Loads and parses a simulation file, once per file
+    :param sim_file: Data file that contains the simulated data
+    :return: parsed trace
+    """
+    trace = _traces.get(sim_file)
+
+    if trace is None:
+        trace = _traces[sim_file] = SimulationTrace(sim_file)
+
+    return trace
+
+
+def _record_timestamp(record: telemetry_parser.StatusRecord) -> datetime.datetime:
+    hours, minutes, seconds = record.time.split(":")
+
+    return datetime.datetime(record.year, record.month, record.day, int(hours), int(minutes)) + \
+        datetime.timedelta(seconds=float(seconds))
+
+
+class SyntheticDevice:
+    """
+    Virtual Blue Raven that sends status lines for a looping, made up flight: a boost, a coast to apogee and a
+    descent. Lines are formatted like the real device, with a valid CRC, so they go through the same parsing.
+    """
+
+    def __init__(self, rate: float = 20.0, flight_seconds: float = 120.0, apogee: int = 30000, seed: int = 0):
+        if rate <= 0:
+            raise ValueError(f"Invalid synthetic telemetry rate '{rate}'.")
+
+        self.rate = rate
+        self.flight_seconds = flight_seconds
+        self.apogee = apogee
+
+        # offset each device's flight, so devices are not all in the same phase
+        self.phase = (seed * 7.3) % flight_seconds
+
+        self.start_time = datetime.datetime.now()
+
+    def line(self, elapsed: float) -> bytes:
+        """
+        Builds the status line sent at a point in the flight
+        :param elapsed: seconds since the device started
+        :return: status line, with CRC
+        """
+        t = (elapsed + self.phase) % self.flight_seconds
+        progress = t / self.flight_seconds
+
+        # altitude rises and falls over the flight, velocity is its rate of change
+        altitude = int(self.apogee * math.sin(math.pi * progress))
+        velocity = int(self.apogee * math.pi / self.flight_seconds * math.cos(math.pi * progress))
+        accel_z = -1000 + (8000 if progress < 0.05 else 0)
+
+        timestamp = self.start_time + datetime.timedelta(seconds=elapsed)
+
+        body = (f"{timestamp:%Y %m %d %H:%M:%S}.{timestamp.microsecond // 1000:03} "
+                f"HG:{accel_z // 10:7d}{0:7d}{0:7d} "
+                f"XYZ:{0:7d}{0:7d}{accel_z:7d} "
+                f"Bo:{max(10000 - altitude // 3, 0):6d}{2500:5d} "
+                f"bt:{3300 - int(progress * 100):5d} "
+                f"gy:{0:6d}{0:6d}{0:6d} "
+                f"ang:{int(progress * 900):7d}{0:7d} "
+                f"vel{velocity:7d} "
+                f"AGL{altitude:8d}").encode("ascii")
+
+        # the length field counts the whole line, including the CRC and \r\n
+        length = len(b"@ BLR_STAT 000 ") + len(body) + len(b" CRC: 0000\r\n")
+        body = b"@ BLR_STAT %03d " % length + body
+
+        return body + b" CRC: %04X" % telemetry_parser.crc16(body)
+
+    def schedule(self) -> Iterator[tuple[float, bytes, None]]:
+        """
+        Sends lines forever, at the device's rate
+        :return: (seconds from the start at 1x speed, line, None) for each line, lines are parsed when published
+        """
+        index = 0
+
+        while True:
+            elapsed = index / self.rate
+            yield elapsed, self.line(elapsed), None
+            index += 1
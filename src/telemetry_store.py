@@ -0,0 +1,58 @@
+# Developed By Keagan Bowman
+# In-process latest-value store for Blue Raven telemetry.
+# Reader and simulator threads publish each parsed record here, and the video loop reads the latest record for a
+# device without a database round trip. Postgres only archives the raw telemetry lines.
+#
+# telemetry_store.py
+from __future__ import annotations
+
+import threading
+
+
+class TelemetryStore:
+    """
+    Latest telemetry record of every device, with a version counter per device that increases on every publish.
+    Publishing takes a lock so version counters never skip or repeat, while reads are lock-free: each device's
+    (version, record) tuple is replaced in a single assignment, so a reader always sees a matching pair.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # device ID -> (version, telemetry list)
+        self._latest: dict[int, tuple[int, list]] = {}
+
+    def publish(self, device: int, telemetry: list) -> int:
+        """
+        Replaces the latest record of a device
+        :param device: device ID
+        :param telemetry: parsed get_telemetry list for the device
+        :return: new version of the device's record
+        """
+        with self._lock:
+            version = self._latest.get(device, (0, None))[0] + 1
+            self._latest[device] = (version, telemetry)
+
+        return version
+
+    def get(self, device: int) -> tuple[int, list]:
+        """
+        :param device: device ID
+        :return: version and latest record of the device, or (0, [device ID]) if nothing was published yet
+        """
+        return self._latest.get(device, (0, [int(device)]))
+
+    def version(self, device: int) -> int:
+        """
+        :param device: device ID
+        :return: version of the device's latest record, 0 if nothing was published yet
+        """
+        return self._latest.get(device, (0, None))[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._latest.clear()
+
+
+# store shared by the telemetry threads and the video loop
+STORE = TelemetryStore()
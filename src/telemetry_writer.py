@@ -0,0 +1,198 @@
+# Developed By Keagan Bowman
+# Batched database writer for Blue Raven telemetry.
+# Telemetry threads hand their raw lines to a shared writer, which archives them in Postgres in batches, so a line
+# no longer costs its own transaction (and fsync) on the serial read path.
+#
+# telemetry_writer.py
+from __future__ import annotations
+
+import time
+import psycopg2
+import datetime
+import threading
+import db_handler
+
+
+class TelemetryWriter:
+    """
+    Buffers telemetry lines and inserts them with one statement and one commit per batch. A batch is flushed once it
+    holds max_rows lines, or once its oldest line has waited max_delay seconds, whichever comes first. Lines keep the
+    time they were added, not the time they were flushed.
+
+    Telemetry is stored in the typed data columns, and its raw line is only kept if keep_raw is set. Lines that are
+    not telemetry are always stored raw.
+
+    Corrupt serial bytes never stop the writer: bytes that are not UTF-8 are replaced, and NUL characters (which
+    Postgres rejects in text) are removed. If the database still rejects a value in a batch, the batch is written
+    row by row, so only the bad rows are lost.
+    """
+
+    def __init__(self, max_rows: int = 50, max_delay: float = 0.1, keep_raw: bool = True):
+        if max_rows < 1:
+            raise ValueError(f"Invalid telemetry batch size '{max_rows}'.")
+
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.keep_raw = keep_raw
+
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+
+        # (device ID, raw data string or None, time received, *telemetry values) waiting to be flushed
+        self._rows: list[tuple] = []
+        # monotonic time the oldest buffered row was added
+        self._oldest = 0.0
+
+        # writer statistics
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.failed_flushes = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._start_time = time.monotonic()
+
+    def start(self) -> None:
+        """
+        Starts the background flush thread
+        """
+        self._start_time = time.monotonic()
+
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, device: int, data: str | bytes, telemetry: list | None = None) -> None:
+        """
+        Buffers a telemetry line for the next batch
+        :param device: id of the device that sent the line
+        :param data: telemetry line
+        :param telemetry: parsed telemetry list of the line, or None if the line is not telemetry
+        """
+        if telemetry is not None and not self.keep_raw:
+            data = None
+        else:
+            if isinstance(data, bytes):
+                # if the data is in bytes, cast it to a string, keeping lines with corrupt bytes
+                data = data.decode("utf-8", errors="replace")
+
+            # text columns cannot hold NUL
+            data = data.replace("\x00", "")
+
+        row = (device, data, datetime.datetime.now(), *db_handler.telemetry_values(telemetry))
+
+        with self._condition:
+            if not self._rows:
+                self._oldest = time.monotonic()
+
+            self._rows.append(row)
+
+            # wake the flush thread as soon as a full batch is ready
+            if len(self._rows) >= self.max_rows:
+                self._condition.notify()
+
+    def close(self) -> None:
+        """
+        Stops the flush thread and writes every buffered line
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        # rows added after the flush thread exited
+        with self._condition:
+            rows, self._rows = self._rows, []
+
+        if rows:
+            self._flush(rows)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                # wait for a full batch, the oldest row to time out, or shutdown
+                while not self._stopping and len(self._rows) < self.max_rows:
+                    if self._rows:
+                        timeout = self._oldest + self.max_delay - time.monotonic()
+
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+
+                    self._condition.wait(timeout)
+
+                rows, self._rows = self._rows, []
+                stopping = self._stopping
+
+            # flush outside the lock, so telemetry threads can keep buffering
+            if rows:
+                self._flush(rows)
+
+            if stopping:
+                return
+
+    def _flush(self, rows: list[tuple]) -> None:
+        start = time.perf_counter()
+
+        try:
+            db_handler.add_data_batch(rows)
+        except psycopg2.DataError as e:
+            # a value the database rejects fails its whole batch, so write the rows one by one and only drop the bad
+            # ones
+            print(f"Failed to write {len(rows)} telemetry rows, retrying them one by one: {e!r}")
+            self.failed_flushes += 1
+            self._flush_rows(rows)
+            return
+        except Exception as e:
+            # drop the batch rather than the writer (any other error, ie: a database or pool error), the latest
+            # values are already in the telemetry store
+            self.rows_failed += len(rows)
+            self.failed_flushes += 1
+            print(f"Failed to write {len(rows)} telemetry rows: {e!r}")
+            return
+
+        elapsed = time.perf_counter() - start
+
+        self.rows_written += len(rows)
+        self.flushes += 1
+        self.flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _flush_rows(self, rows: list[tuple]) -> None:
+        start = time.perf_counter()
+
+        for row in rows:
+            try:
+                db_handler.add_data_batch([row])
+            except Exception as e:
+                self.rows_failed += 1
+                print(f"Dropped telemetry row of device {row[0]}: {e!r}")
+                continue
+
+            self.rows_written += 1
+
+        elapsed = time.perf_counter() - start
+
+        self.flushes += 1
+        self.flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = time.monotonic() - self._start_time
+
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def mean_flush_seconds(self) -> float:
+        return self.flush_seconds / self.flushes if self.flushes > 0 else 0.0
+
+    def stats(self) -> str:
+        return (f"telemetry writer: {self.rows_written} rows in {self.flushes} flushes "
+                f"({self.rows_per_second:.1f} rows/s), {self.mean_flush_seconds * 1000:.2f} ms mean / "
+                f"{self.max_flush_seconds * 1000:.2f} ms max flush, {self.rows_failed} rows failed in "
+                f"{self.failed_flushes} failed flushes")
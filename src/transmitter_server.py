@@ -6,15 +6,19 @@
 from __future__ import annotations
 
 import cv2
-import json
 import time
 import utils
 import models
-import qrcode
 import db_handler
-import numpy as np
+import stage_metrics
+import frame_pipeline
+import qr_renderer
+import output_sinks
 import overlay_utils
+import telemetry_codec
 import telemetry_handler
+import telemetry_writer
+import telemetry_service
 
 # load config
 config = models.Config('./config.json')
@@ -23,28 +27,16 @@ config = models.Config('./config.json')
 if config.USE_PICAM:
     from picamera2 import Picamera2
 
-# attempt to import mouse library
-try:
-    import mouse
-    USING_MOUSE_LIB = True
-except ModuleNotFoundError:
-    import subprocess
-    USING_MOUSE_LIB = False
-
 
 def main():
-    # move mouse to bottom of screen
-    if USING_MOUSE_LIB:
-        mouse.move(0, config.HEIGHT)
-    else:
-        # fall back to XTE commands
-        subprocess.run(["xte", f"mousemove 0 {config.HEIGHT}"])
-
-    # connect to database
-    db = db_handler.establish_db(False)
+    # connect to database, the telemetry threads share this pool of connections
+    db_handler.init_pool(config.DB_POOL_SIZE)
 
     # set all devices to inactive
-    db_handler.reset_device_statuses(db)
+    db_handler.reset_device_statuses()
+
+    # time spent in each stage of a frame
+    metrics = stage_metrics.StageMetrics("transmitter")
 
     # establish video feed
     if config.USE_PICAM:
@@ -62,39 +54,86 @@ def main():
 
         # start camera
         camera.start()
+    elif config.CAPTURE_LATEST_ONLY:
+        # drain the camera in the background, the capture stage reads its newest frame
+        video_stream = utils.create_latest_capture(config, metrics)
     else:
         video_stream = utils.establish_video_feed(config)
 
-    # establish output writer
-    output_writer = utils.create_video_writer(config)
+    # paced frames are recorded at the target rate. unpaced frames are recorded at the rate the camera reports, on
+    # their capture timeline, so frames dropped before the recorders do not speed up the video
+    if config.TARGET_FPS > 0 or config.USE_PICAM:
+        record_fps = None
+    else:
+        record_fps = video_stream.get(cv2.CAP_PROP_FPS)
+
+    timed = config.TARGET_FPS == 0
+
+    # record the captured video in the background. without the overlaid video, the overlay of each recorded frame
+    # goes to a telemetry sidecar instead
+    raw_only = config.USE_QR_OVERLAY and not config.RECORD_QR_VIDEO
+
+    recorders = [utils.create_video_recorder(config, sidecar=raw_only, metrics=metrics, fps=record_fps,
+                                             timed=timed)]
+
+    if config.USE_QR_OVERLAY and config.RECORD_QR_VIDEO:
+        # record the overlaid video in the background
+        recorders.append(utils.create_video_recorder(config, "qr-", "output", metrics=metrics, fps=record_fps,
+                                                     timed=timed))
 
     if config.USE_QR_OVERLAY:
-        qr_output_writer = utils.create_video_writer(config, "qr-")
-
-        # create empty QR code
-        qr = qrcode.main.QRCode(
-            version=13,  # force QR code scale
-            error_correction=qrcode.constants.ERROR_CORRECT_H,  # best error correction (up to 30%)
-            box_size=config.QR_PIXEL_SCALE,  # set pixels for each module of QR code
-            border=config.QR_BORDER_SIZE,  # set QR code border
-        )
+        # create QR renderer, sized for the telemetry payload
+        qr = utils.create_qr_renderer(config, utils.telemetry_payload_length(config))
+
+        # cache rendered QR codes, since the telemetry for a controller rarely changes between frames
+        qr_cache = qr_renderer.QRCache(qr, config.QR_CACHE_SIZE)
+
+        # delta payloads sent between keyframes are shorter, so they get their own (smaller) QR renderer
+        if config.QR_KEYFRAME_INTERVAL > 0:
+            delta_qr = utils.create_qr_renderer(config, utils.telemetry_payload_length(config, delta=True))
+            delta_qr_cache = qr_renderer.QRCache(delta_qr, config.QR_CACHE_SIZE)
+        else:
+            delta_qr_cache = qr_cache
+
+        # create telemetry encoder, which tracks keyframes between frames
+        telemetry_encoder = telemetry_codec.TelemetryEncoder(config.QR_KEYFRAME_INTERVAL, config.QR_AGGREGATE)
+
+        # create the batched writer that archives telemetry lines
+        writer = telemetry_writer.TelemetryWriter(config.TELEMETRY_BATCH_ROWS, config.TELEMETRY_BATCH_MS / 1000,
+                                                  config.TELEMETRY_KEEP_RAW)
+        writer.start()
+
+        simulation_files = ['./simulations/static-simulation.dat', './simulations/flight-simulation.dat']
 
         # begin telemetry streams
-        if not config.SIMULATE:
+        if config.TELEMETRY_ASYNC:
+            # read every port or simulator from one event loop
+            service = telemetry_service.TelemetryService(writer)
+
+            if not config.SIMULATE:
+                raven_ids = [service.add_port(port) for port in config.BLUE_RAVEN_PORTS]
+            else:
+                raven_ids = [service.add_simulator(simulation_files[i % len(simulation_files)], f"SIMULATOR-{i}",
+                                                   config.SIMULATION_SPEED)
+                             for i in range(1, config.SIMULATION_COUNT + 1)]
+
+            # synthetic load, ingested but not transmitted
+            for i in range(1, config.SYNTHETIC_COUNT + 1):
+                service.add_synthetic(f"SYNTHETIC-{i}", config.SYNTHETIC_RATE, config.SIMULATION_SPEED, seed=i)
+
+            service.start()
+        elif not config.SIMULATE:
             # get raven IDs from telemetry search
-            raven_ids = telemetry_handler.start_raven_streams(db, config.BLUE_RAVEN_PORTS)
+            raven_ids = telemetry_handler.start_raven_streams(config.BLUE_RAVEN_PORTS, writer)
         else:
             # create raven simulations
-            raven_ids = telemetry_handler.simulate_raven_streams(db, config.SIMULATION_COUNT,
-                                                                 [
-                                                                     './simulations/static-simulation.dat',
-                                                                     './simulations/flight-simulation.dat'
-                                                                 ])
+            raven_ids = telemetry_handler.simulate_raven_streams(config.SIMULATION_COUNT, simulation_files, writer,
+                                                                 config.SIMULATION_SPEED)
 
-    # set framerate tracking
+    # frames overlaid in the last full second, sent in the frame marker
     frames_in_last_second = 0
     frames_this_second = 0
-    last_sample_time = time.time()
+    last_sample_time = time.monotonic()
 
     frames_since_controller_swap = 0
 
@@ -103,76 +142,65 @@ def main():
     # set transmission id counter
     transmission_id = 0
 
-    # create viewport window
-    cv2.namedWindow("outputVideo", cv2.WINDOW_GUI_NORMAL)
-
-    # resize viewport
-    cv2.resizeWindow("outputVideo", config.WIDTH, config.HEIGHT)
-
-    # move viewport to 0, 0
-    cv2.moveWindow("outputVideo", 0, 0)
+    # frame-sized buffers for captured and overlaid frames, reused once every stage is done with a frame. sized for
+    # the overlay, display (and pace) queues, and grown to fit the recorder queues when they fill up
+    buffer_count = 2 * config.PIPELINE_QUEUE_SIZE + 3
 
-    # apply viewport placement offset
-    cv2.moveWindow("outputVideo", config.WINDOW_OFFSET_X, config.WINDOW_OFFSET_Y)
+    if config.TARGET_FPS > 0:
+        # the pace queue, and the frame the pace stage holds to duplicate
+        buffer_count += config.PIPELINE_QUEUE_SIZE + 1
+    image_pool = frame_pipeline.FrameBufferPool("capture", (config.HEIGHT, config.WIDTH, 3), buffer_count)
+    output_pool = frame_pipeline.FrameBufferPool("overlay", (config.HEIGHT, config.WIDTH, 3), buffer_count)
 
-    # begin video loop
-    while True:
+    def capture_frame(frame: frame_pipeline.Frame) -> bool:
         # load in a frame
-        if config.USE_PICAM:
-            frame = camera.capture_array()
-        else:
-            s, frame = video_stream.read()
+        with metrics.timer("capture"):
+            if config.USE_PICAM:
+                # Picamera2 returns a new array for every capture
+                frame.image = camera.capture_array()
+            else:
+                # read into a pooled buffer
+                s, image = video_stream.read(frame.attach(image_pool))
+                frame.image = image if s else None
 
         # skip failed frames
-        if frame is None:
-            continue
-
-        # write frame to video file
-        output_writer.write(frame)
-
-        if config.USE_QR_OVERLAY:
-            # reshape frame
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
-
-            # get telemetry data for this offset
-            telemetry = telemetry_handler.get_telemetry(db, raven_ids[current_raven_index])
-
-            # append fps count to telemetry
-            telemetry.append(frames_in_last_second)
-
-            # add transmission id to telemetry
-            telemetry.append(transmission_id)
+        return frame.image is not None
 
-            # clear QR code data
-            qr.clear()
+    def overlay_frame(frame: frame_pipeline.Frame) -> None:
+        nonlocal frames_in_last_second, frames_this_second, last_sample_time
+        nonlocal frames_since_controller_swap, current_raven_index, transmission_id
 
-            # add data to QR code
-            qr.add_data(json.dumps(telemetry))
+        if not config.USE_QR_OVERLAY:
+            frame.output = frame.image
+            return
 
-            # make qr code
-            qr.make()
+        with metrics.timer("telemetry"):
+            if config.QR_AGGREGATE:
+                # get telemetry data for every controller
+                telemetry = [telemetry_handler.get_telemetry(raven_id) for raven_id in raven_ids]
+            else:
+                # get telemetry data for this offset
+                telemetry = [telemetry_handler.get_telemetry(raven_ids[current_raven_index])]
 
-            # build QR image
-            qr_img = qr.make_image()
+        with metrics.timer("qr"):
+            # encode telemetry as a keyframe, or as a delta from the last keyframe
+            payload, is_delta = telemetry_encoder.encode(telemetry)
 
-            # get qr code image as numpy array
-            qr_img = np.array(qr_img, dtype=np.uint8) * 255
+            # get the rendered QR code for this payload
+            qr_img = (delta_qr_cache if is_delta else qr_cache).get(payload)
 
-            # cast color scale
-            qr_img = cv2.cvtColor(qr_img, cv2.COLOR_GRAY2RGB)
+        with metrics.timer("overlay"):
+            # reshape frame, into a pooled buffer
+            output = cv2.cvtColor(frame.image, cv2.COLOR_RGBA2RGB, dst=frame.attach(output_pool))
 
-            # add qr code
-            frame = overlay_utils.handle_overlay_request(config, "write", frame, qr_img)
-
-            # write overlayed frame to video file
-            qr_output_writer.write(frame)
-
-        # show overlaid video
-        cv2.imshow("outputVideo", frame)
-        cv2.waitKey(1)
+            # add qr code and frame sequence marker
+            frame.output = overlay_utils.overlay_telemetry(config, output, qr_img, transmission_id,
+                                                           frames_in_last_second)
+            frame.overlay = (transmission_id, frames_in_last_second, is_delta, payload)
 
         # check if a second has elapsed
-        if int(time.time() - last_sample_time) >= 1:
+        now = time.monotonic()
+        if now - last_sample_time >= 1:
             # set last seconds frames equal to this second
             frames_in_last_second = frames_this_second
 
@@ -180,7 +208,7 @@ def main():
             frames_this_second = 0
 
             # update sample time
-            last_sample_time = time.time()
+            last_sample_time = now
 
         # update frame counter
         frames_this_second += 1
@@ -196,12 +224,128 @@ def main():
             # reset frames since controller swap
             frames_since_controller_swap = 0
 
-            # increase index counter
-            current_raven_index += 1
+            # increase index counter, and reset it if needed
+            current_raven_index = (current_raven_index + 1) % len(raven_ids)
+
+    # capture -> overlay -> display, with the captured and overlaid frames recorded by background recorders.
+    # capture never waits on the overlay, and the overlay never waits on the recorders or the display
+    pipeline = frame_pipeline.FramePipeline()
 
-            # reset index if needed
-            if config.USE_QR_OVERLAY and current_raven_index == len(raven_ids):
-                current_raven_index = 0
+    overlay_queue = pipeline.queue("overlay", config.PIPELINE_QUEUE_SIZE, config.PIPELINE_DROP_POLICY)
+    display_queue = pipeline.queue("display", config.PIPELINE_QUEUE_SIZE, config.PIPELINE_DROP_POLICY)
+
+    if config.TARGET_FPS > 0:
+        # capture -> overlay -> pace -> display. the pace stage sends frames at the target rate, and every video is
+        # recorded from it, so the recordings have the same frames as the transmission and play back at its speed
+        pace_queue = pipeline.queue("pace", config.PIPELINE_QUEUE_SIZE, config.PIPELINE_DROP_POLICY)
+
+        pipeline.stage("capture", capture_frame, outputs=[overlay_queue])
+        pipeline.stage("overlay", overlay_frame, overlay_queue, [pace_queue])
+        pipeline.paced_stage("pace", config.TARGET_FPS, pace_queue,
+                             [recorder.frames for recorder in recorders] + [display_queue], metrics)
+    else:
+        if raw_only:
+            # the sidecar needs each recorded frame's overlay, so raw frames are recorded after the overlay stage
+            capture_recorders, overlay_recorders = [], recorders
+        else:
+            capture_recorders, overlay_recorders = recorders[:1], recorders[1:]
+
+        pipeline.stage("capture", capture_frame,
+                       outputs=[overlay_queue] + [recorder.frames for recorder in capture_recorders])
+        pipeline.stage("overlay", overlay_frame, overlay_queue,
+                       [recorder.frames for recorder in overlay_recorders] + [display_queue])
+
+    # open the output to the video transmitter: a window, the framebuffer, or a pipe
+    sink = output_sinks.create_sink(config)
+    sink.open()
+
+    last_stats_time = time.monotonic()
+    last_stats_frames = 0
+
+    def stats_line(seconds: float, shown: int) -> str:
+        # one line of the counters that show the transmitter falling behind, the per-stage timing is exported by the
+        # metrics exporter
+        line = (f"{shown / seconds:.1f} fps shown, {sink.errors} sink errors, "
+                f"{sum(queue.dropped for queue in pipeline.queues)} pipeline drops, ")
+
+        if not config.USE_PICAM and config.CAPTURE_LATEST_ONLY:
+            line += f"{video_stream.dropped} capture drops, "
+
+        return line + (f"{sum(recorder.encoded for recorder in recorders)} recorded, "
+                       f"{sum(recorder.dropped for recorder in recorders)} recorder drops")
+
+    # dump and serve the stage metrics
+    exporter = utils.create_metrics_exporter(config, metrics)
+
+    # begin video loop, the display stays on the main thread (the window sink's GUI calls need it)
+    pipeline.start()
+
+    try:
+        while True:
+            frame = display_queue.get(timeout=1.0)
+
+            if frame is None:
+                # the display queue is only closed if a stage failed
+                if display_queue.closed:
+                    raise RuntimeError("Frame pipeline stopped.") from pipeline.error
+
+                continue
+
+            # show overlaid video
+            with metrics.timer("display"):
+                sink.show(frame.output)
+
+            # time from capture to display
+            metrics.observe("latency", time.monotonic() - frame.captured)
+
+            # the sink has its own copy of the frame
+            frame.release()
+
+            # report the frame counters every second, if enabled
+            if config.PRINT_STATS and time.monotonic() - last_stats_time >= 1:
+                print(stats_line(time.monotonic() - last_stats_time, sink.frames - last_stats_frames))
+
+                last_stats_time = time.monotonic()
+                last_stats_frames = sink.frames
+    finally:
+        # stop capturing, then encode the frames already captured and finalize the video files
+        pipeline.stop()
+
+        if not config.USE_PICAM:
+            video_stream.release()
+
+        for recorder in recorders:
+            recorder.close()
+            print(recorder.stats())
+
+        exporter.stop()
+        sink.close()
+
+        # stage timing and pipeline stats, once
+        print(metrics.summary())
+        print(pipeline.stats())
+        print(sink.stats())
+
+        if not config.USE_PICAM and config.CAPTURE_LATEST_ONLY:
+            print(video_stream.stats())
+
+        if config.USE_QR_OVERLAY:
+            print(qr_cache.stats())
+
+            if config.QR_KEYFRAME_INTERVAL > 0:
+                print(delta_qr_cache.stats())
+                print(telemetry_encoder.stats())
+
+            # stop the telemetry streams, then write out the telemetry they buffered
+            if config.TELEMETRY_ASYNC:
+                service.stop()
+                print(service.stats())
+            else:
+                telemetry_handler.stop_streams()
+            writer.close()
+            print(writer.stats())
+
+        db_handler.close_pool()
 
 
 if __name__ == "__main__":
@@ -7,7 +7,13 @@ from __future__ import annotations
 import os
 import cv2
 import models
+import stage_metrics
 import datetime
+import qr_renderer
+import latest_capture
+import telemetry_codec
+import telemetry_sidecar
+import video_recorder
 
 
 def establish_video_feed(config: models.Config, priority_list=None) -> cv2.VideoCapture | None:
@@ -48,12 +54,12 @@ def establish_video_feed(config: models.Config, priority_list=None) -> cv2.Video
         raise "No valid camera device found."
 
 
-def create_video_writer(config: models.Config, prefix: str = "") -> cv2.VideoWriter:
+def video_path(config: models.Config, prefix: str = "") -> str:
     """
-    Create a video writer using the config resolution
-    :param config: Config object to get resolution from
+    Path for a new video, named after the current time
+    :param config: Config object to get the video extension from
     :param prefix: video name prefix
-    :return: cv2 VideoWriter object
+    :return: path inside of ./video-out/
     """
     # check if video-out directory exists
     if not os.path.exists("./video-out/"):
@@ -63,11 +69,152 @@ def create_video_writer(config: models.Config, prefix: str = "") -> cv2.VideoWri
     # create video name from current time
     video_name = datetime.datetime.now().strftime("%m-%d-%Y-%H-%M-%S")
 
+    return "./video-out/" + prefix + video_name + config.OUTPUT_EXTENSION
+
+
+def create_latest_capture(config: models.Config, metrics: stage_metrics.StageMetrics | None = None,
+                          record: bool = False) -> latest_capture.LatestFrameCapture | None:
+    """
+    Create a capture of the first camera found, drained in the background so reads return the newest frame
+    :param config: Configuration to pull resolution information from
+    :param metrics: metrics the age of every frame read is recorded to
+    :param record: record every frame of the camera to a new video, at the rate the camera reports
+    :return: started LatestFrameCapture, or None if no camera was found
+    """
+    stream = establish_video_feed(config)
+
+    if stream is None:
+        return None
+
+    writer = create_video_writer(config, fps=stream.get(cv2.CAP_PROP_FPS)) if record else None
+
+    capture = latest_capture.LatestFrameCapture(stream, metrics, writer)
+    capture.start()
+
+    return capture
+
+
+def create_video_writer(config: models.Config, prefix: str = "", path: str | None = None,
+                        fps: float | None = None) -> cv2.VideoWriter:
+    """
+    Create a video writer using the config resolution
+    :param config: Config object to get resolution and frame rate from
+    :param prefix: video name prefix
+    :param path: video path, defaults to a new video_path
+    :param fps: frame rate the video plays back at, defaults to TARGET_FPS (or 30 with pacing disabled)
+    :return: cv2 VideoWriter object
+    """
     # specify codec
     cc = cv2.VideoWriter_fourcc(*config.OUTPUT_CODEC)
 
     # open video output
-    output_writer = cv2.VideoWriter("./video-out/" + prefix + video_name + config.OUTPUT_EXTENSION, cc, 10,
+    output_writer = cv2.VideoWriter(path or video_path(config, prefix), cc, fps or config.TARGET_FPS or 30,
                                     (config.WIDTH, config.HEIGHT))
 
     return output_writer
+
+
+def create_video_recorder(config: models.Config, prefix: str = "", image: str = "image", sidecar: bool = False,
+                          metrics: stage_metrics.StageMetrics | None = None, fps: float | None = None,
+                          timed: bool = False) -> video_recorder.VideoRecorder:
+    """
+    Create a background video recorder using the config resolution and recording options
+    :param config: Config object to get resolution and recording options from
+    :param prefix: video name prefix
+    :param image: frame image that is recorded, "image" (as captured) or "output" (as transmitted)
+    :param sidecar: also write the overlay of each frame to a telemetry sidecar next to the video
+    :param metrics: metrics the encode time of each frame is recorded to
+    :param fps: frame rate the video plays back at, see create_video_writer
+    :param timed: record frames on their capture timeline at that frame rate, for frames that are not paced
+    :return: started VideoRecorder
+    """
+    fps = fps or config.TARGET_FPS or 30
+    path = video_path(config, prefix)
+    sidecar_writer = telemetry_sidecar.SidecarWriter(telemetry_sidecar.sidecar_path(path), config) if sidecar else None
+
+    recorder = video_recorder.VideoRecorder(create_video_writer(config, path=path, fps=fps), prefix + "video",
+                                            config.RECORD_QUEUE_SIZE, config.RECORD_DROP_POLICY, image,
+                                            sidecar_writer, metrics, fps if timed else None)
+    recorder.start()
+
+    return recorder
+
+
+def create_metrics_exporter(config: models.Config,
+                            metrics: stage_metrics.StageMetrics) -> stage_metrics.MetricsExporter:
+    """
+    Create the stage metrics exporter, dumping and serving metrics as configured
+    :param config: Config object to get metrics options from
+    :param metrics: stage metrics of the transmitter or receiver
+    :return: started MetricsExporter
+    """
+    exporter = stage_metrics.MetricsExporter(metrics, config.METRICS_INTERVAL, config.METRICS_FORMAT,
+                                             config.METRICS_PORT)
+    exporter.start()
+
+    return exporter
+
+
+def controller_count(config: models.Config) -> int:
+    """
+    Number of flight controllers the transmitter sends telemetry for
+    :param config: Config object to get controller options from
+    :return: number of simulated controllers, or number of configured serial ports
+    """
+    if config.SIMULATE:
+        return config.SIMULATION_COUNT
+
+    return len(config.BLUE_RAVEN_PORTS)
+
+
+def telemetry_payload_length(config: models.Config, delta: bool = False) -> int:
+    """
+    Length of the telemetry payload carried by each QR code
+    :param config: Config object to get QR options from
+    :param delta: get the length of delta payloads sent between keyframes, instead of full payloads
+    :return: payload length, in characters
+    """
+    # every controller in every frame, or one controller per frame
+    records = controller_count(config) if config.QR_AGGREGATE else 1
+
+    if config.QR_KEYFRAME_INTERVAL > 0:
+        return telemetry_codec.payload_length(records, keyframe=not delta, delta=delta)
+
+    return telemetry_codec.payload_length(records, aggregate=config.QR_AGGREGATE)
+
+
+def create_qr_renderer(config: models.Config, payload_length: int) -> qr_renderer.QRRenderer:
+    """
+    Create the QR renderer shared by the transmitter and receiver, so both agree on the QR size
+    :param config: Config object to get QR options from
+    :param payload_length: length of the alphanumeric payload that will be encoded
+    :return: QRRenderer for the configured (or smallest fitting) QR version
+    """
+    # pick the smallest QR version that fits the payload, never going below the configured version
+    version = qr_renderer.smallest_version(payload_length, 'H', alphanumeric=True, minimum=config.QR_VERSION)
+
+    return qr_renderer.QRRenderer(
+        version=version,
+        error_correction='H',  # best error correction (up to 30%)
+        mask_pattern=config.QR_MASK_PATTERN,  # fixed mask, skips mask scoring on every frame
+        box_size=config.QR_PIXEL_SCALE,  # set pixels for each module of QR code
+        border=config.QR_BORDER_SIZE,  # set QR code border
+    )
+
+
+def create_qr_renderers(config: models.Config) -> list[qr_renderer.QRRenderer]:
+    """
+    Create a QR renderer for each QR size the transmitter sends
+    :param config: Config object to get QR options from
+    :return: QRRenderers, delta payloads (the most frequent) first when keyframes are enabled
+    """
+    renderers = [create_qr_renderer(config, telemetry_payload_length(config))]
+
+    if config.QR_KEYFRAME_INTERVAL > 0:
+        delta = create_qr_renderer(config, telemetry_payload_length(config, delta=True))
+
+        # delta and keyframe payloads may share a QR version if QR_VERSION is set
+        if delta.shape != renderers[0].shape:
+            renderers.insert(0, delta)
+
+    return renderers
@@ -0,0 +1,176 @@
+# Developed By Keagan Bowman
+# Background video recording for the transmitter.
+# Each recorder encodes its frames in its own thread, fed by a bounded frame queue, so a software encode (XVID on a
+# Raspberry Pi) never holds up the frame loop. OpenCV releases the GIL while encoding, so two recorders (raw and
+# overlaid) encode in parallel on separate cores.
+#
+# video_recorder.py
+from __future__ import annotations
+
+import cv2
+import time
+import threading
+import stage_metrics
+import frame_pipeline
+import telemetry_sidecar
+
+
+class VideoRecorder:
+    """
+    Records frames to a video file from a background thread.
+
+    Frames are added without blocking. When the encoder cannot keep up and the queue is full, a frame is dropped by
+    the queue's drop policy (see frame_pipeline.DROP_POLICIES), and counted. The queue is FIFO and encoded by one
+    thread, so the frames that are recorded are in the order they were added. Closing the recorder encodes every
+    frame still queued, then finalizes the file.
+
+    With a sidecar, the overlay of every encoded frame is written to the sidecar under the frame's index in the
+    video, so the overlaid video can be rebuilt later (see render_overlay.py).
+
+    A write that fails does not stop the recorder: the error is printed once, counted, and kept in error, and the
+    next frame is recorded as usual.
+
+    Frames that are not paced (ie: TARGET_FPS set to 0) arrive at whatever rate the frames before the recorder leave
+    them at. With fps set, they are recorded on a timeline of 1 / fps from their capture times instead: a frame is
+    repeated for every interval that passed since the last one without a capture, so the video plays back at real
+    speed when frames were dropped on the way to the recorder.
+    """
+
+    def __init__(self, writer: cv2.VideoWriter, name: str, queue_size: int = 30, drop_policy: str = "oldest",
+                 image: str = "image", sidecar: telemetry_sidecar.SidecarWriter | None = None,
+                 metrics: stage_metrics.StageMetrics | None = None, fps: float | None = None):
+        """
+        :param writer: opened video writer, released by the recorder when it is closed
+        :param name: recorder name, for stats
+        :param queue_size: frames buffered for the encoder
+        :param drop_policy: "oldest" or "latest", frame dropped when the buffer is full
+        :param image: Frame attribute that is recorded, "image" (as captured) or "output" (as transmitted)
+        :param sidecar: sidecar the overlay of each frame is written to, closed by the recorder when it is closed
+        :param metrics: metrics the encode time of each frame is recorded to, as the "record <name>" stage
+        :param fps: frame rate the writer was opened at, to record frames on their capture timeline, or None to record
+            every frame once
+        """
+        self.writer = writer
+        self.name = name
+        self.image = image
+        self.sidecar = sidecar
+        self.metrics = metrics
+        self.interval = 1 / fps if fps else None
+
+        # frame_pipeline stages can write to this queue directly. when the stage stops, it closes the queue and
+        # the recorder finishes the frames already queued
+        self.frames = frame_pipeline.FrameQueue(name, queue_size, drop_policy)
+
+        self._thread = threading.Thread(target=self._run, name=f"recorder-{name}", daemon=True)
+        self._released = False
+
+        # last exception raised by the writer or sidecar, if any
+        self.error: BaseException | None = None
+
+        # recorder statistics
+        self.errors = 0
+        self.encoded = 0
+        self.duplicated = 0
+        self.encode_seconds = 0.0
+        self.max_encode_seconds = 0.0
+
+    @property
+    def dropped(self) -> int:
+        return self.frames.dropped
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def write(self, frame: frame_pipeline.Frame) -> bool:
+        """
+        Queues a frame to be recorded
+        :param frame: frame to record
+        :return: False if the frame was dropped
+        """
+        return self.frames.put(frame)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Stops accepting frames, encodes the frames already queued and finalizes the video file
+        :param timeout: seconds to wait for the queued frames to be encoded
+        """
+        self.frames.close()
+
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+        # never release the writer under a running encode
+        if self._thread.is_alive():
+            print(f"Recorder '{self.name}' did not finish within {timeout} s, the video file is not finalized.")
+            return
+
+        if not self._released:
+            self.writer.release()
+
+            if self.sidecar is not None:
+                self.sidecar.close()
+
+            self._released = True
+
+            if self.errors:
+                print(f"Recorder '{self.name}' finalized with {self.errors} failed writes, last: {self.error!r}")
+
+    def _run(self) -> None:
+        # capture time of the first frame, and the timeline intervals recorded since, with fps
+        first: float | None = None
+        slots = 0
+
+        while (frame := self.frames.get()) is not None:
+            start = time.perf_counter()
+            repeats = 1
+
+            if self.interval is not None:
+                if first is None:
+                    first = frame.captured
+
+                # the frame fills every interval up to its own, and always records at least once
+                repeats = max(1, round((frame.captured - first) / self.interval) + 1 - slots)
+                slots += repeats
+
+            try:
+                for _ in range(repeats):
+                    self.writer.write(getattr(frame, self.image))
+
+                    try:
+                        # the frame is in the video, so it takes its index even if its overlay cannot be written
+                        if self.sidecar is not None and frame.overlay is not None:
+                            self.sidecar.write(self.encoded, *frame.overlay)
+                    except Exception as e:
+                        self._failed(e)
+
+                    self.encoded += 1
+            except Exception as e:
+                # skip the frame rather than stop recording
+                self._failed(e)
+                frame.release()
+                continue
+
+            frame.release()
+
+            elapsed = time.perf_counter() - start
+            self.duplicated += repeats - 1
+            self.encode_seconds += elapsed
+            self.max_encode_seconds = max(self.max_encode_seconds, elapsed)
+
+            if self.metrics is not None:
+                self.metrics.observe(f"record {self.name}", elapsed)
+
+    def _failed(self, error: Exception) -> None:
+        # report the first failure, and count the rest
+        if self.errors == 0:
+            print(f"Recorder '{self.name}' failed to write a frame: {error!r}")
+
+        self.errors += 1
+        self.error = error
+
+    def stats(self) -> str:
+        mean = self.encode_seconds / self.encoded * 1000 if self.encoded else 0.0
+
+        return (f"{self.name} recorder: {self.encoded} encoded, {self.duplicated} duplicated, {self.dropped} dropped, "
+                f"{self.errors} failed, {len(self.frames)}/{self.frames.maxsize} queued, {mean:.2f} ms/frame "
+                f"({self.max_encode_seconds * 1000:.2f} ms max)")
@@ -0,0 +1,47 @@
+# Developed By Keagan Bowman
+# Shared test setup.
+# The modules in src/ import each other by name, as they do when run from there, so src/ goes on the import path.
+#
+# conftest.py
+from __future__ import annotations
+
+import sys
+import shutil
+import pathlib
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT / "src"))
+
+SIMULATIONS = [ROOT / "simulations" / "static-simulation.dat", ROOT / "simulations" / "flight-simulation.dat"]
+
+
+@pytest.fixture
+def config(tmp_path: pathlib.Path):
+    """
+    :return: Config loaded from a copy of config.json, so a test never rewrites the project's config
+    """
+    import models
+
+    config_path = tmp_path / "config.json"
+    shutil.copy(ROOT / "config.json", config_path)
+
+    return models.Config(str(config_path))
+
+
+@pytest.fixture(scope="session")
+def simulation_records() -> list[list]:
+    """
+    :return: status records of each simulation, in the order they were sent
+    """
+    import telemetry_parser
+
+    parser = telemetry_parser.StatusParser(require_crc=False)
+    streams = []
+
+    for sim_file in SIMULATIONS:
+        with open(sim_file, "rb") as file:
+            streams.append([record for record in map(parser.parse, file) if record is not None])
+
+    return streams
@@ -0,0 +1,113 @@
+# Developed By Keagan Bowman
+# Tests for the transmitter's frame pipeline.
+#
+# test_frame_pipeline.py
+from __future__ import annotations
+
+import cv2
+import tracemalloc
+import numpy as np
+import utils
+import qr_renderer
+import overlay_utils
+import frame_pipeline
+import telemetry_codec
+
+
+def test_pooled_frame_path_allocates_no_frames(config, simulation_records, tmp_path):
+    # the transmitter's capture -> overlay -> display steps, once warmed up, must not allocate a frame-sized array.
+    # the previous allocate-per-frame path is measured too, to show tracemalloc sees frame allocations at all
+    frames, warmup = 200, 50
+
+    shape = (config.HEIGHT, config.WIDTH, 3)
+    frame_bytes = int(np.prod(shape))
+
+    telemetry = simulation_records[0][0].to_list(1)
+    qr_cache = qr_renderer.QRCache(utils.create_qr_renderer(config, utils.telemetry_payload_length(config)))
+    encoder = telemetry_codec.TelemetryEncoder()
+
+    # stand-in for the camera: a short video, rewound when it runs out
+    camera_path = str(tmp_path / "camera.avi")
+    writer = cv2.VideoWriter(camera_path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (config.WIDTH, config.HEIGHT))
+    for _ in range(30):
+        writer.write(np.random.randint(0, 256, shape, dtype=np.uint8))
+    writer.release()
+
+    video_stream = cv2.VideoCapture(camera_path)
+
+    def run(pooled: bool) -> int:
+        # pools sized as in transmitter_server
+        buffer_count = 2 * config.PIPELINE_QUEUE_SIZE + 3
+        image_pool = frame_pipeline.FrameBufferPool("capture", shape, buffer_count)
+        output_pool = frame_pipeline.FrameBufferPool("overlay", shape, buffer_count)
+        display_queue = frame_pipeline.FrameQueue("display", config.PIPELINE_QUEUE_SIZE)
+
+        def step(sequence: int) -> None:
+            frame = frame_pipeline.Frame(sequence)
+
+            # capture stage
+            buffer = frame.attach(image_pool) if pooled else None
+            s, image = video_stream.read(buffer)
+
+            if not s:
+                video_stream.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                s, image = video_stream.read(buffer)
+
+            frame.image = image
+
+            # overlay stage
+            payload, is_delta = encoder.encode([telemetry])
+            qr_img = qr_cache.get(payload)
+
+            buffer = frame.attach(output_pool) if pooled else None
+            output = cv2.cvtColor(frame.image, cv2.COLOR_RGBA2RGB, dst=buffer)
+            frame.output = overlay_utils.overlay_telemetry(config, output, qr_img, sequence, 30)
+
+            # hand off to the display, which releases the frame once shown
+            display_queue.put(frame)
+            frame.release()
+            display_queue.get(timeout=0).release()
+
+        for sequence in range(warmup):
+            step(sequence)
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+        for sequence in range(warmup, warmup + frames):
+            step(sequence)
+
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+
+        return peak
+
+    try:
+        allocating = run(False)
+        pooled = run(True)
+    finally:
+        video_stream.release()
+
+    assert allocating >= frame_bytes, f"allocating path only grew {allocating} bytes, the test is not measuring"
+    assert pooled < frame_bytes, f"pooled path allocated {pooled} bytes, at least one frame-sized array"
+
+
+def test_buffers_return_to_their_pool_once_released():
+    pool = frame_pipeline.FrameBufferPool("test", (4, 4, 3), 2)
+    queue = frame_pipeline.FrameQueue("test", 2)
+
+    frame = frame_pipeline.Frame(0)
+    buffer = frame.attach(pool)
+
+    # the queue holds its own reference
+    queue.put(frame)
+    frame.release()
+
+    assert pool.allocated == 2 and len(pool._free) == 1
+
+    queue.get(timeout=0).release()
+
+    # and the next frame reuses it
+    assert len(pool._free) == 2
+    assert frame_pipeline.Frame(1).attach(pool) is buffer
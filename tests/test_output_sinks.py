@@ -0,0 +1,110 @@
+# Developed By Keagan Bowman
+# Tests for the headless output sinks.
+#
+# test_output_sinks.py
+from __future__ import annotations
+
+import os
+import cv2
+import time
+import pytest
+import threading
+import numpy as np
+import output_sinks
+
+WIDTH, HEIGHT = 72, 57
+
+
+def test_framebuffer_sink_rejects_unsupported_depth(tmp_path):
+    fb_path = tmp_path / "fb"
+    fb_path.write_bytes(bytes(WIDTH * HEIGHT * 3))
+
+    with pytest.raises(ValueError):
+        output_sinks.FramebufferSink(str(fb_path), WIDTH, HEIGHT, 24).open()
+
+
+@pytest.mark.parametrize("bits_per_pixel, code", [(16, cv2.COLOR_BGR2BGR565), (32, cv2.COLOR_BGR2BGRA)])
+def test_framebuffer_sink_writes_converted_frame_at_offset(tmp_path, bits_per_pixel, code):
+    # a file standing in for a framebuffer larger than the frame, with the frame offset into it
+    fb_width, fb_height, offset_x, offset_y = 80, 60, 5, 2
+    pixel_bytes = bits_per_pixel // 8
+
+    fb_path = tmp_path / "fb"
+    fb_path.write_bytes(bytes(fb_width * fb_height * pixel_bytes))
+
+    frame = np.random.randint(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+    sink = output_sinks.FramebufferSink(str(fb_path), fb_width, fb_height, bits_per_pixel, offset_x, offset_y)
+    sink.open()
+    sink.show(frame)
+    sink.close()
+
+    framebuffer = np.fromfile(fb_path, dtype=np.uint8).reshape(fb_height, fb_width, pixel_bytes)
+    region = (slice(offset_y, offset_y + HEIGHT), slice(offset_x, offset_x + WIDTH))
+
+    assert np.array_equal(framebuffer[region], cv2.cvtColor(frame, code))
+
+    # nothing is written outside of the frame
+    framebuffer[region] = 0
+    assert not framebuffer.any()
+
+    assert sink.frames == 1 and sink.errors == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs FIFOs (Linux/macOS)")
+def test_pipe_sink_survives_reader_disconnect(tmp_path):
+    fifo_path = str(tmp_path / "fifo")
+    os.mkfifo(fifo_path)
+
+    # larger than the pipe's buffer, so a write is still in progress when the reader goes away
+    frame = np.random.randint(0, 256, (576, 720, 3), dtype=np.uint8)
+
+    def read_fifo(received: list, limit: int | None = None):
+        # reads until the writer closes, or until limit bytes then disconnects
+        with open(fifo_path, "rb", buffering=0) as fifo:
+            while (limit is None or received[0] < limit) and (chunk := fifo.read(1 << 20)):
+                received[0] += len(chunk)
+
+    # reader that disconnects after one frame
+    received = [0]
+    reader = threading.Thread(target=read_fifo, args=(received, frame.nbytes), daemon=True)
+    reader.start()
+
+    sink = output_sinks.PipeSink(fifo_path)
+    sink.open()
+
+    # the writes fail once the reader is gone, and keep failing while there is no reader, without raising
+    for _ in range(5):
+        sink.show(frame)
+    reader.join(5.0)
+
+    assert sink.frames >= 1 and sink.errors >= 1
+    assert received[0] >= frame.nbytes
+
+    # a new reader is picked up by the next frame shown once it opens the FIFO
+    shown = sink.frames
+    received = [0]
+    reader = threading.Thread(target=read_fifo, args=(received,), daemon=True)
+    reader.start()
+
+    deadline = time.monotonic() + 5.0
+    while sink.frames == shown and time.monotonic() < deadline:
+        sink.show(frame)
+        time.sleep(0.001)
+
+    try:
+        assert sink.frames > shown, f"pipe sink did not reconnect to the new reader, {sink.stats()}"
+
+        # every frame reaches the new reader
+        for _ in range(10):
+            sink.show(frame)
+    finally:
+        if sink.frames == shown:
+            # release the reader still waiting for a writer
+            os.close(os.open(fifo_path, os.O_WRONLY))
+
+        sink.close()
+        reader.join(5.0)
+
+    assert received[0] == (sink.frames - shown) * frame.nbytes
+    assert sink.frames - shown == 11
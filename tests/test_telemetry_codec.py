@@ -0,0 +1,59 @@
+# Developed By Keagan Bowman
+# Tests for the QR payload codec.
+#
+# test_telemetry_codec.py
+from __future__ import annotations
+
+import pytest
+import telemetry_codec
+
+
+def frames(simulation_records: list[list], count: int) -> list[list]:
+    # the two simulations as device 1 and 2, whose clocks are minutes apart (15:22:32 and 15:29:46)
+    streams = [[record.to_list(device) for record in records]
+               for device, records in enumerate(simulation_records, start=1)]
+
+    return [list(records) for records in zip(*streams)][:count]
+
+
+def expected(records: list[list]) -> list[list]:
+    # single-record payloads carry the absolute device time, so they are the reference
+    return [telemetry_codec.decode_payload(telemetry_codec.encode_payload([record]))[0] for record in records]
+
+
+def test_base45_round_trip():
+    data = bytes(range(256))
+
+    assert telemetry_codec.base45_decode(telemetry_codec.base45_encode(data)) == data
+
+    with pytest.raises(ValueError):
+        telemetry_codec.base45_decode(b"a")
+
+
+def test_aggregate_payload_round_trips_devices_minutes_apart(simulation_records):
+    for records in frames(simulation_records, 50):
+        assert telemetry_codec.decode_payload(telemetry_codec.encode_aggregate_payload(records)) == expected(records)
+
+    assert expected(frames(simulation_records, 1)[0])[1][8] == "15:29:46.565"
+
+
+def test_keyframe_and_delta_payloads_round_trip(simulation_records):
+    encoder = telemetry_codec.TelemetryEncoder(keyframe_interval=10)
+    decoder = telemetry_codec.TelemetryDecoder()
+
+    for records in frames(simulation_records, 50):
+        payload, _ = encoder.encode(records)
+
+        assert decoder.decode(payload) == expected(records)
+
+    assert encoder.keyframes > 0 and encoder.deltas > 0
+
+
+def test_delta_without_its_keyframe_is_rejected(simulation_records):
+    encoder = telemetry_codec.TelemetryEncoder(keyframe_interval=10)
+    keyframe, delta = (encoder.encode(records) for records in frames(simulation_records, 2))
+
+    assert not keyframe[1] and delta[1]
+
+    with pytest.raises(ValueError):
+        telemetry_codec.TelemetryDecoder().decode(delta[0])
@@ -0,0 +1,65 @@
+# Developed By Keagan Bowman
+# Tests for the BLR_STAT status line parser.
+#
+# test_telemetry_parser.py
+from __future__ import annotations
+
+import random
+import pathlib
+import telemetry_parser
+
+SIMULATIONS = sorted((pathlib.Path(__file__).resolve().parent.parent / "simulations").glob("*.dat"))
+
+
+def status_lines() -> list[bytes]:
+    lines = []
+
+    for sim_file in SIMULATIONS:
+        with open(sim_file, "rb") as file:
+            lines.extend(line for line in file if line.startswith(b"@ BLR_STAT"))
+
+    return lines
+
+
+def reference_crc16(data: bytes) -> int:
+    # the plain byte-at-a-time CRC
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ telemetry_parser._CRC_TABLE[(crc >> 8) ^ byte]
+
+    return crc
+
+
+def test_crc16_matches_byte_at_a_time():
+    rng = random.Random(0)
+
+    assert telemetry_parser.crc16(b"123456789") == 0xFEE8
+
+    for length in range(300):
+        for data in (rng.randbytes(length), b"\xff" * length):
+            assert telemetry_parser.crc16(data) == reference_crc16(data)
+
+
+def test_simulation_lines_pass_their_crc():
+    lines = status_lines()
+    parser = telemetry_parser.StatusParser()
+
+    assert all(parser.parse(line) is not None for line in lines)
+    assert (parser.parsed, parser.crc_failures, parser.malformed) == (len(lines), 0, 0)
+
+
+def test_corrupt_lines_are_dropped():
+    line = status_lines()[0]
+    parser = telemetry_parser.StatusParser()
+
+    # a changed reading fails the CRC
+    assert parser.parse(line.replace(b"HG:     -3", b"HG:     -4")) is None
+    assert parser.crc_failures == 1
+
+    # a truncated line fails the layout check, before the CRC is computed
+    assert parser.parse(line.replace(b" AGL      -1", b"")) is None
+    assert (parser.crc_failures, parser.malformed) == (1, 1)
+
+    # no CRC at all
+    assert parser.parse(line.split(b" CRC: ")[0]) is None
+    assert parser.malformed == 2
@@ -0,0 +1,85 @@
+# Developed By Keagan Bowman
+# Tests for the asyncio telemetry service, with the database calls replaced.
+#
+# test_telemetry_service.py
+from __future__ import annotations
+
+import os
+import time
+import pytest
+
+pytest.importorskip("serial")
+pytest.importorskip("psycopg2")
+
+import db_handler
+import telemetry_store
+import telemetry_service
+import telemetry_handler
+
+
+class Writer:
+    def __init__(self):
+        self.lines = []
+
+    def add(self, device: int, data: bytes, telemetry: list | None = None) -> None:
+        self.lines.append((device, data))
+
+
+class FailingStream:
+    # stream without a file descriptor, read from the thread pool, whose read fails
+    def read(self, size: int) -> bytes:
+        raise RuntimeError("read failed")
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(db_handler, "set_device_status", lambda device, status: None)
+    monkeypatch.setattr(telemetry_handler, "register_device", lambda port: 1)
+    monkeypatch.setattr(telemetry_service, "REOPEN_DELAY", 0.01)
+
+    service = telemetry_service.TelemetryService(Writer(), telemetry_store.TelemetryStore())
+    yield service
+    service.stop()
+
+
+def test_failed_source_is_counted(service):
+    service.add_stream(FailingStream(), 1)
+    service.start()
+
+    assert wait_for(lambda: service.source_errors == 1)
+    assert "1 stream errors" in service.stats()
+
+
+def test_failed_port_is_reopened(service, monkeypatch):
+    read_fd, write_fd = os.pipe()
+    opened = []
+
+    def open_port(**kwargs):
+        # the port fails to open once, then opens on a pipe
+        opened.append(kwargs["port"])
+
+        if len(opened) == 1:
+            raise OSError("could not open port")
+
+        return os.fdopen(read_fd, "rb", buffering=0)
+
+    monkeypatch.setattr(telemetry_service.serial, "Serial", open_port)
+
+    service.add_port("/dev/ttyACM0")
+    service.start()
+
+    assert wait_for(lambda: len(opened) == 2)
+
+    os.write(write_fd, b"hello\r\n")
+    os.close(write_fd)
+
+    assert wait_for(lambda: service.writer.lines == [(1, b"hello")])
+    assert service.source_errors >= 1
@@ -0,0 +1,49 @@
+# Developed By Keagan Bowman
+# Tests for the batched telemetry writer, with the database calls replaced.
+#
+# test_telemetry_writer.py
+from __future__ import annotations
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import db_handler
+import telemetry_writer
+
+
+@pytest.fixture
+def batches(monkeypatch) -> list[list[tuple]]:
+    # batches written, a batch holding a "bad" line is rejected as a whole, like Postgres does
+    written = []
+
+    def add_data_batch(rows: list[tuple]) -> None:
+        if any(row[1] is not None and "bad" in row[1] for row in rows):
+            raise psycopg2.DataError("invalid value")
+
+        written.append(rows)
+
+    monkeypatch.setattr(db_handler, "add_data_batch", add_data_batch)
+
+    return written
+
+
+def test_corrupt_bytes_are_buffered_as_text(batches):
+    writer = telemetry_writer.TelemetryWriter(max_rows=10)
+
+    # a byte that is not UTF-8, and a NUL Postgres rejects in text
+    writer.add(1, b"BLR_STAT \xc7 line\x00\r\n")
+    writer.close()
+
+    assert batches[0][0][1] == "BLR_STAT � line\r\n"
+
+
+def test_rejected_row_only_drops_itself(batches):
+    writer = telemetry_writer.TelemetryWriter(max_rows=10)
+
+    for line in ("good 1", "bad", "good 2"):
+        writer.add(1, line)
+    writer.close()
+
+    assert [row[1] for rows in batches for row in rows] == ["good 1", "good 2"]
+    assert writer.rows_written == 2 and writer.rows_failed == 1